@@ -0,0 +1,109 @@
+"""
+Сравнение синхронного (ThreadPoolExecutor) и asyncio (grpc.aio) сервера
+при 1000+ одновременных клиентах. Каждый вариант запускается отдельным
+процессом на свободном порту, нагрузка идёт из одного asyncio-клиента.
+
+    python bench/aio_vs_sync.py --clients 1000 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import grpc
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PYTHON_DIR = os.path.join(PROJECT_ROOT, 'python')
+sys.path.insert(0, PYTHON_DIR)
+
+from custom_service import metrics_pb2, metrics_pb2_grpc
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def start_server(extra_args):
+    """Запускает сервер и ждёт готовности канала; возвращает (процесс, порт)."""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "custom_service.server", "--port", str(port), *extra_args],
+        cwd=PYTHON_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        grpc.channel_ready_future(channel).result(timeout=15)
+    return proc, port
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+async def run_load(port, clients, requests, channels):
+    chans = [grpc.aio.insecure_channel(f'localhost:{port}') for _ in range(channels)]
+    stubs = [metrics_pb2_grpc.VitalSignsServiceStub(c) for c in chans]
+    latencies = []
+    errors = 0
+
+    async def client(i):
+        nonlocal errors
+        stub = stubs[i % channels]
+        for k in range(requests):
+            t0 = time.perf_counter()
+            try:
+                await stub.RecordMetric(metrics_pb2.MetricRequest(
+                    user_id=f"user_{i}", type=metrics_pb2.HEART_RATE, value=60 + k % 40))
+            except grpc.aio.AioRpcError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - t0
+    for c in chans:
+        await c.close()
+
+    latencies.sort()
+    return {
+        'rps': len(latencies) / elapsed,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=1000, help="одновременных клиентов")
+    parser.add_argument('--requests', type=int, default=20, help="RecordMetric на клиента")
+    parser.add_argument('--channels', type=int, default=8, help="HTTP/2-соединений у нагрузчика")
+    parser.add_argument('--max-concurrent-rpcs', type=int, default=2000)
+    parser.add_argument('--out', default=None, help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    variants = {
+        'sync (10 threads)': [],
+        'aio': ['--aio', '--max-concurrent-rpcs', str(args.max_concurrent_rpcs)],
+    }
+    results = {}
+    print(f"{args.clients} clients x {args.requests} requests over {args.channels} channels")
+    print(f"{'server':<18} {'rps':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+
+    for name, extra in variants.items():
+        proc, port = start_server(extra)
+        try:
+            r = asyncio.run(run_load(port, args.clients, args.requests, args.channels))
+        finally:
+            proc.terminate()
+            proc.wait()
+        results[name] = r
+        print(f"{name:<18} {r['rps']:>9.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Опрос дашборда отделения: средние `--patients` пациентов по `--types`
+типам метрик. Сравнивает N унарных GetAverage подряд, N унарных
+одновременно (.future) и один BatchGetAverage; печатает JSON с медианой
+и p99 времени одного опроса и проверяет, что ответы совпадают.
+
+    python bench/batch_average.py --patients 500 --rounds 50
+"""
+import argparse
+import json
+import sys
+import time
+
+import grpc
+
+from aio_vs_sync import percentile, start_server
+
+from custom_service import metrics_pb2, metrics_pb2_grpc
+
+TYPES = [metrics_pb2.HEART_RATE, metrics_pb2.STRESS_LEVEL]
+
+def fill(stub, user_ids, types, values: int) -> None:
+    stub.RecordBatches(metrics_pb2.MetricBatch(user_id=user_id, type=metric_type,
+                                               values=[60.0 + (n + k) % 40 for k in range(values)])
+                       for n, user_id in enumerate(user_ids) for metric_type in types)
+
+def unary_sequential(stub, user_ids, types):
+    return [stub.GetAverage(metrics_pb2.AverageRequest(user_id=user_id, type=metric_type))
+            for user_id in user_ids for metric_type in types]
+
+def unary_concurrent(stub, user_ids, types):
+    calls = [stub.GetAverage.future(metrics_pb2.AverageRequest(user_id=user_id, type=metric_type))
+             for user_id in user_ids for metric_type in types]
+    return [call.result() for call in calls]
+
+def batch(stub, user_ids, types):
+    return list(stub.BatchGetAverage(metrics_pb2.BatchAverageRequest(user_ids=user_ids, types=types)).averages)
+
+def measure(fn, stub, user_ids, types, rounds: int) -> tuple[dict, list]:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        result = fn(stub, user_ids, types)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return {
+        'p50_ms': round(percentile(times, 0.5) * 1e3, 2),
+        'p99_ms': round(percentile(times, 0.99) * 1e3, 2),
+        'keys_per_s': round(len(user_ids) * len(types) / percentile(times, 0.5)),
+    }, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patients', type=int, default=500)
+    parser.add_argument('--types', type=int, default=1, choices=range(1, len(TYPES) + 1),
+                        help="сколько типов метрик опрашивать на пациента")
+    parser.add_argument('--values', type=int, default=10, help="измерений на ключ перед опросом")
+    parser.add_argument('--rounds', type=int, default=50, help="опросов на вариант")
+    parser.add_argument('--server-args', default="", help="доп. аргументы сервера, например \"--aio\"")
+    args = parser.parse_args()
+
+    user_ids = [f"patient_{n}" for n in range(args.patients)]
+    types = TYPES[:args.types]
+    proc, port = start_server(['--log-sample', '0', *args.server_args.split()])
+    try:
+        stub = metrics_pb2_grpc.VitalSignsServiceStub(grpc.insecure_channel(f'localhost:{port}'))
+        fill(stub, user_ids, types, args.values)
+        results, answers = {}, {}
+        for name, fn in (('unary_sequential', unary_sequential), ('unary_concurrent', unary_concurrent),
+                         ('batch', batch)):
+            # Прогрев: каналы, потоки пула, кэши
+            fn(stub, user_ids, types)
+            results[name], answers[name] = measure(fn, stub, user_ids, types, args.rounds)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    ok = answers['batch'] == answers['unary_sequential'] == answers['unary_concurrent']
+    print(json.dumps({'patients': args.patients, 'types': len(types), 'rounds': args.rounds, **results}, indent=2))
+    print("PASSED" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Скорость выгрузки сырых значений через ExportSamples: поднимает сервер
+с длинным сырым хвостом, заливает `--users` × `--values` измерений через
+RecordBatches и выгружает всё одним потоком. Сверяет число значений и
+их сумму с отправленным; печатает JSON с пропускной способностью.
+
+    python bench/export_samples.py --users 200 --values 10000
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from array import array
+
+import grpc
+
+from aio_vs_sync import start_server
+
+from custom_service import metrics_pb2, metrics_pb2_grpc
+
+def fill(stub, users: int, values: int, seed: int) -> tuple[int, float]:
+    rng = random.Random(seed)
+    start = int(time.time()) - values
+    total = 0.0
+
+    def batches():
+        nonlocal total
+        for u in range(users):
+            vs = [rng.uniform(50, 150) for _ in range(values)]
+            total += math.fsum(vs)
+            yield metrics_pb2.MetricBatch(user_id=f"user_{u}", type=metrics_pb2.HEART_RATE, values=vs,
+                                          timestamps=range(start, start + values))
+
+    response = stub.RecordBatches(batches())
+    return response.accepted, total
+
+def export(stub, chunk: int) -> tuple[int, float, int, int]:
+    """Выгружает всё; возвращает (значений, сумма, сообщений, байт)."""
+    count, total, messages, size = 0, 0.0, 0, 0
+    for part in stub.ExportSamples(metrics_pb2.ExportRequest(chunk_samples=chunk)):
+        timestamps, values = array('q'), array('d')
+        timestamps.frombytes(part.timestamps)
+        values.frombytes(part.values)
+        if len(timestamps) != len(values):
+            raise ValueError(f"{part.user_id}: column length mismatch")
+        count += len(values)
+        total += math.fsum(values)
+        messages += 1
+        size += len(part.timestamps) + len(part.values)
+    return count, total, messages, size
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--values', type=int, default=10000, help="измерений на пользователя")
+    parser.add_argument('--chunk', type=int, default=0, help="chunk_samples запроса (0 — по умолчанию сервера)")
+    parser.add_argument('--server-args', default="", help="доп. аргументы сервера, например \"--aio\"")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    proc, port = start_server(['--raw-tail', str(args.values), '--log-sample', '0', *args.server_args.split()])
+    try:
+        channel = grpc.insecure_channel(f'localhost:{port}', options=[
+            ('grpc.max_receive_message_length', -1)])
+        stub = metrics_pb2_grpc.VitalSignsServiceStub(channel)
+
+        t0 = time.perf_counter()
+        accepted, sent_total = fill(stub, args.users, args.values, args.seed)
+        fill_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        count, total, messages, size = export(stub, args.chunk)
+        export_s = time.perf_counter() - t0
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    ok = count == accepted == args.users * args.values and abs(total - sent_total) <= 1e-9 * abs(sent_total)
+    print(json.dumps({
+        'users': args.users,
+        'values_per_user': args.values,
+        'fill_s': round(fill_s, 3),
+        'exported': count,
+        'messages': messages,
+        'export_s': round(export_s, 3),
+        'samples_per_s': round(count / export_s),
+        'mb_per_s': round(size / export_s / 1e6, 1),
+    }, indent=2))
+    print("PASSED" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
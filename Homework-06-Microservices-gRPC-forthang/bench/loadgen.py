@@ -0,0 +1,192 @@
+"""
+Нагрузочный генератор для VitalSignsService: M процессов × K одновременных
+потоков запросов (asyncio-корутин), смесь RecordMetric / GetAverage по
+`--users` пользователям. Латентности собираются в HDR-гистограммы
+(логарифмические корзины с фиксированной относительной точностью),
+которые складываются между процессами. Результат — JSON.
+
+    # поднять Python-сервер самому (sync или --aio) и нагрузить его
+    python bench/loadgen.py --server sync --procs 4 --streams 64 --duration 10
+    python bench/loadgen.py --server aio --query-ratio 0.3 --out logs/aio.json
+    # уже запущенный сервер (например, C++ из cpp/)
+    python bench/loadgen.py --target localhost:50051 --users 100000
+
+С `--rate` нагрузка открытая: запросы планируются по расписанию и
+латентность считается от запланированного момента, а не от фактической
+отправки (без coordinated omission).
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+import grpc
+
+from aio_vs_sync import start_server
+
+from custom_service import metrics_pb2, metrics_pb2_grpc
+from custom_service.stats import PERCENTILES, Histogram
+
+SERVERS = {
+    'sync': [],
+    'aio': ['--aio'],
+}
+OPS = ('record', 'query')
+
+async def _load(proc_id: int, args) -> dict:
+    """Один процесс: `streams` корутин на `channels` каналах в течение warmup + duration."""
+    channels = [grpc.aio.insecure_channel(args.target) for _ in range(args.channels)]
+    stubs = [metrics_pb2_grpc.VitalSignsServiceStub(c) for c in channels]
+    hists = {op: Histogram() for op in OPS}
+    errors = {op: 0 for op in OPS}
+    codes = {}
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+    # Открытая нагрузка: каждая корутина шлёт запрос раз в interval секунд
+    interval = args.procs * args.streams / args.rate if args.rate else 0.0
+
+    async def stream(k: int):
+        rng = random.Random(f"{args.seed}-{proc_id}-{k}")
+        stub = stubs[k % len(stubs)]
+        scheduled = start + rng.random() * interval
+        while True:
+            if interval:
+                delay = scheduled - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                t0 = scheduled
+                scheduled += interval
+            else:
+                t0 = loop.time()
+            if t0 >= stop_at:
+                return
+
+            user_id = f"user_{rng.randrange(args.users)}"
+            op = 'query' if rng.random() < args.query_ratio else 'record'
+            try:
+                if op == 'record':
+                    await stub.RecordMetric(metrics_pb2.MetricRequest(
+                        user_id=user_id, type=metrics_pb2.HEART_RATE, value=rng.uniform(50, 150)))
+                else:
+                    await stub.GetAverage(metrics_pb2.AverageRequest(
+                        user_id=user_id, type=metrics_pb2.HEART_RATE))
+                failed = None
+            except grpc.aio.AioRpcError as e:
+                failed = e.code().name
+            if t0 < measure_from:
+                continue
+            if failed:
+                errors[op] += 1
+                codes[failed] = codes.get(failed, 0) + 1
+            else:
+                hists[op].record(int((loop.time() - t0) * 1e6))
+
+    await asyncio.gather(*(stream(k) for k in range(args.streams)))
+    for c in channels:
+        await c.close()
+    return {
+        'hist': {op: hists[op].counts for op in OPS},
+        'errors': errors,
+        'codes': codes,
+    }
+
+def _worker(proc_id: int, args, results) -> None:
+    results.put(asyncio.run(_load(proc_id, args)))
+
+def summarize(hist: Histogram, errors: int, duration: float) -> dict:
+    out = {
+        'count': hist.total,
+        'errors': errors,
+        'rps': hist.total / duration,
+        'mean_us': round(hist.mean(), 1),
+    }
+    for name, q in PERCENTILES.items():
+        out[name] = hist.percentile(q)
+    out['max_us'] = hist.percentile(1.0)
+    return out
+
+def run(args) -> dict:
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(i, args, results)) for i in range(args.procs)]
+    for p in procs:
+        p.start()
+    parts = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    report = {}
+    total = Histogram()
+    total_errors = 0
+    codes = {}
+    for op in OPS:
+        hist = Histogram()
+        for part in parts:
+            hist.merge(Histogram(counts=part['hist'][op]))
+        errors = sum(part['errors'][op] for part in parts)
+        report[op] = summarize(hist, errors, args.duration)
+        report[op]['histogram'] = hist.buckets()
+        total.merge(hist)
+        total_errors += errors
+    for part in parts:
+        for code, n in part['codes'].items():
+            codes[code] = codes.get(code, 0) + n
+    report['total'] = summarize(total, total_errors, args.duration)
+    report['error_codes'] = codes
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный генератор VitalSignsService")
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--target', default=None, help="адрес уже запущенного сервера, host:port")
+    where.add_argument('--server', choices=sorted(SERVERS), default='sync',
+                       help="запустить Python-сервер на свободном порту")
+    parser.add_argument('--server-args', default="", help="доп. аргументы сервера, например \"--workers 32\"")
+    parser.add_argument('--procs', type=int, default=4, help="процессов-нагрузчиков (M)")
+    parser.add_argument('--streams', type=int, default=32, help="одновременных запросов на процесс (K)")
+    parser.add_argument('--channels', type=int, default=2, help="HTTP/2-соединений на процесс")
+    parser.add_argument('--users', type=int, default=1000, help="число различных user_id")
+    parser.add_argument('--query-ratio', type=float, default=0.1, help="доля GetAverage в смеси")
+    parser.add_argument('--rate', type=float, default=None, help="целевой суммарный RPS (открытая нагрузка)")
+    parser.add_argument('--duration', type=float, default=10.0, help="секунд измерения")
+    parser.add_argument('--warmup', type=float, default=2.0, help="секунд прогрева (не учитываются)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help="сохранить JSON в файл (иначе — в stdout)")
+    args = parser.parse_args()
+
+    proc = None
+    if args.target is None:
+        proc, port = start_server(SERVERS[args.server] + args.server_args.split())
+        args.target = f"localhost:{port}"
+    try:
+        report = run(args)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    config = {k: v for k, v in vars(args).items() if k != 'out'}
+    if proc is None:
+        config['server'] = None
+    result = {'config': config, 'results': report}
+
+    t = report['total']
+    print(f"{args.target} ({config['server'] or 'external'}): {t['rps']:.0f} rps, "
+          f"p50 {t['p50_us'] / 1000:.2f} ms, p99 {t['p99_us'] / 1000:.2f} ms, "
+          f"p99.9 {t['p999_us'] / 1000:.2f} ms, errors {t['errors']}", file=sys.stderr)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
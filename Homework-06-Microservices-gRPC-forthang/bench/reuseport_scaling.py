@@ -0,0 +1,69 @@
+"""
+Масштабирование многопроцессного сервера (custom_service.multiproc):
+для каждого числа процессов поднимается кластер на одном порту
+(SO_REUSEPORT) и нагружается bench/loadgen.py. Нагрузчик работает на той
+же машине, поэтому под него стоит оставить часть ядер.
+
+    python bench/reuseport_scaling.py --procs 1 2 4 --clients 4 --duration 10 --out logs/scaling.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import grpc
+
+from aio_vs_sync import PYTHON_DIR, free_port
+from loadgen import run
+
+def start_cluster(procs):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "custom_service.multiproc", "--port", str(port), "--procs", str(procs)],
+        cwd=PYTHON_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        grpc.channel_ready_future(channel).result(timeout=30)
+    return proc, port
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--procs', type=int, nargs='+', default=[1, 2, 4], help="числа процессов сервера")
+    parser.add_argument('--clients', type=int, default=4, help="процессов нагрузчика")
+    parser.add_argument('--streams', type=int, default=32)
+    parser.add_argument('--channels', type=int, default=4,
+                        help="соединений на процесс нагрузчика; SO_REUSEPORT делит именно соединения")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--query-ratio', type=float, default=0.1)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args()
+
+    print(f"cpu cores: {os.cpu_count()}")
+    print(f"{'procs':>5} {'rps':>9} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    results = {}
+    for n in args.procs:
+        proc, port = start_cluster(n)
+        load = argparse.Namespace(target=f"localhost:{port}", procs=args.clients, streams=args.streams,
+                                  channels=args.channels, users=args.users, query_ratio=args.query_ratio,
+                                  rate=None, duration=args.duration, warmup=args.warmup, seed=n)
+        try:
+            report = run(load)
+        finally:
+            proc.terminate()
+            proc.wait()
+        t = report['total']
+        results[n] = t
+        base = results[args.procs[0]]['rps']
+        print(f"{n:>5} {t['rps']:>9.0f} {t['rps'] / base:>8.2f} {t['p50_us'] / 1000:>8.2f} "
+              f"{t['p99_us'] / 1000:>8.2f} {t['errors']:>7}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'args': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Проверка роутера на локальном кластере: поднимает N серверов на разных
+портах, пишет данные через Router (пачки раскладываются по узлам),
+добавляет и удаляет узел и сверяет, что средние всех пользователей не
+изменились, а переехала примерно 1/N часть ключей. Во время переноса
+отдельный поток продолжает писать, и его записи тоже сверяются.
+
+    python bench/router_cluster.py --nodes 3 --users 5000
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+
+from aio_vs_sync import free_port, start_server
+
+from custom_service import metrics_pb2
+from custom_service.router import Router
+
+def check(router, expected) -> int:
+    """Число пользователей, чьё среднее или количество разошлось с ожидаемым."""
+    bad = 0
+    for user_id, values in expected.items():
+        r = router.get_average(metrics_pb2.AverageRequest(user_id=user_id, type=metrics_pb2.HEART_RATE))
+        if r.count != len(values) or abs(r.average_value - statistics.fmean(values)) > 1e-9:
+            bad += 1
+    return bad
+
+def distribution(router, users) -> dict:
+    counts = {node: 0 for node in router.ring.nodes}
+    for user_id in users:
+        counts[router.ring.node_for(user_id)] += 1
+    return counts
+
+class Writer(threading.Thread):
+    """Пишет по одному измерению через router.record, пока идёт перенос; expected пополняется."""
+
+    def __init__(self, router, expected, prefix, users=200):
+        super().__init__(daemon=True)
+        self.router, self.expected, self.prefix, self.users = router, expected, prefix, users
+        self.stop = threading.Event()
+
+    def run(self):
+        rng = random.Random(self.prefix)
+        i = 0
+        while not self.stop.is_set():
+            user_id, value = f"{self.prefix}_{i % self.users}", rng.uniform(50, 150)
+            self.router.record(metrics_pb2.MetricRequest(user_id=user_id, type=metrics_pb2.HEART_RATE, value=value))
+            self.expected.setdefault(user_id, []).append(value)
+            i += 1
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.join()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--values', type=int, default=5, help="измерений на пользователя")
+    parser.add_argument('--vnodes', type=int, default=128)
+    args = parser.parse_args()
+
+    admins = [f"localhost:{free_port()}" for _ in range(args.nodes + 1)]
+    servers = [start_server(['--admin-address', admin]) for admin in admins]
+    addrs = [f"localhost:{port},{admin}" for (_, port), admin in zip(servers, admins)]
+    report = {}
+    try:
+        router = Router(addrs[:-1], args.vnodes)
+        rng = random.Random(0)
+        expected = {f"user_{i}": [rng.uniform(50, 150) for _ in range(args.values)] for i in range(args.users)}
+        batches = [metrics_pb2.MetricBatch(user_id=u, type=metrics_pb2.HEART_RATE, values=v)
+                   for u, v in expected.items()]
+        t0 = time.perf_counter()
+        accepted, rejected = router.record_batches(batches)
+        report['ingest'] = {'accepted': accepted, 'rejected': rejected, 'seconds': time.perf_counter() - t0}
+        report['before'] = {'distribution': distribution(router, expected), 'mismatches': check(router, expected)}
+
+        t0 = time.perf_counter()
+        with Writer(router, expected, "live_add"):
+            moved = router.add_node(addrs[-1])
+        report['add_node'] = {'moved': moved, 'moved_fraction': moved / args.users,
+                              'ideal_fraction': 1 / (args.nodes + 1), 'seconds': time.perf_counter() - t0,
+                              'distribution': distribution(router, expected), 'mismatches': check(router, expected)}
+
+        with Writer(router, expected, "live_remove"):
+            moved = router.remove_node(addrs[0])
+        report['remove_node'] = {'moved': moved, 'moved_fraction': moved / args.users,
+                                 'distribution': distribution(router, expected),
+                                 'mismatches': check(router, expected)}
+    finally:
+        for proc, _ in servers:
+            proc.terminate()
+            proc.wait()
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    ok = all(report[k]['mismatches'] == 0 for k in ('before', 'add_node', 'remove_node'))
+    print("[+] Router cluster check PASSED" if ok else "[-] Router cluster check FAILED", file=sys.stderr)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,11 @@
 #!/usr/bin/env python
 
+import os
+import sys
+
+# Сгенерированный metrics_pb2_grpc импортирует metrics_pb2 как модуль
+# верхнего уровня, поэтому папка пакета должна быть в sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 from . import client
 from . import server
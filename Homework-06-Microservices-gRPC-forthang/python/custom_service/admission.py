@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+import grpc
+
+from custom_service.stats import HANDLER_KINDS
+
+# Чтение — приоритетный класс; остальные методы, кроме EXEMPT, — записи
+READ_METHODS = frozenset({'GetAverage', 'BatchGetAverage', 'GetPercentiles'})
+# Не ограничиваются: долгие подписки и наблюдение (перенос данных идёт через отдельный ClusterAdminService)
+EXEMPT_METHODS = frozenset({'WatchAverage', 'GetStats'})
+# Стандартный заголовок gRPC: клиентская политика повторов ждёт столько миллисекунд
+PUSHBACK_KEY = 'grpc-retry-pushback-ms'
+
+class AdmissionController:
+    """
+    Адаптивный лимит одновременных RPC (AIMD по латентности).
+
+    Латентность RPC — от прихода в сервер (включая очередь пула) до
+    ответа. Ответ медленнее `target` секунд уменьшает лимит в `backoff`
+    раз (не чаще раза за `target`), быстрый ответ при загруженном лимите
+    увеличивает его на 1/limit — примерно +1 за «оборот» лимита.
+
+    Запрос отклоняется сразу, если он уже прождал в очереди дольше
+    target (как в CoDel: ответ всё равно опоздал; потоковая запись под
+    эту проверку не попадает) или если заняты все
+    места его класса. Записям доступна только доля (1 - read_reserve)
+    лимита, так что чтения проходят, когда записи уже отбрасываются;
+    для чтений и порог ожидания вдвое больше.
+    """
+
+    def __init__(self, target: float = 0.02, initial_limit: int = 16, min_limit: int = 1,
+                 max_limit: int = 256, backoff: float = 0.9, read_reserve: float = 0.25):
+        self.target = target
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.read_reserve = read_reserve
+        self.in_flight = 0
+        self.latency = 0.0  # EWMA латентности принятых запросов, секунды
+        self.rejected = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def admit(self, read: bool, waited: float) -> bool:
+        with self._lock:
+            scale = 2.0 if read else 1.0
+            room = self.limit if read else self.limit * (1.0 - self.read_reserve)
+            if waited > self.target * scale or self.in_flight >= max(1.0, room):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, sample: bool = True) -> None:
+        """sample=False — не учитывать латентность (потоковые RPC длятся сколько угодно)."""
+        with self._lock:
+            self.in_flight -= 1
+            if not sample:
+                return
+            self.latency += 0.1 * (latency - self.latency)
+            now = time.monotonic()
+            if latency > self.target:
+                if now - self._last_decrease >= self.target:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif self.in_flight >= self.limit / 2:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def retry_after_ms(self) -> int:
+        """Подсказка клиенту: примерно время, за которое освободится лимит."""
+        return int(min(1000.0, max(10.0, 2000.0 * max(self.latency, self.target))))
+
+def _reject(context, controller: AdmissionController):
+    delay = controller.retry_after_ms()
+    context.set_trailing_metadata(((PUSHBACK_KEY, str(delay)),))
+    return f"server overloaded, retry in {delay} ms"
+
+def _queued(handler, arrived: float):
+    """
+    Сколько RPC прождал до обработчика. Для потоковой записи (RecordMetrics,
+    RecordBatches) — всегда 0: время с открытия стрима включает и то, как
+    медленно клиент отдаёт сообщения, а это не очередь сервера. Лимит
+    одновременных RPC для них по-прежнему действует.
+    """
+    if handler.request_streaming:
+        return lambda: 0.0
+    return lambda: time.monotonic() - arrived
+
+class AdmissionInterceptor(grpc.ServerInterceptor):
+    """
+    Перехватчик синхронного сервера. intercept_service вызывается в потоке
+    приёма ещё до очереди пула — там засекается время прихода; решение
+    принимается уже в потоке пула, где гарантированно будет и release.
+    """
+
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        if handler is None or method in EXEMPT_METHODS:
+            return handler
+        arrived = time.monotonic()
+        controller = self.controller
+        read = method in READ_METHODS
+        unary = not (handler.request_streaming or handler.response_streaming)
+        name, factory = HANDLER_KINDS[handler.request_streaming, handler.response_streaming]
+        behavior = getattr(handler, name)
+        queued = _queued(handler, arrived)
+
+        if handler.response_streaming:
+            def wrapped(request, context):
+                if not controller.admit(read, queued()):
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _reject(context, controller))
+                try:
+                    yield from behavior(request, context)
+                finally:
+                    controller.release(time.monotonic() - arrived, unary)
+        else:
+            def wrapped(request, context):
+                if not controller.admit(read, queued()):
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _reject(context, controller))
+                try:
+                    return behavior(request, context)
+                finally:
+                    controller.release(time.monotonic() - arrived, unary)
+
+        return factory(wrapped, request_deserializer=handler.request_deserializer,
+                       response_serializer=handler.response_serializer)
+
+class AsyncAdmissionInterceptor(grpc.aio.ServerInterceptor):
+    """То же для grpc.aio; «очередь» здесь — ожидание своей очереди в event loop."""
+
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        if handler is None or method in EXEMPT_METHODS:
+            return handler
+        arrived = time.monotonic()
+        controller = self.controller
+        read = method in READ_METHODS
+        unary = not (handler.request_streaming or handler.response_streaming)
+        name, factory = HANDLER_KINDS[handler.request_streaming, handler.response_streaming]
+        behavior = getattr(handler, name)
+        queued = _queued(handler, arrived)
+
+        if handler.response_streaming:
+            async def wrapped(request, context):
+                if not controller.admit(read, queued()):
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _reject(context, controller))
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                finally:
+                    controller.release(time.monotonic() - arrived, unary)
+        else:
+            async def wrapped(request, context):
+                if not controller.admit(read, queued()):
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _reject(context, controller))
+                try:
+                    return await behavior(request, context)
+                finally:
+                    controller.release(time.monotonic() - arrived, unary)
+
+        return factory(wrapped, request_deserializer=handler.request_deserializer,
+                       response_serializer=handler.response_serializer)
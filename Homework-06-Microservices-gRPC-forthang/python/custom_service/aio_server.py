@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import asyncio
+
+import grpc
+
+import metrics_pb2_grpc
+
+from custom_service.admission import AdmissionController, AsyncAdmissionInterceptor
+from custom_service.asynclog import AsyncLog
+from custom_service.server import (STREAM_CHUNK, WATCH_INTERVAL, VitalSignsServicer, batch_response,
+                                   stats_response)
+from custom_service.stats import AsyncStatsInterceptor, ServerStats
+from custom_service.storage import MetricStorage
+
+class AsyncVitalSignsServicer(metrics_pb2_grpc.VitalSignsServiceServicer):
+    """
+    Вариант сервиса на grpc.aio: все RPC обслуживаются корутинами в одном
+    event loop, без пула потоков. Хранилище — тот же MetricStorage, что и
+    у синхронного сервера; мьютексы полос здесь не конкурируют и почти
+    ничего не стоят.
+    """
+
+    def __init__(self, storage: MetricStorage | None = None, stats: ServerStats | None = None,
+                 log: AsyncLog | None = None, watch_interval: float = WATCH_INTERVAL):
+        # Унарные методы не блокируют, поэтому переиспользуем синхронную логику
+        self._sync = VitalSignsServicer(storage, stats, log, watch_interval)
+        self.storage = self._sync.storage
+        self.stats = self._sync.stats
+
+    async def RecordMetric(self, request, context):
+        return self._sync.RecordMetric(request, context)
+
+    async def GetAverage(self, request, context):
+        return self._sync.GetAverage(request, context)
+
+    async def BatchGetAverage(self, request, context):
+        try:
+            return self._sync.batch_average(request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    async def WatchAverage(self, request, context):
+        # Подписчик — корутина, а не поток: тысячи подписок стоят только памяти
+        key = (request.user_id, request.type)
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        changed.set()
+
+        def wake():
+            # Запись может прийти и не из потока event loop
+            loop.call_soon_threadsafe(changed.set)
+
+        self.storage.watchers.subscribe(key, wake)
+        try:
+            while True:
+                await changed.wait()
+                changed.clear()
+                yield self._sync.GetAverage(request, context)
+                await asyncio.sleep(self._sync.watch_interval)
+        finally:
+            self.storage.watchers.unsubscribe(key, wake)
+
+    async def GetPercentiles(self, request, context):
+        try:
+            return self._sync.percentiles(request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    async def ExportSamples(self, request, context):
+        # Копирование срезов под мьютексом полосы короткое, event loop почти не блокируется
+        for chunk in self._sync.ExportSamples(request, context):
+            yield chunk
+
+    async def GetStats(self, request, context):
+        return stats_response(self.stats.snapshot())
+
+    async def RecordMetrics(self, request_iterator, context):
+        accepted = rejected = 0
+        chunk = []
+        async for request in request_iterator:
+            chunk.append(request)
+            if len(chunk) >= STREAM_CHUNK:
+                ok, bad = self._sync.ingest_requests(chunk)
+                accepted, rejected, chunk = accepted + ok, rejected + bad, []
+        ok, bad = self._sync.ingest_requests(chunk)
+        return batch_response(accepted + ok, rejected + bad)
+
+    async def RecordBatches(self, request_iterator, context):
+        accepted = rejected = 0
+        async for batch in request_iterator:
+            ok, bad = self._sync.ingest_batch(batch)
+            accepted, rejected = accepted + ok, rejected + bad
+        return batch_response(accepted, rejected)
+
+async def serve_async(port: str = "50051", maximum_concurrent_rpcs: int | None = None,
+                      storage: MetricStorage | None = None, stats: ServerStats | None = None,
+                      log: AsyncLog | None = None, watch_interval: float = WATCH_INTERVAL,
+                      admission: AdmissionController | None = None):
+    servicer = AsyncVitalSignsServicer(storage, stats, log, watch_interval)
+    interceptors = [AsyncStatsInterceptor(servicer.stats)]
+    if admission is not None:
+        interceptors.append(AsyncAdmissionInterceptor(admission))
+    server = grpc.aio.server(interceptors=interceptors, maximum_concurrent_rpcs=maximum_concurrent_rpcs)
+    metrics_pb2_grpc.add_VitalSignsServiceServicer_to_server(servicer, server)
+    server.add_insecure_port('[::]:' + port)
+
+    print(f"Async server started, listening on {port} (max concurrent RPCs: {maximum_concurrent_rpcs or 'unlimited'})")
+
+    await server.start()
+    await server.wait_for_termination()
+
+if __name__ == '__main__':
+    asyncio.run(serve_async())
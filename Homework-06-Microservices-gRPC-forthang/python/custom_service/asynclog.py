@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import itertools
+import sys
+import threading
+import time
+from collections import deque
+
+class AsyncLog:
+    """
+    Лог без работы в потоке запроса: log() кладёт в очередь кортеж
+    (время, формат, аргументы), а фоновый поток раз в `interval` секунд
+    форматирует накопленное и пишет одним write. Пишется каждая
+    `sample`-я запись (0 — ничего); если в очереди уже `capacity`
+    записей, новая отбрасывается и учитывается в `dropped`.
+    """
+
+    def __init__(self, stream=None, sample: int = 1, capacity: int = 65536, interval: float = 0.1):
+        self.stream = stream if stream is not None else sys.stdout
+        self.sample = sample
+        self.capacity = capacity
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        # next() у itertools.count атомарен под GIL — счётчик выборки без мьютекса
+        self._seen = itertools.count()
+        self._queue = deque()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="async-log", daemon=True)
+        self._thread.start()
+
+    def log(self, fmt: str, *args) -> None:
+        if not self.sample or next(self._seen) % self.sample:
+            return
+        # len и append без общего мьютекса: очередь может чуть превысить capacity
+        if len(self._queue) >= self.capacity:
+            self.dropped += 1
+            return
+        self._queue.append((time.time(), fmt, args))
+
+    def _drain(self) -> None:
+        queue = self._queue
+        lines = []
+        while queue:
+            ts, fmt, args = queue.popleft()
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(ts))
+            lines.append(f"{stamp}.{int(ts % 1 * 1000):03d} [LOG] {fmt % args}\n")
+        if lines:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+            self.written += len(lines)
+
+    def _run(self) -> None:
+        reported = 0
+        while True:
+            stopping = self._stop.wait(self.interval)
+            self._drain()
+            if self.dropped != reported:
+                self.stream.write(f"[LOG] queue full, dropped {self.dropped - reported} records\n")
+                self.stream.flush()
+                reported = self.dropped
+            if stopping:
+                return
+
+    def close(self) -> None:
+        """Останавливает поток, дописав всё, что осталось в очереди."""
+        self._stop.set()
+        self._thread.join()
@@ -17,14 +17,27 @@ def run():
     print(f"Connecting to server at {server_address}...")
 
     # Создаем небезопасный канал (без SSL)
-    # with grpc.insecure_channel(server_address) as channel:
-    #     stub = metrics_pb2_grpc.VitalSignsServiceStub(channel)
-    #
-    #     TODO: 1. Сгенерируйте 5-10 значений пульса (HEART_RATE)
-    #     TODO: 2. В цикле отправьте их через stub.RecordMetric
-    #     TODO: 3. Вызовите stub.GetAverage и выведите результат в консоль
-
-    print("Client implementation is missing! See client.py to fix this.")
+    with grpc.insecure_channel(server_address) as channel:
+        stub = metrics_pb2_grpc.VitalSignsServiceStub(channel)
+        user_id = "student_py"
+
+        # 1. Генерируем 5-10 значений пульса, как их накопил бы браслет
+        values = [random.uniform(60, 100) for _ in range(random.randint(5, 10))]
+        now = int(time.time())
+
+        # 2. Отправляем всю пачку одним сообщением в client-streaming RPC
+        batch = metrics_pb2.MetricBatch(
+            user_id=user_id,
+            type=metrics_pb2.HEART_RATE,
+            values=values,
+            timestamps=[now] * len(values),
+        )
+        summary = stub.RecordBatches(iter([batch]))
+        print(f"Sent {len(values)} values: {summary.accepted} accepted, {summary.rejected} rejected")
+
+        # 3. Запрашиваем среднее
+        response = stub.GetAverage(metrics_pb2.AverageRequest(user_id=user_id, type=metrics_pb2.HEART_RATE))
+        print(f"Average heart rate: {response.average_value:.2f} (based on {response.count} measurements)")
 
 if __name__ == '__main__':
     logging.basicConfig()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import math
+from array import array
+
+from custom_service.timeseries import Aggregate, TimeSeries
+
+# Слотов типов на пользователя: значения MetricType 0..3 (UNKNOWN не пишется, один в запас)
+TYPE_SLOTS = 4
+
+class KeyTable:
+    """
+    Ключи (user_id, MetricType) одной полосы хранилища.
+
+    user_id интернируется в плотный номер один раз, при первом появлении;
+    ключ — слот number * type_slots + type. По слоту лежат ряд (в списке)
+    и агрегат за всё время — в колонках array: число, сумма, сумма
+    квадратов, минимум, максимум. Поиск — один словарь по user_id и
+    индексация массивов, без кортежа-ключа и объекта Aggregate на ключ.
+    Номер пользователя, у которого не осталось ни одного ключа,
+    освобождается и достаётся следующему новому.
+
+    Ряды в таблице «прикреплены»: их агрегат живёт в колонках, поле
+    series.agg — None. pop() возвращает ряд с заполненным agg, insert()
+    забирает agg в колонки.
+    """
+
+    def __init__(self, type_slots: int = TYPE_SLOTS):
+        self.type_slots = type_slots
+        self.ids = {}          # user_id -> номер
+        self.users = []        # номер -> user_id; None — номер свободен
+        self.live = array('q')  # номер -> сколько ключей пользователя в таблице
+        self.free = []
+        self.series = []       # слот -> TimeSeries или None
+        self.count = array('q')
+        self.total = array('d')
+        self.total_sq = array('d')
+        self.min = array('d')
+        self.max = array('d')
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def find(self, user_id: str, metric_type: int) -> int:
+        """Слот ключа или -1, если его нет."""
+        n = self.ids.get(user_id)
+        if n is None or not 0 <= metric_type < self.type_slots:
+            return -1
+        slot = n * self.type_slots + metric_type
+        return slot if self.series[slot] is not None else -1
+
+    def key_of(self, slot: int) -> tuple[str, int]:
+        return self.users[slot // self.type_slots], slot % self.type_slots
+
+    def _intern(self, user_id: str) -> int:
+        if self.free:
+            n = self.free.pop()
+            self.users[n] = user_id
+        else:
+            n = len(self.users)
+            self.users.append(user_id)
+            self.live.append(0)
+            k = self.type_slots
+            self.series.extend([None] * k)
+            self.count.extend(array('q', bytes(8 * k)))
+            for column in (self.total, self.total_sq, self.min, self.max):
+                column.extend(array('d', bytes(8 * k)))
+        self.ids[user_id] = n
+        return n
+
+    def insert(self, user_id: str, metric_type: int, series: TimeSeries) -> int:
+        """Кладёт откреплённый ряд (с agg) под отсутствующий ключ; возвращает слот."""
+        if not 0 <= metric_type < self.type_slots:
+            raise ValueError(f"metric type {metric_type} is out of range")
+        n = self.ids.get(user_id)
+        if n is None:
+            n = self._intern(user_id)
+        slot = n * self.type_slots + metric_type
+        agg, series.agg = series.agg, None
+        self.series[slot] = series
+        self.count[slot], self.total[slot], self.total_sq[slot] = agg.count, agg.total, agg.total_sq
+        self.min[slot], self.max[slot] = agg.min, agg.max
+        self.live[n] += 1
+        self.size += 1
+        return slot
+
+    def pop(self, slot: int) -> TimeSeries:
+        """Вынимает ряд слота, откреплённый: агрегат из колонок — в его agg."""
+        series = self.series[slot]
+        series.agg = self.aggregate(slot)
+        self.series[slot] = None
+        self.size -= 1
+        n = slot // self.type_slots
+        self.live[n] -= 1
+        if not self.live[n]:
+            del self.ids[self.users[n]]
+            self.users[n] = None
+            self.free.append(n)
+        return series
+
+    def aggregate(self, slot: int) -> Aggregate:
+        """Копия агрегата слота."""
+        return Aggregate(self.count[slot], self.total[slot], self.total_sq[slot], self.min[slot], self.max[slot])
+
+    def add(self, slot: int, value: float) -> None:
+        self.count[slot] += 1
+        self.total[slot] += value
+        self.total_sq[slot] += value * value
+        if value < self.min[slot]:
+            self.min[slot] = value
+        if value > self.max[slot]:
+            self.max[slot] = value
+
+    def add_many(self, slot: int, values) -> None:
+        if not values:
+            return
+        self.count[slot] += len(values)
+        self.total[slot] += math.fsum(values)
+        self.total_sq[slot] += math.fsum(v * v for v in values)
+        self.min[slot] = min(self.min[slot], min(values))
+        self.max[slot] = max(self.max[slot], max(values))
+
+    def merge(self, slot: int, agg: Aggregate) -> None:
+        self.count[slot] += agg.count
+        self.total[slot] += agg.total
+        self.total_sq[slot] += agg.total_sq
+        self.min[slot] = min(self.min[slot], agg.min)
+        self.max[slot] = max(self.max[slot], agg.max)
+
+    def slots(self) -> list[int]:
+        """Занятые слоты по возрастанию."""
+        return [slot for slot, series in enumerate(self.series) if series is not None]
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+from concurrent import futures
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import zlib
+
+import grpc
+
+import metrics_pb2
+import metrics_pb2_grpc
+
+from custom_service.server import (STREAM_CHUNK, ClusterAdminServicer, VitalSignsServicer, batch_response,
+                                   merge_batch_average, split_batch_average)
+from custom_service.stats import StatsInterceptor
+from custom_service.storage import MetricStorage, key_hash
+from custom_service.wal import dump_series, load_series
+
+# Время ожидания ответа соседнего процесса при пересылке
+FORWARD_TIMEOUT = 10.0
+# Для переноса данных — дольше таймаута роутера (Router.timeout, 10 с): соседа,
+# уже вынувшего ряды, нельзя бросить раньше, чем сдастся сам роутер
+ADMIN_FORWARD_TIMEOUT = 60.0
+
+def shard_of(user_id: str, n_shards: int) -> int:
+    """Владелец user_id. Не hash(): он рандомизирован в каждом процессе."""
+    return zlib.crc32(user_id.encode()) % n_shards
+
+def peer_address(socket_dir: str, shard: int) -> str:
+    return f"unix:{os.path.join(socket_dir, f'shard-{shard}.sock')}"
+
+class ShardedServicer(VitalSignsServicer):
+    """
+    Процесс-шард: хранит только своих пользователей (shard_of(user_id)),
+    чужие запросы пересылает владельцу через его unix-сокет. Так
+    GetAverage верен, в какой бы процесс ядро ни отдало соединение.
+    GetStats не пересылается: он описывает тот процесс, который ответил.
+    """
+
+    def __init__(self, shard: int, n_shards: int, socket_dir: str, storage: MetricStorage | None = None):
+        super().__init__(storage)
+        self.shard = shard
+        self.n_shards = n_shards
+        self.socket_dir = socket_dir
+        self._peers = {}
+
+    def _peer(self, shard: int):
+        # Каналы создаём лениво: соседи могут подняться позже нас
+        stub = self._peers.get(shard)
+        if stub is None:
+            channel = grpc.insecure_channel(peer_address(self.socket_dir, shard))
+            stub = self._peers[shard] = metrics_pb2_grpc.VitalSignsServiceStub(channel)
+        return stub
+
+    def _forward(self, method: str, shard: int, request, context):
+        try:
+            return getattr(self._peer(shard), method)(request, timeout=FORWARD_TIMEOUT, wait_for_ready=True)
+        except grpc.RpcError as e:
+            context.abort(e.code(), f"shard {shard}: {e.details()}")
+
+    def RecordMetric(self, request, context):
+        owner = shard_of(request.user_id, self.n_shards)
+        if owner == self.shard:
+            return super().RecordMetric(request, context)
+        return self._forward('RecordMetric', owner, request, context)
+
+    def GetAverage(self, request, context):
+        owner = shard_of(request.user_id, self.n_shards)
+        if owner == self.shard:
+            return super().GetAverage(request, context)
+        return self._forward('GetAverage', owner, request, context)
+
+    def BatchGetAverage(self, request, context):
+        parts = split_batch_average(request, lambda user_id: shard_of(user_id, self.n_shards))
+        if set(parts) <= {self.shard}:
+            return super().BatchGetAverage(request, context)
+        calls = {owner: (idx, self._peer(owner).BatchGetAverage.future(
+                     sub, timeout=FORWARD_TIMEOUT, wait_for_ready=True))
+                 for owner, (idx, sub) in parts.items() if owner != self.shard}
+        done = []
+        if self.shard in parts:
+            idx, sub = parts[self.shard]
+            done.append((idx, super().BatchGetAverage(sub, context)))
+        for owner, (idx, call) in calls.items():
+            try:
+                done.append((idx, call.result()))
+            except grpc.RpcError as e:
+                context.abort(e.code(), f"shard {owner}: {e.details()}")
+        return merge_batch_average(request, done)
+
+    def GetPercentiles(self, request, context):
+        owner = shard_of(request.user_id, self.n_shards)
+        if owner == self.shard:
+            return super().GetPercentiles(request, context)
+        return self._forward('GetPercentiles', owner, request, context)
+
+    def WatchAverage(self, request, context):
+        owner = shard_of(request.user_id, self.n_shards)
+        if owner == self.shard:
+            yield from super().WatchAverage(request, context)
+            return
+        call = self._peer(owner).WatchAverage(request, wait_for_ready=True)
+        # Клиент ушёл — закрываем и поток к владельцу
+        context.add_callback(call.cancel)
+        try:
+            yield from call
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED:
+                context.abort(e.code(), f"shard {owner}: {e.details()}")
+
+    def ExportSamples(self, request, context):
+        # Пользователь живёт в одном шарде; выгрузка всех идёт по шардам по очереди
+        owners = [shard_of(request.user_id, self.n_shards)] if request.user_id else range(self.n_shards)
+        for owner in owners:
+            if owner == self.shard:
+                yield from super().ExportSamples(request, context)
+                continue
+            try:
+                yield from self._peer(owner).ExportSamples(request, wait_for_ready=True)
+            except grpc.RpcError as e:
+                context.abort(e.code(), f"shard {owner}: {e.details()}")
+
+    def _scatter(self, method: str, by_owner: dict, local, context) -> tuple[int, int]:
+        """Отправляет чужие группы владельцам параллельно (.future), свою пишет сам."""
+        calls = {owner: getattr(self._peer(owner), method).future(
+                     iter(items), timeout=FORWARD_TIMEOUT, wait_for_ready=True)
+                 for owner, items in by_owner.items() if owner != self.shard}
+        accepted, rejected = local(by_owner.get(self.shard, []))
+        for owner, call in calls.items():
+            try:
+                response = call.result()
+            except grpc.RpcError as e:
+                context.abort(e.code(), f"shard {owner}: {e.details()}")
+            accepted, rejected = accepted + response.accepted, rejected + response.rejected
+        return accepted, rejected
+
+    def _ingest_requests_sharded(self, requests, context) -> tuple[int, int]:
+        by_owner = {}
+        for r in requests:
+            by_owner.setdefault(shard_of(r.user_id, self.n_shards), []).append(r)
+        return self._scatter('RecordMetrics', by_owner, self.ingest_requests, context)
+
+    def _ingest_batches_sharded(self, batches, context) -> tuple[int, int]:
+        by_owner = {}
+        for b in batches:
+            by_owner.setdefault(shard_of(b.user_id, self.n_shards), []).append(b)
+
+        def local(own):
+            accepted = rejected = 0
+            for b in own:
+                ok, bad = self.ingest_batch(b)
+                accepted, rejected = accepted + ok, rejected + bad
+            return accepted, rejected
+
+        return self._scatter('RecordBatches', by_owner, local, context)
+
+    def RecordMetrics(self, request_iterator, context):
+        accepted = rejected = 0
+        chunk = []
+        for request in request_iterator:
+            chunk.append(request)
+            if len(chunk) >= STREAM_CHUNK:
+                ok, bad = self._ingest_requests_sharded(chunk, context)
+                accepted, rejected, chunk = accepted + ok, rejected + bad, []
+        ok, bad = self._ingest_requests_sharded(chunk, context)
+        return batch_response(accepted + ok, rejected + bad)
+
+    def RecordBatches(self, request_iterator, context):
+        accepted = rejected = 0
+        chunk = []
+        size = 0
+        for batch in request_iterator:
+            chunk.append(batch)
+            size += len(batch.values)
+            if size >= STREAM_CHUNK:
+                ok, bad = self._ingest_batches_sharded(chunk, context)
+                accepted, rejected, chunk, size = accepted + ok, rejected + bad, [], 0
+        ok, bad = self._ingest_batches_sharded(chunk, context)
+        return batch_response(accepted + ok, rejected + bad)
+
+class ShardedAdminServicer(ClusterAdminServicer):
+    """
+    ClusterAdminService процесса-шарда. Роутер видит узел целиком, поэтому
+    ExportRange собирает диапазоны со всех шардов, а ImportSeries
+    раскладывает ряды по владельцам (shard_of) — через их unix-сокеты.
+    Оба метода либо применяются на всех шардах, либо откатываются: иначе
+    повтор или откат на роутере удвоил бы или потерял часть рядов.
+    """
+
+    def __init__(self, shard: int, n_shards: int, socket_dir: str, storage: MetricStorage):
+        super().__init__(storage)
+        self.shard = shard
+        self.n_shards = n_shards
+        self.socket_dir = socket_dir
+        self._peers = {}
+
+    def _peer(self, shard: int):
+        stub = self._peers.get(shard)
+        if stub is None:
+            channel = grpc.insecure_channel(peer_address(self.socket_dir, shard))
+            stub = self._peers[shard] = metrics_pb2_grpc.ClusterAdminServiceStub(channel)
+        return stub
+
+    def export_range(self, request):
+        calls = [self._peer(owner).ExportRange.future(request, timeout=ADMIN_FORWARD_TIMEOUT, wait_for_ready=True)
+                 for owner in range(self.n_shards) if owner != self.shard]
+        items = load_series(self.storage, super().export_range(request).data)
+        error = None
+        for call in calls:
+            try:
+                items += load_series(self.storage, call.result().data)
+            except grpc.RpcError as e:
+                error = error or e
+        if error is not None:
+            # Вынутое у остальных шардов возвращаем владельцам, а не теряем
+            self.import_series(dump_series(self.storage, items))
+            raise error
+        return metrics_pb2.SeriesDump(data=dump_series(self.storage, items), keys=len(items))
+
+    def import_series(self, data: bytes) -> int:
+        by_owner = {}
+        for key, series in load_series(self.storage, data):
+            by_owner.setdefault(shard_of(key[0], self.n_shards), []).append((key, series))
+        calls = {owner: self._peer(owner).ImportSeries.future(
+                     metrics_pb2.SeriesDump(data=dump_series(self.storage, items), keys=len(items)),
+                     timeout=ADMIN_FORWARD_TIMEOUT, wait_for_ready=True)
+                 for owner, items in by_owner.items() if owner != self.shard}
+        error = None
+        for owner, call in calls.items():
+            try:
+                call.result()
+            except grpc.RpcError as e:
+                error = error or e
+        if error is not None:
+            # Роутер вернёт всю пачку на исходный узел — вынимаем то, что соседи уже влили.
+            # Чужих рядов у этих пользователей здесь нет: записи в них ждут конца переноса
+            for owner, call in calls.items():
+                if call.exception() is None:
+                    hashes = sorted({key_hash(key[0]) for key, _ in by_owner[owner]})
+                    self._peer(owner).ExportRange(metrics_pb2.HashRange(first=hashes, last=hashes),
+                                                  timeout=ADMIN_FORWARD_TIMEOUT, wait_for_ready=True)
+            raise error
+        # Свою часть вливаем последней, когда соседи уже приняли свои
+        for key, series in by_owner.get(self.shard, []):
+            self.storage.merge(key, series)
+        return sum(len(items) for items in by_owner.values())
+
+    def ExportRange(self, request, context):
+        try:
+            return super().ExportRange(request, context)
+        except grpc.RpcError as e:
+            context.abort(e.code(), e.details())
+
+    def ImportSeries(self, request, context):
+        try:
+            return super().ImportSeries(request, context)
+        except grpc.RpcError as e:
+            context.abort(e.code(), e.details())
+
+def serve_shard(shard: int, n_shards: int, port: str, socket_dir: str, max_workers: int,
+                admin_address: str | None = None):
+    """
+    Один процесс: общий порт (SO_REUSEPORT) и личный unix-сокет для
+    пересылок. У сокета свой сервер и пул потоков, и он никуда не
+    пересылает: иначе два шарда, забившие пулы пересылками друг к другу,
+    ждали бы друг друга до таймаута. С admin_address ещё и общий
+    служебный порт ClusterAdminService.
+    """
+    storage = MetricStorage()
+
+    servicer = ShardedServicer(shard, n_shards, socket_dir, storage)
+    public = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers),
+                         interceptors=[StatsInterceptor(servicer.stats)],
+                         options=[('grpc.so_reuseport', 1)])
+    metrics_pb2_grpc.add_VitalSignsServiceServicer_to_server(servicer, public)
+    public.add_insecure_port('[::]:' + port)
+
+    internal = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    metrics_pb2_grpc.add_VitalSignsServiceServicer_to_server(VitalSignsServicer(storage), internal)
+    metrics_pb2_grpc.add_ClusterAdminServiceServicer_to_server(ClusterAdminServicer(storage), internal)
+    internal.add_insecure_port(peer_address(socket_dir, shard))
+
+    admin = None
+    if admin_address:
+        admin = grpc.server(futures.ThreadPoolExecutor(max_workers=2), options=[('grpc.so_reuseport', 1)])
+        metrics_pb2_grpc.add_ClusterAdminServiceServicer_to_server(
+            ShardedAdminServicer(shard, n_shards, socket_dir, storage), admin)
+        admin.add_insecure_port(admin_address)
+
+    print(f"Shard {shard}/{n_shards} (pid {os.getpid()}) listening on {port}")
+
+    internal.start()
+    if admin is not None:
+        admin.start()
+    public.start()
+
+    def stop(*_):
+        public.stop(1)
+        internal.stop(1)
+        if admin is not None:
+            admin.stop(1)
+
+    signal.signal(signal.SIGTERM, stop)
+    public.wait_for_termination()
+
+def main():
+    parser = argparse.ArgumentParser(description="Несколько процессов VitalSigns на одном порту (SO_REUSEPORT)")
+    parser.add_argument('--port', default="50051")
+    parser.add_argument('--procs', type=int, default=os.cpu_count(), help="число процессов-шардов")
+    parser.add_argument('--workers', type=int, default=10, help="потоков в пуле каждого процесса")
+    parser.add_argument('--socket-dir', default=None, help="каталог unix-сокетов для пересылок между шардами")
+    parser.add_argument('--admin-address', metavar='HOST:PORT', default=None,
+                        help="общий адрес ClusterAdminService (перенос данных роутером кластера)")
+    args = parser.parse_args()
+
+    socket_dir = args.socket_dir or tempfile.mkdtemp(prefix="vitals-")
+    # spawn, а не fork: gRPC нельзя безопасно форкать после инициализации
+    ctx = multiprocessing.get_context('spawn')
+    procs = [ctx.Process(target=serve_shard, args=(i, args.procs, args.port, socket_dir, args.workers,
+                                                          args.admin_address))
+             for i in range(args.procs)]
+    for p in procs:
+        p.start()
+
+    def stop(*_):
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+        if args.socket_dir is None:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        stop()
+
+if __name__ == '__main__':
+    main()
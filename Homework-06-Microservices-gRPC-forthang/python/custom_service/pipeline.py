@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import random
+import time
+
+import grpc
+
+import metrics_pb2
+import metrics_pb2_grpc
+
+from custom_service.admission import PUSHBACK_KEY
+
+# Коды, при которых запрос имеет смысл повторить
+RETRYABLE = frozenset({
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+})
+
+class PipelinedClient:
+    """
+    Клиент для шлюза, пересылающего данные устройств с высокой частотой.
+
+    - Пул из `channels` HTTP/2-соединений, запросы раздаются по кругу.
+    - Измерения копятся в буфере и уходят одним RecordBatches (по
+      MetricBatch на ключ) при `batch_size` значениях или через `linger`
+      секунд после первого значения в буфере.
+    - В полёте не больше `max_in_flight` RPC; когда окно занято,
+      record() ждёт — это и есть обратное давление на источник.
+    - Ошибки из RETRYABLE повторяются до `retries` раз с экспоненциальной
+      задержкой и полным джиттером. Повтор RecordBatches может записать
+      пачку дважды, если ответ потерялся после записи (at-least-once).
+
+        async with PipelinedClient('localhost:50051') as client:
+            await client.record("user_1", metrics_pb2.HEART_RATE, 72.0)
+            await client.flush()
+            average = await client.get_average("user_1", metrics_pb2.HEART_RATE)
+    """
+
+    def __init__(self, target: str, channels: int = 2, max_in_flight: int = 64, batch_size: int = 512,
+                 linger: float = 0.005, retries: int = 5, backoff: float = 0.05, max_backoff: float = 2.0,
+                 timeout: float = 10.0):
+        self._channels = [grpc.aio.insecure_channel(target) for _ in range(channels)]
+        self._stubs = [metrics_pb2_grpc.VitalSignsServiceStub(c) for c in self._channels]
+        self._next = 0
+        self.batch_size = batch_size
+        self.linger = linger
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self._window = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+        # (user_id, type) -> ([values], [timestamps])
+        self._buffer = {}
+        self._buffered = 0
+        self._timer = None
+
+        self.stats = {'sent': 0, 'rejected': 0, 'failed': 0, 'rpcs': 0, 'retries': 0}
+        self.last_error = None
+
+    def _stub(self):
+        self._next = (self._next + 1) % len(self._stubs)
+        return self._stubs[self._next]
+
+    async def _call(self, method: str, request):
+        """
+        Один RPC с повторами; повторная попытка идёт через другой канал.
+        Список сообщений отправляется как client-stream, заново на каждой попытке.
+        """
+        attempt = 0
+        while True:
+            try:
+                self.stats['rpcs'] += 1
+                payload = iter(request) if isinstance(request, list) else request
+                return await getattr(self._stub(), method)(payload, timeout=self.timeout)
+            except grpc.aio.AioRpcError as e:
+                if e.code() not in RETRYABLE or attempt >= self.retries:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                # Сервер под admission control подсказывает, когда повторять
+                for key, value in e.trailing_metadata() or ():
+                    if key == PUSHBACK_KEY:
+                        delay = max(delay, int(value) / 1000)
+                attempt += 1
+                self.stats['retries'] += 1
+                await asyncio.sleep(delay)
+
+    async def record(self, user_id: str, metric_type: int, value: float, timestamp: int = 0) -> None:
+        values, timestamps = self._buffer.setdefault((user_id, metric_type), ([], []))
+        values.append(value)
+        timestamps.append(timestamp or int(time.time()))
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            await self._flush_buffer()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self._on_linger)
+
+    def _on_linger(self) -> None:
+        self._timer = None
+        if self._buffered:
+            self._spawn(self._flush_buffer())
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_buffer(self) -> None:
+        """Забирает буфер и отправляет его, как только освободится место в окне."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        buffer, self._buffer, count = self._buffer, {}, self._buffered
+        self._buffered = 0
+        if not buffer:
+            return
+        batches = [metrics_pb2.MetricBatch(user_id=user_id, type=metric_type, values=values, timestamps=timestamps)
+                   for (user_id, metric_type), (values, timestamps) in buffer.items()]
+        await self._window.acquire()
+        self._spawn(self._send(batches, count))
+
+    async def _send(self, batches, count: int) -> None:
+        try:
+            response = await self._call('RecordBatches', batches)
+            self.stats['sent'] += response.accepted
+            self.stats['rejected'] += response.rejected
+        except grpc.aio.AioRpcError as e:
+            self.stats['failed'] += count
+            self.last_error = e
+        finally:
+            self._window.release()
+
+    async def flush(self) -> dict:
+        """Отправляет буфер и ждёт все RPC в полёте; возвращает статистику."""
+        await self._flush_buffer()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+        return dict(self.stats)
+
+    async def get_average(self, user_id: str, metric_type: int, from_ts: int = 0, to_ts: int = 0):
+        """Чтение идёт в обход буфера; вызовите flush(), чтобы увидеть свои записи."""
+        async with self._window:
+            return await self._call('GetAverage', metrics_pb2.AverageRequest(
+                user_id=user_id, type=metric_type, from_ts=from_ts, to_ts=to_ts))
+
+    async def close(self) -> None:
+        await self.flush()
+        for channel in self._channels:
+            await channel.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+async def _demo(args):
+    async with PipelinedClient(args.target, channels=args.channels, max_in_flight=args.in_flight,
+                               batch_size=args.batch_size) as client:
+        t0 = time.perf_counter()
+        for i in range(args.samples):
+            await client.record(f"device_{i % args.users}", metrics_pb2.HEART_RATE, random.uniform(60, 100))
+        stats = await client.flush()
+        elapsed = time.perf_counter() - t0
+        response = await client.get_average("device_0", metrics_pb2.HEART_RATE)
+
+    print(f"Pushed {args.samples} samples in {elapsed:.2f}s ({args.samples / elapsed:.0f}/s) "
+          f"via {stats['rpcs']} RPCs: {stats}")
+    print(f"Average for device_0: {response.average_value:.2f} ({response.count} measurements)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Демо конвейерного клиента")
+    parser.add_argument('--target', default='localhost:50051')
+    parser.add_argument('--samples', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--in-flight', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=512)
+    asyncio.run(_demo(parser.parse_args()))
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+from bisect import bisect_left, bisect_right
+from concurrent import futures
+
+import argparse
+import signal
+import threading
+
+import grpc
+
+import metrics_pb2
+import metrics_pb2_grpc
+
+from custom_service.server import (STREAM_CHUNK, batch_response, merge_batch_average, split_batch_average,
+                                   stats_response)
+from custom_service.stats import ServerStats, StatsInterceptor
+from custom_service.storage import key_hash
+
+HASH_MAX = (1 << 64) - 1
+
+class HashRing:
+    """
+    Консистентное хэширование с виртуальными узлами: у каждого узла
+    `vnodes` точек на кольце 64-битного key_hash, пользователь принадлежит
+    первой точке не меньше key_hash(user_id) (с переходом через ноль).
+    Добавление узла забирает у соседей примерно 1/N ключей.
+    """
+
+    def __init__(self, nodes=(), vnodes: int = 128):
+        self.vnodes = vnodes
+        self.nodes = []
+        # Точки и владельцы меняются одним присваиванием — читатели видят согласованный снимок
+        self._ring = ([], [])
+        for node in nodes:
+            self.add(node)
+
+    def _rebuild(self, nodes) -> None:
+        points = sorted((key_hash(f"{node}#{v}"), node) for node in nodes for v in range(self.vnodes))
+        self.nodes = list(nodes)
+        self._ring = ([h for h, _ in points], [node for _, node in points])
+
+    def add(self, node: str) -> None:
+        if node not in self.nodes:
+            self._rebuild(self.nodes + [node])
+
+    def remove(self, node: str) -> None:
+        self._rebuild([n for n in self.nodes if n != node])
+
+    def owner_of_hash(self, h: int) -> str:
+        points, owners = self._ring
+        return owners[bisect_left(points, h) % len(points)]
+
+    def node_for(self, user_id: str) -> str:
+        return self.owner_of_hash(key_hash(user_id))
+
+    def ranges(self, node: str) -> list[tuple[int, int]]:
+        """Диапазоны [first, last] хэша, которыми владеет node."""
+        points, owners = self._ring
+        out = []
+        for i, (point, owner) in enumerate(zip(points, owners)):
+            if owner != node:
+                continue
+            if i == 0:
+                out.append((0, point))
+                if points[-1] < HASH_MAX:
+                    out.append((points[-1] + 1, HASH_MAX))
+            else:
+                out.append((points[i - 1] + 1, point))
+        return out
+
+    def copy(self) -> "HashRing":
+        ring = HashRing(vnodes=self.vnodes)
+        ring.nodes, ring._ring = list(self.nodes), self._ring
+        return ring
+
+def parse_node(spec: str) -> tuple[str, str | None]:
+    """'host:port[,admin_host:admin_port]' → (адрес узла, адрес ClusterAdminService или None)."""
+    address, _, admin = spec.partition(',')
+    return address.strip(), admin.strip() or None
+
+class Router:
+    """
+    Умный клиент кластера VitalSigns: пользователи раскладываются по
+    узлам через HashRing, пачки записей разбиваются по узлам и уходят
+    параллельно (.future), add_node / remove_node переносят данные
+    затронутых диапазонов хэша между узлами (ExportRange → ImportSeries
+    служебного сервиса узла, адрес которого задаётся после запятой:
+    host:port,admin_host:admin_port).
+
+    Записи в переносимые диапазоны ждут конца переноса, а перенос — конца
+    записей, начатых по старому кольцу: иначе запись, дошедшая до старого
+    владельца после ExportRange, осталась бы на нём. Чтение не ждёт, поэтому
+    перенесённые пользователи ненадолго видны только частично. Узлы
+    проверяются до переключения кольца (узел с --wal переносить нельзя), а
+    если перенос всё же срывается, роутер возвращает старое кольцо и уже
+    перенесённые ряды.
+    """
+
+    def __init__(self, nodes, vnodes: int = 128, timeout: float = 10.0):
+        parsed = [parse_node(spec) for spec in nodes]
+        self.ring = HashRing([address for address, _ in parsed], vnodes)
+        self.admin = dict(parsed)
+        self.timeout = timeout
+        self._stubs = {}
+        self._admin_stubs = {}
+        self._lock = threading.Lock()
+        # Один перенос за раз
+        self._rebalance = threading.Lock()
+        # Забор записей: переносимые диапазоны (first и last по возрастанию),
+        # эпоха кольца и число незавершённых записей каждой эпохи
+        self._fence = threading.Condition()
+        self._moving = ([], [])
+        self._epoch = 0
+        self._writes = {}
+
+    def stub(self, node: str):
+        stub = self._stubs.get(node)
+        if stub is None:
+            with self._lock:
+                stub = self._stubs.get(node)
+                if stub is None:
+                    stub = self._stubs[node] = metrics_pb2_grpc.VitalSignsServiceStub(grpc.insecure_channel(node))
+        return stub
+
+    def admin_stub(self, node: str):
+        admin = self.admin.get(node)
+        if admin is None:
+            raise ValueError(f"node {node} has no admin address, use host:port,admin_host:admin_port")
+        stub = self._admin_stubs.get(admin)
+        if stub is None:
+            with self._lock:
+                stub = self._admin_stubs.get(admin)
+                if stub is None:
+                    stub = self._admin_stubs[admin] = metrics_pb2_grpc.ClusterAdminServiceStub(
+                        grpc.insecure_channel(admin))
+        return stub
+
+    def _is_moving(self, h: int) -> bool:
+        firsts, lasts = self._moving
+        i = bisect_right(firsts, h) - 1
+        return i >= 0 and h <= lasts[i]
+
+    def _begin_write(self, user_ids) -> tuple[int, HashRing]:
+        """Ждёт, пока ни один из user_ids не переносится; возвращает (эпоху, кольцо) для записи."""
+        hashes = [key_hash(user_id) for user_id in user_ids]
+        with self._fence:
+            while any(self._is_moving(h) for h in hashes):
+                self._fence.wait()
+            self._writes[self._epoch] = self._writes.get(self._epoch, 0) + 1
+            return self._epoch, self.ring
+
+    def _end_write(self, epoch: int) -> None:
+        with self._fence:
+            self._writes[epoch] -= 1
+            if not self._writes[epoch]:
+                del self._writes[epoch]
+                self._fence.notify_all()
+
+    def record(self, request):
+        epoch, ring = self._begin_write([request.user_id])
+        try:
+            return self.stub(ring.node_for(request.user_id)).RecordMetric(request, timeout=self.timeout)
+        finally:
+            self._end_write(epoch)
+
+    def get_average(self, request):
+        return self.stub(self.ring.node_for(request.user_id)).GetAverage(request, timeout=self.timeout)
+
+    def batch_get_average(self, request):
+        """Разбивает запрос по узлам пользователей, опрашивает узлы параллельно и собирает ответ."""
+        parts = split_batch_average(request, self.ring.node_for)
+        calls = [(idx, self.stub(node).BatchGetAverage.future(sub, timeout=self.timeout))
+                 for node, (idx, sub) in parts.items()]
+        return merge_batch_average(request, [(idx, call.result()) for idx, call in calls])
+
+    def get_percentiles(self, request):
+        return self.stub(self.ring.node_for(request.user_id)).GetPercentiles(request, timeout=self.timeout)
+
+    def watch_average(self, request):
+        """Поток AverageResponse с узла пользователя; cancel() у результата закрывает подписку."""
+        return self.stub(self.ring.node_for(request.user_id)).WatchAverage(request)
+
+    def export_samples(self, request):
+        """Поток SampleChunk: с узла пользователя или, без user_id, со всех узлов по очереди."""
+        nodes = [self.ring.node_for(request.user_id)] if request.user_id else list(self.ring.nodes)
+        for node in nodes:
+            yield from self.stub(node).ExportSamples(request)
+
+    def _fan_out(self, method: str, messages) -> tuple[int, int]:
+        """Группирует сообщения по узлам и шлёт каждому одним client-stream RPC."""
+        messages = list(messages)
+        epoch, ring = self._begin_write({m.user_id for m in messages})
+        try:
+            by_node = {}
+            for m in messages:
+                by_node.setdefault(ring.node_for(m.user_id), []).append(m)
+            calls = [getattr(self.stub(node), method).future(iter(items), timeout=self.timeout)
+                     for node, items in by_node.items()]
+            accepted = rejected = 0
+            for call in calls:
+                response = call.result()
+                accepted, rejected = accepted + response.accepted, rejected + response.rejected
+            return accepted, rejected
+        finally:
+            self._end_write(epoch)
+
+    def record_many(self, requests) -> tuple[int, int]:
+        return self._fan_out('RecordMetrics', requests)
+
+    def record_batches(self, batches) -> tuple[int, int]:
+        return self._fan_out('RecordBatches', batches)
+
+    def _move(self, moves, done: dict | None = None) -> int:
+        """
+        moves: {(откуда, куда): [диапазоны]} — переносит ряды и возвращает
+        число ключей. Пары, ряды которых уже лежат на новом узле, пишутся в done.
+        """
+        moved = 0
+        for (source, target), ranges in moves.items():
+            first, last = zip(*ranges)
+            dump = self.admin_stub(source).ExportRange(metrics_pb2.HashRange(first=first, last=last),
+                                                       timeout=self.timeout)
+            if not dump.keys:
+                continue
+            try:
+                self.admin_stub(target).ImportSeries(dump, timeout=self.timeout)
+            except grpc.RpcError:
+                # Не теряем вынутые данные: возвращаем их на исходный узел
+                self.admin_stub(source).ImportSeries(dump, timeout=self.timeout)
+                raise
+            moved += dump.keys
+            if done is not None:
+                done[source, target] = ranges
+        return moved
+
+    def _check_admin(self, nodes) -> None:
+        """Пробный ExportRange с пустым HashRange: узел доступен и может отдавать ряды (не --wal)."""
+        for node in nodes:
+            try:
+                self.admin_stub(node).ExportRange(metrics_pb2.HashRange(), timeout=self.timeout)
+            except grpc.RpcError as e:
+                raise ValueError(f"node {node} cannot take part in rebalancing: {e.details()}") from e
+
+    def _switch(self, ring: HashRing, moves) -> int:
+        """Переключает запросы на новое кольцо и переносит ряды, придерживая записи в диапазоны moves."""
+        # Узлы без служебного адреса, недоступные или с --wal отсеиваем до переключения
+        self._check_admin({node for pair in moves for node in pair})
+        ranges = sorted(r for rs in moves.values() for r in rs)
+        with self._fence:
+            self._moving = ([first for first, _ in ranges], [last for _, last in ranges])
+            old, self.ring = self.ring, ring
+            self._epoch += 1
+            # Записи по старому кольцу могут ещё идти к старым владельцам — ждём их до ExportRange
+            while any(epoch < self._epoch for epoch in self._writes):
+                self._fence.wait()
+        done = {}
+        try:
+            return self._move(moves, done)
+        except Exception:
+            # Перенос сорвался: возвращаем старое кольцо и уже перенесённые ряды. Записи
+            # в диапазоны moves всё это время ждали, а у остальных владелец в обоих кольцах один
+            with self._fence:
+                self.ring = old
+            self._move({(target, source): ranges for (source, target), ranges in done.items()})
+            raise
+        finally:
+            with self._fence:
+                self._moving = ([], [])
+                self._fence.notify_all()
+
+    def add_node(self, spec: str) -> int:
+        """Добавляет узел host:port,admin_host:admin_port, переносит на него его диапазоны; возвращает число ключей."""
+        node, admin = parse_node(spec)
+        with self._rebalance:
+            if node in self.ring.nodes:
+                return 0
+            old, ring = self.ring, self.ring.copy()
+            ring.add(node)
+            moves = {}
+            if old.nodes:
+                for first, last in ring.ranges(node):
+                    # Диапазон нового узла целиком принадлежал одному старому владельцу
+                    moves.setdefault((old.owner_of_hash(last), node), []).append((first, last))
+            previous = self.admin.get(node)
+            self.admin[node] = admin
+            try:
+                return self._switch(ring, moves)
+            except Exception:
+                # Кольцо не переключилось или вернулось к старому — узла в кластере нет
+                self.admin[node] = previous
+                raise
+
+    def remove_node(self, spec: str) -> int:
+        """Раздаёт диапазоны узла новым владельцам и убирает его из кольца."""
+        node, _ = parse_node(spec)
+        with self._rebalance:
+            if node not in self.ring.nodes:
+                return 0
+            if len(self.ring.nodes) == 1:
+                raise ValueError("cannot remove the last node")
+            old, ring = self.ring, self.ring.copy()
+            ring.remove(node)
+            moves = {}
+            for first, last in old.ranges(node):
+                # Новые владельцы внутри диапазона могут смениться — режем его по точкам нового кольца
+                points, owners = ring._ring
+                lo = first
+                i = bisect_left(points, lo)
+                while lo <= last:
+                    owner = owners[i % len(points)]
+                    hi = min(last, points[i]) if i < len(points) else last
+                    moves.setdefault((node, owner), []).append((lo, hi))
+                    lo, i = hi + 1, i + 1
+            return self._switch(ring, moves)
+
+class RouterServicer(metrics_pb2_grpc.VitalSignsServiceServicer):
+    """
+    gRPC-прокси перед кластером для клиентов, которые не могут встроить Router.
+    GetStats отвечает за сам прокси (без хранилища); узлы опрашиваются напрямую.
+    """
+
+    def __init__(self, router: Router):
+        self.router = router
+        self.stats = ServerStats()
+
+    def _call(self, fn, request, context):
+        try:
+            return fn(request)
+        except grpc.RpcError as e:
+            context.abort(e.code(), e.details())
+
+    def RecordMetric(self, request, context):
+        return self._call(self.router.record, request, context)
+
+    def GetAverage(self, request, context):
+        return self._call(self.router.get_average, request, context)
+
+    def BatchGetAverage(self, request, context):
+        return self._call(self.router.batch_get_average, request, context)
+
+    def GetPercentiles(self, request, context):
+        return self._call(self.router.get_percentiles, request, context)
+
+    def WatchAverage(self, request, context):
+        call = self.router.watch_average(request)
+        context.add_callback(call.cancel)
+        try:
+            yield from call
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED:
+                context.abort(e.code(), e.details())
+
+    def ExportSamples(self, request, context):
+        try:
+            yield from self.router.export_samples(request)
+        except grpc.RpcError as e:
+            context.abort(e.code(), e.details())
+
+    def GetStats(self, request, context):
+        return stats_response(self.stats.snapshot())
+
+    def _stream(self, method, request_iterator, context):
+        accepted = rejected = 0
+        chunk = []
+        for message in request_iterator:
+            chunk.append(message)
+            if len(chunk) >= STREAM_CHUNK:
+                ok, bad = self._call(method, chunk, context)
+                accepted, rejected, chunk = accepted + ok, rejected + bad, []
+        ok, bad = self._call(method, chunk, context) if chunk else (0, 0)
+        return batch_response(accepted + ok, rejected + bad)
+
+    def RecordMetrics(self, request_iterator, context):
+        return self._stream(self.router.record_many, request_iterator, context)
+
+    def RecordBatches(self, request_iterator, context):
+        return self._stream(self.router.record_batches, request_iterator, context)
+
+def read_nodes(path: str) -> list[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def main():
+    parser = argparse.ArgumentParser(description="Роутер кластера VitalSigns (консистентное хэширование)")
+    parser.add_argument('--port', default="50050")
+    parser.add_argument('--nodes', nargs='*', default=[], help="узлы host:port,admin_host:admin_port (служебный адрес нужен для ребалансировки)")
+    parser.add_argument('--nodes-file', default=None,
+                        help="файл со списком узлов; по SIGHUP перечитывается с ребалансировкой")
+    parser.add_argument('--vnodes', type=int, default=128, help="виртуальных узлов на сервер")
+    parser.add_argument('--workers', type=int, default=10)
+    args = parser.parse_args()
+
+    nodes = args.nodes + (read_nodes(args.nodes_file) if args.nodes_file else [])
+    if not nodes:
+        parser.error("нужен хотя бы один узел: --nodes или --nodes-file")
+    router = Router(nodes, args.vnodes)
+
+    def reload(*_):
+        wanted = read_nodes(args.nodes_file)
+        for spec in wanted:
+            print(f"[ROUTER] add {spec}: moved {router.add_node(spec)} keys")
+        addresses = {parse_node(spec)[0] for spec in wanted}
+        for node in [n for n in router.ring.nodes if n not in addresses]:
+            print(f"[ROUTER] remove {node}: moved {router.remove_node(node)} keys")
+
+    if args.nodes_file:
+        # Ребалансировка идёт в отдельном потоке, чтобы не блокировать обработчик сигнала
+        signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=reload, daemon=True).start())
+
+    servicer = RouterServicer(router)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.workers),
+                         interceptors=[StatsInterceptor(servicer.stats)])
+    metrics_pb2_grpc.add_VitalSignsServiceServicer_to_server(servicer, server)
+    server.add_insecure_port('[::]:' + args.port)
+
+    print(f"Router listening on {args.port}, nodes: {', '.join(router.ring.nodes)}")
+
+    server.start()
+    server.wait_for_termination()
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,13 @@
 
 from concurrent import futures
 
+import argparse
+import asyncio
 import grpc
+import math
+import signal
+import sys
+import threading
 import typing
 import time
 
@@ -10,49 +16,452 @@ import time
 import metrics_pb2
 import metrics_pb2_grpc
 
+from custom_service.admission import AdmissionController, AdmissionInterceptor
+from custom_service.asynclog import AsyncLog
+from custom_service.sketch import DEFAULT_ACCURACY, DEFAULT_SKETCH_HOURS
+from custom_service.stats import ServerStats, StatsInterceptor
+from custom_service.storage import MetricStorage, key_hash
+from custom_service.timeseries import DEFAULT_RAW_TAIL
+from custom_service.wal import USER_ID_BYTES, Durability, dump_series, load_series
+
+# Сколько измерений из стрима RecordMetrics копим перед записью в хранилище
+STREAM_CHUNK = 1024
+
+# Граница окна GetAverage, если from_ts или to_ts не заданы
+WINDOW_UNBOUNDED = 1 << 62
+
+# Значений в одном SampleChunk, если клиент не указал chunk_samples
+EXPORT_CHUNK = 65536
+
+# Не чаще одного обновления WatchAverage за столько секунд
+WATCH_INTERVAL = 0.5
+
+# Квантили GetPercentiles, если клиент их не указал
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+# Не больше стольких пар (user_id, type) в одном BatchGetAverage
+MAX_BATCH_KEYS = 100000
+
+# Значения MetricType, которые можно записывать; все меньше TYPE_SLOTS хранилища
+KNOWN_TYPES = frozenset(metrics_pb2.MetricType.values()) - {metrics_pb2.UNKNOWN}
+
+def validate(user_id: str, metric_type: int, value: float) -> str | None:
+    """Возвращает текст ошибки или None, если измерение валидно."""
+    if not user_id:
+        return "user_id is required"
+    if len(user_id.encode()) > USER_ID_BYTES:
+        return f"user_id must be at most {USER_ID_BYTES} bytes"
+    if metric_type == metrics_pb2.UNKNOWN:
+        return "metric type is required"
+    if metric_type not in KNOWN_TYPES:
+        return f"unknown metric type {metric_type}"
+    if not math.isfinite(value):
+        return "value must be finite"
+    return None
+
+def batch_response(accepted: int, rejected: int):
+    return metrics_pb2.BatchResponse(accepted=accepted, rejected=rejected,
+                                     message=f"{accepted} saved, {rejected} rejected")
+
+def split_batch_average(request, owner_of) -> dict:
+    """Разбивает BatchAverageRequest по владельцам user_id: владелец -> (номера в user_ids, подзапрос)."""
+    by_owner = {}
+    for n, user_id in enumerate(request.user_ids):
+        by_owner.setdefault(owner_of(user_id), []).append(n)
+    return {owner: (idx, metrics_pb2.BatchAverageRequest(
+                user_ids=[request.user_ids[n] for n in idx], types=request.types,
+                from_ts=request.from_ts, to_ts=request.to_ts))
+            for owner, idx in by_owner.items()}
+
+def merge_batch_average(request, parts):
+    """Собирает ответы подзапросов [(номера в user_ids, ответ)] в порядке исходного запроса."""
+    width = len(request.types)
+    averages = [None] * (len(request.user_ids) * width)
+    for idx, response in parts:
+        for k, n in enumerate(idx):
+            averages[n * width:(n + 1) * width] = response.averages[k * width:(k + 1) * width]
+    return metrics_pb2.BatchAverageResponse(averages=averages)
+
+def stats_response(snapshot: dict):
+    """StatsResponse из ServerStats.snapshot()."""
+    methods = [metrics_pb2.MethodStats(**m) for m in snapshot['methods']]
+    return metrics_pb2.StatsResponse(**{**snapshot, 'methods': methods})
+
 class VitalSignsServicer(metrics_pb2_grpc.VitalSignsServiceServicer):
     storage: typing.Any |None = None
 
-    def __init__(self):
-        # TODO: Инициализируйте хранилище данных (например, словарь)
-        # self.storage = ...
-        pass
+    def __init__(self, storage: MetricStorage | None = None, stats: ServerStats | None = None,
+                 log: AsyncLog | None = None, watch_interval: float = WATCH_INTERVAL):
+        # Агрегаты (count, sum, sum_sq, min, max) по ключу (user_id, type)
+        self.storage = storage if storage is not None else MetricStorage()
+        # Счётчики RPC пишет StatsInterceptor; без него GetStats отдаёт только размер хранилища
+        self.stats = stats if stats is not None else ServerStats(self.storage, log)
+        self.log = log
+        self.watch_interval = watch_interval
 
     def RecordMetric(self, request, context):
         """
         Принимает MetricRequest, сохраняет данные в память.
         Возвращает MetricResponse.
         """
-        print(f"[LOG] Received metric: {request.type} = {request.value} for user {request.user_id}")
+        if self.log is not None:
+            # Только постановка в очередь: форматирует и пишет поток AsyncLog
+            self.log.log("Received metric: %s = %s for user %s", request.type, request.value, request.user_id)
 
-        # TODO: 1. Проверить валидность данных
-        # TODO: 2. Сохранить значение в список для данного пользователя и типа метрики
+        error = validate(request.user_id, request.type, request.value)
+        if error:
+            return metrics_pb2.MetricResponse(success=False, message=error)
+
+        # O(1): обновляем агрегат под мьютексом одной полосы
+        self.storage.record(request.user_id, request.type, request.value, request.timestamp)
 
         return metrics_pb2.MetricResponse(success=True, message="Data saved")
 
     def GetAverage(self, request, context):
         """
         Принимает AverageRequest, считает среднее.
-        Возвращает AverageResponse.
+        Если задано окно [from_ts, to_ts), среднее считается по нему
+        (0 — граница не задана). Возвращает AverageResponse.
+        """
+        if request.from_ts or request.to_ts:
+            # Окно собирается из часовых и минутных корзин и сырого хвоста
+            lo = request.from_ts or -WINDOW_UNBOUNDED
+            hi = request.to_ts or WINDOW_UNBOUNDED
+            total, count = self.storage.window(request.user_id, request.type, lo, hi)
+            return metrics_pb2.AverageResponse(average_value=total / count if count else 0.0, count=count)
+
+        # Среднее берём из готового агрегата, без прохода по значениям
+        agg = self.storage.get(request.user_id, request.type)
+
+        return metrics_pb2.AverageResponse(average_value=agg.mean, count=agg.count)
+
+    def batch_average(self, request):
+        """Средние для всех пар user_ids × types; ValueError при пустом или слишком большом запросе."""
+        if not request.types:
+            raise ValueError("types are required")
+        if len(request.user_ids) * len(request.types) > MAX_BATCH_KEYS:
+            raise ValueError(f"at most {MAX_BATCH_KEYS} (user_id, type) pairs per request")
+        keys = [(user_id, metric_type) for user_id in request.user_ids for metric_type in request.types]
+        if request.from_ts or request.to_ts:
+            lo = request.from_ts or -WINDOW_UNBOUNDED
+            hi = request.to_ts or WINDOW_UNBOUNDED
+            sums = self.storage.sum_counts(keys, lo, hi)
+        else:
+            sums = self.storage.sum_counts(keys)
+        return metrics_pb2.BatchAverageResponse(averages=[
+            metrics_pb2.AverageResponse(average_value=total / count if count else 0.0, count=count)
+            for total, count in sums])
+
+    def BatchGetAverage(self, request, context):
+        try:
+            return self.batch_average(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def WatchAverage(self, request, context):
+        """
+        Поток AverageResponse: первый ответ сразу, дальше — после записей в
+        этот ключ, не чаще раза в watch_interval (записи за интервал дают
+        одно обновление). Каждый подписчик занимает поток пула; для тысяч
+        подписчиков лучше --aio.
         """
-        # TODO: 1. Найти данные пользователя
-        # TODO: 2. Вычислить среднее (если данных нет, вернуть 0)
+        key = (request.user_id, request.type)
+        changed = threading.Event()
+        closed = threading.Event()
+        changed.set()
+
+        def on_close():
+            closed.set()
+            changed.set()
 
-        average = 0.0 # Заглушка
-        count = 0     # Заглушка
+        context.add_callback(on_close)
+        self.storage.watchers.subscribe(key, changed.set)
+        try:
+            while True:
+                changed.wait()
+                if closed.is_set():
+                    return
+                changed.clear()
+                yield self.GetAverage(request, context)
+                closed.wait(self.watch_interval)
+        finally:
+            self.storage.watchers.unsubscribe(key, changed.set)
 
-        return metrics_pb2.AverageResponse(average_value=average, count=count)
+    def percentiles(self, request):
+        """Квантили по скетчу ключа; ValueError при долях вне [0, 1]."""
+        qs = list(request.quantiles) or DEFAULT_QUANTILES
+        if not all(0.0 <= q <= 1.0 for q in qs):
+            raise ValueError("quantiles must be in [0, 1]")
+        if request.from_ts or request.to_ts:
+            lo = request.from_ts or -WINDOW_UNBOUNDED
+            hi = request.to_ts or WINDOW_UNBOUNDED
+            values, count = self.storage.quantiles(request.user_id, request.type, qs, lo, hi)
+        else:
+            values, count = self.storage.quantiles(request.user_id, request.type, qs)
+        return metrics_pb2.PercentilesResponse(quantiles=qs, values=values, count=count,
+                                               relative_accuracy=self.storage.sketch_accuracy)
 
-def serve():
-    port = "50051"
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    metrics_pb2_grpc.add_VitalSignsServiceServicer_to_server(VitalSignsServicer(), server)
-    server.add_insecure_port('[::]:' + port)
+    def GetPercentiles(self, request, context):
+        try:
+            return self.percentiles(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def ExportSamples(self, request, context):
+        """
+        Отдаёт сырые значения потоком SampleChunk: срезы колонок
+        array('q') / array('d') уходят байтами, без объекта на значение.
+        """
+        lo = request.from_ts or -WINDOW_UNBOUNDED
+        hi = request.to_ts or WINDOW_UNBOUNDED
+        size = request.chunk_samples if request.chunk_samples > 0 else EXPORT_CHUNK
+        for (user_id, metric_type), timestamps, values in self.storage.samples(
+                request.user_id, request.type, lo, hi):
+            for i in range(0, len(values), size):
+                yield metrics_pb2.SampleChunk(user_id=user_id, type=metric_type,
+                                              timestamps=timestamps[i:i + size].tobytes(),
+                                              values=values[i:i + size].tobytes())
+
+    def GetStats(self, request, context):
+        return stats_response(self.stats.snapshot())
+
+    def ingest_requests(self, requests) -> tuple[int, int]:
+        """Проверяет и пишет список MetricRequest; возвращает (accepted, rejected)."""
+        items = [(r.user_id, r.type, r.value, r.timestamp) for r in requests
+                 if not validate(r.user_id, r.type, r.value)]
+        self.storage.record_items(items)
+        return len(items), len(requests) - len(items)
+
+    def ingest_batch(self, batch) -> tuple[int, int]:
+        """Проверяет и пишет одну MetricBatch под одним мьютексом; возвращает (accepted, rejected)."""
+        if validate(batch.user_id, batch.type, 0.0):
+            return 0, len(batch.values)
+        values, timestamps = batch.values, batch.timestamps
+        if timestamps and len(timestamps) != len(values):
+            return 0, len(values)
+        if not all(map(math.isfinite, values)):
+            if timestamps:
+                pairs = [(v, ts) for v, ts in zip(values, timestamps) if math.isfinite(v)]
+                values, timestamps = [v for v, _ in pairs], [ts for _, ts in pairs]
+            else:
+                values = [v for v in values if math.isfinite(v)]
+        self.storage.record_many(batch.user_id, batch.type, values, timestamps)
+        return len(values), len(batch.values) - len(values)
+
+    def RecordMetrics(self, request_iterator, context):
+        """
+        Client-streaming: принимает поток MetricRequest.
+        Измерения копятся чанками по STREAM_CHUNK и пишутся с одним
+        взятием мьютекса на полосу. Возвращает BatchResponse.
+        """
+        accepted = rejected = 0
+        chunk = []
+        for request in request_iterator:
+            chunk.append(request)
+            if len(chunk) >= STREAM_CHUNK:
+                ok, bad = self.ingest_requests(chunk)
+                accepted, rejected, chunk = accepted + ok, rejected + bad, []
+        ok, bad = self.ingest_requests(chunk)
+        return batch_response(accepted + ok, rejected + bad)
+
+    def RecordBatches(self, request_iterator, context):
+        """
+        Client-streaming: принимает поток MetricBatch.
+        Каждая пачка целиком применяется под одним мьютексом.
+        """
+        accepted = rejected = 0
+        for batch in request_iterator:
+            ok, bad = self.ingest_batch(batch)
+            accepted, rejected = accepted + ok, rejected + bad
+        return batch_response(accepted, rejected)
+
+class ClusterAdminServicer(metrics_pb2_grpc.ClusterAdminServiceServicer):
+    """
+    Служебный сервис ребалансировки: вынимает и вливает ряды пачками.
+    Поднимается отдельным сервером на --admin-address (build_admin_server),
+    чтобы клиенты публичного порта не могли выгрузить или перезаписать
+    чужие данные.
+    """
+
+    def __init__(self, storage: MetricStorage):
+        self.storage = storage
+
+    def export_range(self, request):
+        """Вынимает пользователей, чей key_hash(user_id) лежит в одном из диапазонов HashRange."""
+        ranges = list(zip(request.first, request.last))
+        if not ranges:
+            # Пустой HashRange — пробный вызов роутера: без прохода по хранилищу
+            return metrics_pb2.SeriesDump()
+
+        def moving(user_id):
+            h = key_hash(user_id)
+            return any(first <= h <= last for first, last in ranges)
+
+        taken = self.storage.take(moving)
+        return metrics_pb2.SeriesDump(data=dump_series(self.storage, taken), keys=len(taken))
+
+    def import_series(self, data: bytes) -> int:
+        """Вливает ряды из SeriesDump; ValueError, если формат или уровни свёрток не совпадают."""
+        items = load_series(self.storage, data)
+        for key, series in items:
+            self.storage.merge(key, series)
+        return len(items)
+
+    def ExportRange(self, request, context):
+        """Отдаёт ряды пользователей из диапазонов хэша и удаляет их у себя — для переноса на другой узел."""
+        if self.storage.wal is not None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "rebalancing is not supported with --wal")
+        dump = self.export_range(request)
+        if not context.is_active():
+            # Вызвавший уже не ждёт ответа (дедлайн, обрыв) — ряды вернулись бы в никуда, кладём обратно.
+            # Остаётся окно между этой проверкой и отправкой ответа
+            self.import_series(dump.data)
+            context.abort(grpc.StatusCode.CANCELLED, "caller went away, series restored")
+        return dump
+
+    def ImportSeries(self, request, context):
+        """Вливает ряды, вынутые ExportRange на другом узле."""
+        if self.storage.wal is not None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "rebalancing is not supported with --wal")
+        try:
+            imported = self.import_series(request.data)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return batch_response(imported, 0)
+
+def build_server(port: str = "50051", max_workers: int = 10, maximum_concurrent_rpcs: int | None = None,
+                 storage: MetricStorage | None = None, stats: ServerStats | None = None,
+                 log: AsyncLog | None = None, watch_interval: float = WATCH_INTERVAL,
+                 admission: AdmissionController | None = None):
+    """Собирает, но не запускает сервер; возвращает (server, порт). Порт "0" — любой свободный."""
+    servicer = VitalSignsServicer(storage, stats, log, watch_interval)
+    # Статистика снаружи: отказы admission попадают в неё с кодом RESOURCE_EXHAUSTED
+    interceptors = [StatsInterceptor(servicer.stats)]
+    if admission is not None:
+        interceptors.append(AdmissionInterceptor(admission))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), interceptors=interceptors,
+                         maximum_concurrent_rpcs=maximum_concurrent_rpcs)
+    metrics_pb2_grpc.add_VitalSignsServiceServicer_to_server(servicer, server)
+    bound = server.add_insecure_port('[::]:' + port)
+    return server, bound
+
+def build_admin_server(address: str, storage: MetricStorage, max_workers: int = 2):
+    """
+    Отдельный сервер ClusterAdminService на address (host:port, порт 0 —
+    любой свободный); возвращает (server, порт). Свой сервер, а не второй
+    порт основного: у grpc.server все сервисы слушают все его порты.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    metrics_pb2_grpc.add_ClusterAdminServiceServicer_to_server(ClusterAdminServicer(storage), server)
+    bound = server.add_insecure_port(address)
+    return server, bound
+
+def serve(port: str = "50051", max_workers: int = 10, maximum_concurrent_rpcs: int | None = None,
+          storage: MetricStorage | None = None, stats: ServerStats | None = None, log: AsyncLog | None = None,
+          watch_interval: float = WATCH_INTERVAL, admission: AdmissionController | None = None):
+    server, _ = build_server(port, max_workers, maximum_concurrent_rpcs, storage, stats, log, watch_interval,
+                             admission)
 
     print(f"Server started, listening on {port}")
 
     server.start()
     server.wait_for_termination()
 
+def main():
+    parser = argparse.ArgumentParser(description="VitalSigns gRPC server")
+    parser.add_argument('--port', default="50051")
+    parser.add_argument('--aio', action='store_true', help="asyncio-сервер (grpc.aio) вместо пула потоков")
+    parser.add_argument('--workers', type=int, default=10, help="потоков в пуле синхронного сервера")
+    parser.add_argument('--max-concurrent-rpcs', type=int, default=None,
+                        help="лимит одновременных RPC (сверх лимита — RESOURCE_EXHAUSTED)")
+    parser.add_argument('--wal', metavar='DIR', default=None,
+                        help="долговременный режим: WAL и снапшоты в DIR, восстановление при старте")
+    parser.add_argument('--wal-sync', action='store_true',
+                        help="отвечать на запись только после fsync её пачки (group commit)")
+    parser.add_argument('--wal-interval', type=float, default=0.005, help="окно group commit, секунды")
+    parser.add_argument('--snapshot-interval', type=float, default=60.0, help="период снапшотов, секунды")
+    parser.add_argument('--raw-tail', type=int, default=DEFAULT_RAW_TAIL,
+                        help="сколько последних сырых значений хранить на ключ (для окон и ExportSamples)")
+    parser.add_argument('--sketch-accuracy', type=float, default=DEFAULT_ACCURACY,
+                        help="относительная ошибка GetPercentiles (память скетча ~ 1/accuracy)")
+    parser.add_argument('--sketch-hours', type=int, default=DEFAULT_SKETCH_HOURS,
+                        help="сколько последних часов хранить скетчи для окон GetPercentiles")
+    parser.add_argument('--memory-budget', type=float, default=0.0,
+                        help="бюджет памяти рядов, МБ: холодные ключи сверх него вытесняются (0 — без лимита)")
+    parser.add_argument('--ttl', type=float, default=0.0,
+                        help="удалять ключи без записи и чтения дольше стольких секунд (0 — никогда)")
+    parser.add_argument('--spill-dir', metavar='DIR', default=None,
+                        help="вытеснять в файлы в DIR (читаются обратно при обращении), а не удалять")
+    parser.add_argument('--sweep-interval', type=float, default=5.0,
+                        help="период учёта памяти и вытеснения, секунды")
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help="писать в лог каждое N-е измерение RecordMetric (0 — не писать)")
+    parser.add_argument('--log-queue', type=int, default=65536,
+                        help="длина очереди лога; при переполнении записи отбрасываются")
+    parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL,
+                        help="не чаще одного обновления WatchAverage за столько секунд")
+    parser.add_argument('--admission', action='store_true',
+                        help="адаптивный лимит одновременных RPC: лишние записи сразу получают RESOURCE_EXHAUSTED")
+    parser.add_argument('--admission-target-ms', type=float, default=20.0,
+                        help="целевая латентность: медленнее — лимит уменьшается")
+    parser.add_argument('--admission-max-limit', type=int, default=None,
+                        help="потолок лимита (по умолчанию --workers, для --aio 256)")
+    parser.add_argument('--admin-address', metavar='HOST:PORT', default=None,
+                        help="адрес служебного ClusterAdminService для переноса данных роутером "
+                             "(loopback или внутренняя сеть; без него узел нельзя ребалансировать)")
+    parser.add_argument('--stats-file', default=None, help="периодически сохранять GetStats в JSON-файл")
+    parser.add_argument('--stats-interval', type=float, default=10.0, help="период записи --stats-file, секунды")
+    args = parser.parse_args()
+    if args.wal_sync and args.aio:
+        parser.error("--wal-sync блокирует поток обработчика и несовместим с --aio")
+    if not 0.0 < args.sketch_accuracy < 1.0:
+        parser.error("--sketch-accuracy должна быть в (0, 1)")
+    if args.spill_dir and not args.memory_budget:
+        parser.error("--spill-dir имеет смысл только с --memory-budget")
+
+    storage = MetricStorage(raw_tail=args.raw_tail, sketch_accuracy=args.sketch_accuracy,
+                            sketch_hours=args.sketch_hours, memory_budget=int(args.memory_budget * 2 ** 20),
+                            ttl=args.ttl, spill_dir=args.spill_dir)
+    if args.memory_budget or args.ttl:
+        storage.sweep_periodically(args.sweep_interval)
+    durability = None
+    if args.wal:
+        durability = Durability(storage, args.wal, sync=args.wal_sync, commit_interval=args.wal_interval,
+                                snapshot_interval=args.snapshot_interval)
+    log = AsyncLog(sample=args.log_sample, capacity=args.log_queue) if args.log_sample else None
+    admission = None
+    if args.admission:
+        max_limit = args.admission_max_limit or (256 if args.aio else args.workers)
+        admission = AdmissionController(args.admission_target_ms / 1000, initial_limit=max_limit,
+                                        max_limit=max_limit)
+    stats = ServerStats(storage, log, admission)
+    if args.stats_file:
+        stats.dump_periodically(args.stats_file, args.stats_interval)
+
+    admin_server = None
+    if args.admin_address:
+        # Синхронный сервер в своих потоках — и рядом с --aio тоже
+        admin_server, _ = build_admin_server(args.admin_address, storage)
+        admin_server.start()
+        print(f"Cluster admin service listening on {args.admin_address}")
+
+    # SIGTERM → SystemExit, чтобы при остановке отработал finally с финальным снапшотом
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if args.aio:
+            from custom_service.aio_server import serve_async
+            asyncio.run(serve_async(args.port, args.max_concurrent_rpcs, storage, stats, log, args.watch_interval,
+                                    admission))
+        else:
+            serve(args.port, args.workers, args.max_concurrent_rpcs, storage, stats, log, args.watch_interval,
+                  admission)
+    finally:
+        if admin_server is not None:
+            admin_server.stop(0)
+        if log is not None:
+            log.close()
+        if durability is not None:
+            durability.close()
+
 if __name__ == '__main__':
-    serve()
+    main()
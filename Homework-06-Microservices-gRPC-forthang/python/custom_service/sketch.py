@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import math
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+DEFAULT_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+DEFAULT_SKETCH_HOURS = 24
+# Значения по модулю меньше считаются нулём
+MIN_INDEXABLE = 1e-9
+
+class DenseStore:
+    """
+    Счётчики подряд идущих ключей: counts[i] — число значений с ключом
+    offset + i. Не больше max_bins корзин; при переполнении нижние ключи
+    схлопываются в самый нижний оставшийся (страдают только низкие квантили).
+    """
+    __slots__ = ("counts", "offset", "total", "max_bins")
+
+    def __init__(self, max_bins: int):
+        self.counts = array('q')
+        self.offset = 0
+        self.total = 0
+        self.max_bins = max_bins
+
+    def add(self, key: int, n: int = 1) -> None:
+        counts = self.counts
+        if not counts:
+            self.offset = key
+            counts.append(0)
+        i = key - self.offset
+        if i < 0:
+            if len(counts) - i > self.max_bins:
+                i = 0
+            else:
+                counts[0:0] = array('q', bytes(8 * -i))
+                self.offset = key
+                i = 0
+        elif i >= len(counts):
+            counts.extend(array('q', bytes(8 * (i + 1 - len(counts)))))
+            if len(counts) > self.max_bins:
+                drop = len(counts) - self.max_bins
+                collapsed = sum(counts[:drop + 1])
+                del counts[:drop]
+                counts[0] = collapsed
+                self.offset += drop
+                i -= drop
+        counts[i] += n
+        self.total += n
+
+    def merge(self, other: "DenseStore") -> None:
+        for i, n in enumerate(other.counts):
+            if n:
+                self.add(other.offset + i, n)
+
+class DDSketch:
+    """
+    DDSketch: квантили с относительной ошибкой не больше `accuracy` при
+    памяти O(log(max/min) / accuracy). Значение v попадает в корзину
+    ceil(log_gamma |v|), gamma = (1 + a) / (1 - a). Скетчи с одинаковой
+    точностью складываются без потери точности — по часам и по узлам.
+    """
+    __slots__ = ("accuracy", "gamma", "log_gamma", "positive", "negative", "zero")
+
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY, max_bins: int = DEFAULT_MAX_BINS):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = DenseStore(max_bins)
+        self.negative = DenseStore(max_bins)
+        self.zero = 0
+
+    @property
+    def count(self) -> int:
+        return self.positive.total + self.negative.total + self.zero
+
+    def _key(self, v: float) -> int:
+        return math.ceil(math.log(v) / self.log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, v: float) -> None:
+        if v > MIN_INDEXABLE:
+            self.positive.add(self._key(v))
+        elif v < -MIN_INDEXABLE:
+            self.negative.add(self._key(-v))
+        else:
+            self.zero += 1
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.accuracy != self.accuracy:
+            raise ValueError("cannot merge sketches with different accuracy")
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zero += other.zero
+
+    def quantile(self, q: float) -> float:
+        """Значение ранга q·(count-1) с относительной ошибкой не больше accuracy."""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        # Отрицательные: больший ключ — меньшее значение
+        neg = self.negative
+        for i in range(len(neg.counts) - 1, -1, -1):
+            seen += neg.counts[i]
+            if seen > rank:
+                return -self._value(neg.offset + i)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        pos = self.positive
+        for i, n in enumerate(pos.counts):
+            seen += n
+            if seen > rank:
+                return self._value(pos.offset + i)
+        return self._value(pos.offset + len(pos.counts) - 1)
+
+    def nbytes(self) -> int:
+        """Примерный объём в памяти вместе с массивами счётчиков."""
+        return (sys.getsizeof(self) + sys.getsizeof(self.positive) + sys.getsizeof(self.positive.counts)
+                + sys.getsizeof(self.negative) + sys.getsizeof(self.negative.counts))
+
+    # zero, затем (offset, число корзин) отрицательного и положительного хранилищ
+    HEAD = struct.Struct('<qqiqi')
+
+    def to_bytes(self) -> bytes:
+        neg, pos = self.negative, self.positive
+        return (self.HEAD.pack(self.zero, neg.offset, len(neg.counts), pos.offset, len(pos.counts))
+                + neg.counts.tobytes() + pos.counts.tobytes())
+
+    def load(self, buf, off: int) -> int:
+        """Читает скетч из buf со смещения off; возвращает смещение за ним."""
+        self.zero, neg_offset, neg_n, pos_offset, pos_n = self.HEAD.unpack_from(buf, off)
+        off += self.HEAD.size
+        for store, offset, n in ((self.negative, neg_offset, neg_n), (self.positive, pos_offset, pos_n)):
+            store.offset = offset
+            store.counts.frombytes(buf[off:off + 8 * n])
+            store.total = sum(store.counts)
+            off += 8 * n
+        return off
+
+class SketchRollup:
+    """Скетчи по часовым корзинам, не больше `capacity` последних часов."""
+    __slots__ = ("width", "capacity", "accuracy", "starts", "sketches")
+
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY, capacity: int = DEFAULT_SKETCH_HOURS,
+                 width: int = 3600):
+        self.width = width
+        self.capacity = capacity
+        self.accuracy = accuracy
+        self.starts = array('q')
+        self.sketches = []
+
+    def _bucket(self, start: int) -> DDSketch | None:
+        starts = self.starts
+        if starts and starts[-1] == start:
+            return self.sketches[-1]
+        i = bisect_left(starts, start)
+        if i < len(starts) and starts[i] == start:
+            return self.sketches[i]
+        if len(starts) >= self.capacity and i == 0:
+            # Старше всех хранимых часов — такой час уже выброшен
+            return None
+        sketch = DDSketch(self.accuracy)
+        starts.insert(i, start)
+        self.sketches.insert(i, sketch)
+        if len(starts) > self.capacity:
+            del starts[0], self.sketches[0]
+        return sketch
+
+    def add(self, ts: int, value: float) -> None:
+        sketch = self._bucket(ts - ts % self.width)
+        if sketch is not None:
+            sketch.add(value)
+
+    def merge(self, other: "SketchRollup") -> None:
+        for start, sketch in zip(other.starts, other.sketches):
+            mine = self._bucket(start)
+            if mine is not None:
+                mine.merge(sketch)
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self) + sys.getsizeof(self.starts) + sys.getsizeof(self.sketches)
+                + sum(sketch.nbytes() for sketch in self.sketches))
+
+    def window(self, lo: int, hi: int) -> DDSketch:
+        """Сумма скетчей часов, пересекающихся с [lo, hi) — окно округляется до целых часов."""
+        merged = DDSketch(self.accuracy)
+        i = bisect_left(self.starts, lo - self.width + 1)
+        j = bisect_left(self.starts, hi)
+        for sketch in self.sketches[i:j]:
+            merged.merge(sketch)
+        return merged
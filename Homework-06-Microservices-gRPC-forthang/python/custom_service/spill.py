@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+
+# Сжимать файл, когда мёртвых байт больше живых и больше этого порога
+COMPACT_MIN_DEAD = 1 << 20
+
+class SpillFile:
+    """
+    Файл вытесненных из памяти рядов одной полосы хранилища: записи
+    дописываются в конец, индекс в памяти — ключ -> (смещение, длина,
+    время последнего доступа) в порядке вытеснения. Прочитанная или
+    истёкшая запись становится мёртвой; когда мёртвого больше, чем
+    живого, файл переписывается. Без своих мьютексов — вызывающий держит
+    мьютекс полосы. Содержимое не переживает перезапуск: файл
+    обнуляется при открытии.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.index = {}
+        self.size = 0
+        self.dead = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def put(self, key, data: bytes, seen: float) -> None:
+        os.pwrite(self._fd, data, self.size)
+        self.index[key] = (self.size, len(data), seen)
+        self.size += len(data)
+
+    def read(self, key) -> bytes:
+        off, length, _ = self.index[key]
+        return os.pread(self._fd, length, off)
+
+    def pop(self, key) -> bytes | None:
+        """Запись ключа с удалением из файла; None, если ключа нет."""
+        if key not in self.index:
+            return None
+        data = self.read(key)
+        self.discard(key)
+        return data
+
+    def discard(self, key) -> None:
+        _, length, _ = self.index.pop(key)
+        self.dead += length
+        if self.dead > max(COMPACT_MIN_DEAD, self.size - self.dead):
+            self.compact()
+
+    def expire(self, before: float) -> list:
+        """Удаляет записи, к которым не обращались с момента before; возвращает их ключи."""
+        expired = []
+        # Индекс упорядочен по вытеснению, а вытесняются самые давние — раньше
+        for key, (_, _, seen) in self.index.items():
+            if seen >= before:
+                break
+            expired.append(key)
+        for key in expired:
+            self.discard(key)
+        return expired
+
+    def compact(self) -> None:
+        tmp = self.path + '.tmp'
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        index, size = {}, 0
+        for key, (off, length, seen) in self.index.items():
+            os.pwrite(fd, os.pread(self._fd, length, off), size)
+            index[key] = (size, length, seen)
+            size += length
+        os.replace(tmp, self.path)
+        os.close(self._fd)
+        self._fd, self.index, self.size, self.dead = fd, index, size, 0
+
+    def close(self) -> None:
+        os.close(self._fd)
+        os.remove(self.path)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+import json
+import os
+import threading
+import time
+
+import grpc
+
+PERCENTILES = {'p50_us': 0.50, 'p90_us': 0.90, 'p99_us': 0.99, 'p999_us': 0.999}
+
+class Histogram:
+    """
+    HDR-гистограмма целых значений (микросекунды). До 2**bits значения
+    хранятся точно, дальше на каждую степень двойки приходится 2**(bits-1)
+    корзин, то есть относительная ошибка не больше 2**(1-bits).
+    """
+
+    def __init__(self, bits: int = 8, counts=None):
+        self.bits = bits
+        self.sub = 1 << bits
+        self.half = self.sub >> 1
+        self.counts = list(counts) if counts else []
+        self.total = sum(self.counts)
+
+    def _index(self, value: int) -> int:
+        if value < self.sub:
+            return value
+        shift = value.bit_length() - self.bits
+        return shift * self.half + (value >> shift)
+
+    def _upper(self, index: int) -> int:
+        """Наибольшее значение, попадающее в корзину index."""
+        if index < self.sub:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        i = self._index(max(0, value))
+        if i >= len(self.counts):
+            self.counts.extend([0] * (i + 1 - len(self.counts)))
+        self.counts[i] += 1
+        self.total += 1
+
+    def merge(self, other: "Histogram") -> None:
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+
+    def percentile(self, q: float) -> int:
+        if not self.total:
+            return 0
+        rank = max(1, int(q * self.total + 0.5))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self._upper(i)
+        return self._upper(len(self.counts) - 1)
+
+    def mean(self) -> float:
+        if not self.total:
+            return 0.0
+        return sum(self._upper(i) * c for i, c in enumerate(self.counts) if c) / self.total
+
+    def buckets(self) -> list[list[int]]:
+        """Непустые корзины [верхняя граница, число] — для сравнения прогонов."""
+        return [[self._upper(i), c] for i, c in enumerate(self.counts) if c]
+
+class _MethodStats:
+    __slots__ = ("calls", "codes", "hist")
+
+    def __init__(self):
+        self.calls = 0
+        self.codes = {}
+        self.hist = Histogram()
+
+class _ThreadStats:
+    __slots__ = ("methods", "in_flight")
+
+    def __init__(self):
+        self.methods = {}
+        self.in_flight = 0
+
+class ServerStats:
+    """
+    Счётчики RPC по методам: число вызовов, коды завершения, гистограмма
+    латентности и число RPC в работе. Каждый поток пишет только в свои
+    счётчики (threading.local), поэтому на горячем пути нет общих мьютексов;
+    snapshot() складывает счётчики всех потоков. Чтение идёт без остановки
+    записи, так что снимок согласован лишь приблизительно.
+    """
+
+    def __init__(self, storage=None, log=None, admission=None):
+        self.storage = storage
+        # AsyncLog сервера: в снимок попадают его счётчики записанного и отброшенного
+        self.log = log
+        # AdmissionController: текущий лимит и число отказов
+        self.admission = admission
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _mine(self) -> _ThreadStats:
+        mine = getattr(self._local, 'stats', None)
+        if mine is None:
+            mine = self._local.stats = _ThreadStats()
+            with self._lock:
+                self._threads.append(mine)
+        return mine
+
+    def begin(self) -> tuple[_ThreadStats, float]:
+        mine = self._mine()
+        mine.in_flight += 1
+        return mine, time.perf_counter()
+
+    def end(self, token: tuple[_ThreadStats, float], method: str, code: grpc.StatusCode) -> None:
+        # Завершение приходит в тот же поток, что и начало: и в пуле, и в event loop
+        mine, start = token
+        mine.in_flight -= 1
+        stats = mine.methods.get(method)
+        if stats is None:
+            stats = mine.methods[method] = _MethodStats()
+        stats.calls += 1
+        stats.codes[code.name] = stats.codes.get(code.name, 0) + 1
+        stats.hist.record(int((time.perf_counter() - start) * 1e6))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            threads = list(self._threads)
+        merged = {}
+        for mine in threads:
+            for method, stats in list(mine.methods.items()):
+                total = merged.setdefault(method, _MethodStats())
+                total.calls += stats.calls
+                for code, n in list(stats.codes.items()):
+                    total.codes[code] = total.codes.get(code, 0) + n
+                total.hist.merge(stats.hist)
+
+        methods = []
+        for method, stats in sorted(merged.items()):
+            entry = {'method': method, 'calls': stats.calls, 'codes': stats.codes,
+                     'mean_us': round(stats.hist.mean(), 1)}
+            for name, q in PERCENTILES.items():
+                entry[name] = stats.hist.percentile(q)
+            entry['max_us'] = stats.hist.percentile(1.0)
+            methods.append(entry)
+
+        stripe_keys = self.storage.stripe_sizes() if self.storage is not None else []
+        memory = self.storage.memory_stats() if self.storage is not None else {}
+        return {
+            'uptime_s': round(time.time() - self.started, 3),
+            'in_flight': sum(mine.in_flight for mine in threads),
+            'methods': methods,
+            'keys': sum(stripe_keys),
+            'stripe_keys': stripe_keys,
+            'log_written': self.log.written if self.log is not None else 0,
+            'log_dropped': self.log.dropped if self.log is not None else 0,
+            'admission_limit': self.admission.limit if self.admission is not None else 0.0,
+            'admission_rejected': self.admission.rejected if self.admission is not None else 0,
+            **memory,
+        }
+
+    def dump_periodically(self, path: str, interval: float) -> threading.Thread:
+        """Раз в interval секунд перезаписывает path JSON-снимком (через временный файл)."""
+        def run():
+            while True:
+                time.sleep(interval)
+                tmp = path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(self.snapshot(), f, indent=2)
+                os.replace(tmp, path)
+
+        thread = threading.Thread(target=run, name="stats-dump", daemon=True)
+        thread.start()
+        return thread
+
+def _code(context, failed: bool) -> grpc.StatusCode:
+    """Код завершения RPC: выставленный через abort/set_code, иначе OK или UNKNOWN при исключении."""
+    code = context.code()
+    if isinstance(code, grpc.StatusCode):
+        return code
+    return grpc.StatusCode.UNKNOWN if failed else grpc.StatusCode.OK
+
+# (request_streaming, response_streaming) -> поле RpcMethodHandler и фабрика обработчика
+HANDLER_KINDS = {
+    (False, False): ('unary_unary', grpc.unary_unary_rpc_method_handler),
+    (True, False): ('stream_unary', grpc.stream_unary_rpc_method_handler),
+    (False, True): ('unary_stream', grpc.unary_stream_rpc_method_handler),
+    (True, True): ('stream_stream', grpc.stream_stream_rpc_method_handler),
+}
+
+def _rewrap(handler, wrapped):
+    _, factory = HANDLER_KINDS[handler.request_streaming, handler.response_streaming]
+    return factory(wrapped, request_deserializer=handler.request_deserializer,
+                   response_serializer=handler.response_serializer)
+
+class StatsInterceptor(grpc.ServerInterceptor):
+    """Перехватчик синхронного сервера: засекает каждый RPC и пишет его в ServerStats."""
+
+    def __init__(self, stats: ServerStats):
+        self.stats = stats
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        behavior = getattr(handler, HANDLER_KINDS[handler.request_streaming, handler.response_streaming][0])
+        stats = self.stats
+
+        if handler.response_streaming:
+            def wrapped(request, context):
+                token = stats.begin()
+                failed = True
+                try:
+                    yield from behavior(request, context)
+                    failed = False
+                finally:
+                    stats.end(token, method, _code(context, failed))
+        else:
+            def wrapped(request, context):
+                token = stats.begin()
+                failed = True
+                try:
+                    response = behavior(request, context)
+                    failed = False
+                    return response
+                finally:
+                    stats.end(token, method, _code(context, failed))
+
+        return _rewrap(handler, wrapped)
+
+class AsyncStatsInterceptor(grpc.aio.ServerInterceptor):
+    """То же для grpc.aio: обработчики — корутины и асинхронные генераторы."""
+
+    def __init__(self, stats: ServerStats):
+        self.stats = stats
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        behavior = getattr(handler, HANDLER_KINDS[handler.request_streaming, handler.response_streaming][0])
+        stats = self.stats
+
+        if handler.response_streaming:
+            async def wrapped(request, context):
+                token = stats.begin()
+                failed = True
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                    failed = False
+                finally:
+                    stats.end(token, method, _code(context, failed))
+        else:
+            async def wrapped(request, context):
+                token = stats.begin()
+                failed = True
+                try:
+                    response = await behavior(request, context)
+                    failed = False
+                    return response
+                finally:
+                    stats.end(token, method, _code(context, failed))
+
+        return _rewrap(handler, wrapped)
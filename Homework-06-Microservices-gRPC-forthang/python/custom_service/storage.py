@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+from custom_service.keytable import TYPE_SLOTS, KeyTable
+from custom_service.sketch import DEFAULT_ACCURACY, DEFAULT_SKETCH_HOURS
+from custom_service.spill import SpillFile
+from custom_service.timeseries import DEFAULT_RAW_TAIL, DEFAULT_TIERS, Aggregate, TimeSeries
+from custom_service.wal import dump_series, encode_record, load_series
+from custom_service.watch import Watchers
+
+# Память ключа сверх TimeSeries.nbytes(): слот KeyTable (ссылка, агрегат в колонках),
+# доля строки user_id и записи словаря номеров, учёт вытеснения
+KEY_OVERHEAD = 200
+# Вытеснение при превышении бюджета освобождает полосу до этой доли её бюджета
+EVICT_TO = 0.9
+
+
+def key_hash(user_id: str) -> int:
+    """Стабильный 64-битный хэш user_id, одинаковый во всех процессах и узлах кластера."""
+    return int.from_bytes(hashlib.blake2b(user_id.encode(), digest_size=8).digest(), 'little')
+
+
+class MetricStorage:
+    """
+    In-memory хранилище агрегатов и временных рядов с lock striping.
+
+    Ключи распределены по `stripes` независимым таблицам KeyTable, каждая
+    под своим мьютексом; номер полосы — хэш user_id. Потоки
+    ThreadPoolExecutor, работающие с разными пользователями, не ждут друг
+    друга. Внутри полосы ключ — плотный слот (номер пользователя, тип):
+    агрегаты лежат в колонках array, поиск — индексация.
+
+    С `memory_budget` (байт) или `ttl` (секунд) ключи вытесняются, см.
+    sweep(): холодные сверх бюджета — в файлы `spill_dir` (по файлу на
+    полосу, обратно читаются при первом обращении) или, без него, удаляются;
+    ключи без обращений дольше ttl удаляются и из памяти, и из файлов.
+    """
+
+    def __init__(self, stripes: int = 64, tiers=DEFAULT_TIERS, raw_tail: int = DEFAULT_RAW_TAIL,
+                 sketch_accuracy: float = DEFAULT_ACCURACY, sketch_hours: int = DEFAULT_SKETCH_HOURS,
+                 memory_budget: int = 0, ttl: float = 0.0, spill_dir: str | None = None,
+                 type_slots: int = TYPE_SLOTS):
+        self.stripes = stripes
+        # Параметры TimeSeries каждого ключа: уровни свёрток, длина сырого хвоста,
+        # относительная точность квантилей и число часовых скетчей
+        self.tiers = tiers
+        self.raw_tail = raw_tail
+        self.sketch_accuracy = sketch_accuracy
+        self.sketch_hours = sketch_hours
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._shards = [KeyTable(type_slots) for _ in range(stripes)]
+        # WriteAheadLog в долговременном режиме (см. wal.Durability), иначе None
+        self.wal = None
+        # Подписчики WatchAverage; будятся после записи в их ключ, уже без мьютекса полосы
+        self.watchers = Watchers()
+
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        # Слоты, к которым обращались после прошлого sweep(), — бит обращения, как в CLOCK.
+        # Без бюджета и TTL не ведётся, горячий путь ничего не платит
+        self._touched = [set() for _ in range(stripes)] if memory_budget or ttl else None
+        # Слот -> (время обращения, замеченного sweep(), байт); порядок — от давних к свежим
+        self._seen = [{} for _ in range(stripes)]
+        self._bytes = [0] * stripes
+        self._reloaded = [0] * stripes
+        self.evicted = 0
+        self.expired = 0
+        self._spill = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spill = [SpillFile(os.path.join(spill_dir, f"{i:03d}.spill")) for i in range(stripes)]
+
+    def stripe_of(self, user_id: str) -> int:
+        return hash(user_id) % self.stripes
+
+    def _slot(self, i: int, user_id: str, metric_type: int, create: bool) -> int:
+        """
+        Слот ключа в полосе i (под её мьютексом): из таблицы, из файла
+        вытеснения или, при create, новый. -1 — ключа нет.
+        """
+        table = self._shards[i]
+        # KeyTable.find без вызова метода: это самый частый путь
+        n = table.ids.get(user_id)
+        slot = n * table.type_slots + metric_type if n is not None and 0 <= metric_type < table.type_slots else -1
+        if slot < 0 or table.series[slot] is None:
+            series = self._reload(i, (user_id, metric_type))
+            if series is None:
+                if not create:
+                    return -1
+                series = self.new_series()
+            slot = table.insert(user_id, metric_type, series)
+        if self._touched is not None:
+            self._touched[i].add(slot)
+        return slot
+
+    def _reload(self, i: int, key) -> TimeSeries | None:
+        if self._spill is None or key not in self._spill[i]:
+            return None
+        self._reloaded[i] += 1
+        return self._decode(self._spill[i].pop(key))
+
+    def _encode(self, key, series: TimeSeries) -> bytes:
+        return zlib.compress(dump_series(self, [(key, series)]), 1)
+
+    def _decode(self, data: bytes) -> TimeSeries:
+        return load_series(self, zlib.decompress(data))[0][1]
+
+    def _spilled(self, i: int, predicate) -> list:
+        """Вытесненные ключи полосы i, для которых predicate(ключ) истинен: [(ключ, ряд)], файл не меняется."""
+        if self._spill is None:
+            return []
+        spill = self._spill[i]
+        return [(key, self._decode(spill.read(key))) for key in spill.index if predicate(key)]
+
+    def _forget(self, i: int, slot: int) -> None:
+        """Снимает слот, освобождённый в полосе i, с учёта памяти."""
+        entry = self._seen[i].pop(slot, None)
+        if entry is not None:
+            self._bytes[i] -= entry[1]
+
+    def new_series(self) -> TimeSeries:
+        return TimeSeries(self.tiers, self.raw_tail, self.sketch_accuracy, self.sketch_hours)
+
+    def record(self, user_id: str, metric_type: int, value: float, timestamp: int = 0) -> None:
+        """timestamp — Unix-время в секундах; 0 означает «сейчас»."""
+        i = self.stripe_of(user_id)
+        ts = timestamp or int(time.time())
+        wal = self.wal
+        record = wal and encode_record(user_id, metric_type, value, ts)
+        with self._locks[i]:
+            table = self._shards[i]
+            slot = self._slot(i, user_id, metric_type, True)
+            table.add(slot, value)
+            table.series[slot].add(ts, value)
+            # В WAL под мьютексом полосы: порядок записей в журнале совпадает с порядком применения
+            seq = wal and wal.append([record])
+        if wal:
+            wal.commit(seq)
+        self.watchers.notify((user_id, metric_type))
+
+    def record_many(self, user_id: str, metric_type: int, values, timestamps=()) -> None:
+        """Пачка значений одного ключа — одно взятие мьютекса. Без timestamps все значения получают текущее время."""
+        if not timestamps:
+            timestamps = [int(time.time())] * len(values)
+        else:
+            now = int(time.time())
+            timestamps = [ts or now for ts in timestamps]
+        i = self.stripe_of(user_id)
+        wal = self.wal
+        records = wal and [encode_record(user_id, metric_type, v, ts) for v, ts in zip(values, timestamps)]
+        with self._locks[i]:
+            table = self._shards[i]
+            slot = self._slot(i, user_id, metric_type, True)
+            table.add_many(slot, values)
+            table.series[slot].add_many(timestamps, values)
+            seq = wal and wal.append(records)
+        if wal:
+            wal.commit(seq)
+        self.watchers.notify((user_id, metric_type))
+
+    def record_items(self, items) -> None:
+        """Смешанные (user_id, type, value, timestamp): группируем по полосам, по одному мьютексу на полосу."""
+        now = int(time.time())
+        by_stripe = {}
+        for user_id, metric_type, value, timestamp in items:
+            by_stripe.setdefault(self.stripe_of(user_id), []).append(
+                ((user_id, metric_type), value, timestamp or now))
+        wal = self.wal
+        seq = 0
+        for i, group in by_stripe.items():
+            table = self._shards[i]
+            records = wal and [encode_record(*key, value, ts) for key, value, ts in group]
+            with self._locks[i]:
+                for (user_id, metric_type), value, ts in group:
+                    slot = self._slot(i, user_id, metric_type, True)
+                    table.add(slot, value)
+                    table.series[slot].add(ts, value)
+                seq = wal and wal.append(records)
+        if wal and seq:
+            wal.commit(seq)
+        if self.watchers:
+            for key in {key for group in by_stripe.values() for key, _, _ in group}:
+                self.watchers.notify(key)
+
+    def get(self, user_id: str, metric_type: int) -> Aggregate:
+        """Снимок агрегата за всё время (пустой, если данных нет)."""
+        i = self.stripe_of(user_id)
+        with self._locks[i]:
+            slot = self._slot(i, user_id, metric_type, False)
+            return self._shards[i].aggregate(slot) if slot >= 0 else Aggregate()
+
+    def window(self, user_id: str, metric_type: int, from_ts: int, to_ts: int) -> tuple[float, int]:
+        """Сумма и количество значений с временем в [from_ts, to_ts)."""
+        i = self.stripe_of(user_id)
+        with self._locks[i]:
+            slot = self._slot(i, user_id, metric_type, False)
+            return self._shards[i].series[slot].window(from_ts, to_ts) if slot >= 0 else (0.0, 0)
+
+    def sum_counts(self, keys, lo: int | None = None, hi: int | None = None) -> list[tuple[float, int]]:
+        """
+        Сумма и количество значений многих ключей — за всё время или за окно
+        [lo, hi) — в порядке keys. Ключи группируются по полосам: по одному
+        взятию мьютекса на полосу, а не на ключ.
+        """
+        by_stripe = {}
+        for n, (user_id, _) in enumerate(keys):
+            by_stripe.setdefault(self.stripe_of(user_id), []).append(n)
+        out = [(0.0, 0)] * len(keys)
+        for i, group in by_stripe.items():
+            table = self._shards[i]
+            with self._locks[i]:
+                for n in group:
+                    user_id, metric_type = keys[n]
+                    slot = self._slot(i, user_id, metric_type, False)
+                    if slot >= 0:
+                        out[n] = ((table.total[slot], table.count[slot]) if lo is None
+                                  else table.series[slot].window(lo, hi))
+        return out
+
+    def quantiles(self, user_id: str, metric_type: int, qs, from_ts: int | None = None,
+                  to_ts: int | None = None) -> tuple[list[float], int]:
+        """Квантили qs и число значений: за всё время или по часам окна [from_ts, to_ts)."""
+        i = self.stripe_of(user_id)
+        with self._locks[i]:
+            slot = self._slot(i, user_id, metric_type, False)
+            if slot < 0:
+                return [0.0] * len(qs), 0
+            return self._shards[i].series[slot].quantiles(qs, from_ts, to_ts)
+
+    def samples(self, user_id: str = "", metric_type: int = 0, lo: int = -(1 << 62), hi: int = 1 << 62):
+        """
+        Сырые значения с временем в [lo, hi): генератор (ключ, timestamps, values)
+        с копиями колонок. Пустой user_id или нулевой metric_type — все.
+        Мьютекс полосы держится только на время копирования её хвостов.
+        Вытесненные ключи читаются из файла, но в память не возвращаются.
+        """
+        def wanted(key):
+            return (not user_id or key[0] == user_id) and (not metric_type or key[1] == metric_type)
+
+        stripes = [self.stripe_of(user_id)] if user_id else range(self.stripes)
+        for i in stripes:
+            table = self._shards[i]
+            with self._locks[i]:
+                items = [(table.key_of(slot), table.series[slot]) for slot in table.slots()]
+                items = [(key, series) for key, series in items if wanted(key)] + self._spilled(i, wanted)
+                chunk = [(key, *series.raw.slice(lo, hi)) for key, series in items]
+            yield from chunk
+
+    def dump_stripe(self, i: int, encode) -> list:
+        """
+        Кодирует все ключи полосы i, включая вытесненные, под её мьютексом:
+        encode(key, agg, series) -> bytes.
+        """
+        table = self._shards[i]
+        with self._locks[i]:
+            chunks = [encode(table.key_of(slot), table.aggregate(slot), table.series[slot])
+                      for slot in table.slots()]
+            chunks += [encode(key, series.agg, series) for key, series in self._spilled(i, lambda key: True)]
+            return chunks
+
+    def take(self, predicate) -> list:
+        """Вынимает из хранилища ключи, для user_id которых predicate истинен; возвращает [(ключ, ряд)]."""
+        taken = []
+        for i in range(self.stripes):
+            table = self._shards[i]
+            with self._locks[i]:
+                for slot in table.slots():
+                    key = table.key_of(slot)
+                    if predicate(key[0]):
+                        taken.append((key, table.pop(slot)))
+                        self._forget(i, slot)
+                if self._spill is not None:
+                    spill = self._spill[i]
+                    keys = [key for key in spill.index if predicate(key[0])]
+                    taken += [(key, self._decode(spill.pop(key))) for key in keys]
+        return taken
+
+    def merge(self, key, series: TimeSeries) -> None:
+        """Вливает ряд, пришедший с другого узла, в ряд того же ключа."""
+        user_id, metric_type = key
+        i = self.stripe_of(user_id)
+        table = self._shards[i]
+        with self._locks[i]:
+            slot = self._slot(i, user_id, metric_type, False)
+            if slot < 0:
+                slot = table.insert(user_id, metric_type, series)
+                if self._touched is not None:
+                    self._touched[i].add(slot)
+            else:
+                table.merge(slot, series.agg)
+                table.series[slot].merge(series)
+
+    def restore(self, key, series: TimeSeries) -> None:
+        """Кладёт восстановленный из снапшота ряд (только при старте)."""
+        user_id, metric_type = key
+        i = self.stripe_of(user_id)
+        slot = self._shards[i].insert(user_id, metric_type, series)
+        if self._touched is not None:
+            self._touched[i].add(slot)
+
+    def sweep(self) -> None:
+        """
+        Учёт памяти и вытеснение, по полосе за раз под её мьютексом.
+
+        Слоты с битом обращения получают текущее время и пересчитанный
+        размер и переезжают в конец порядка _seen, бит сбрасывается. Так
+        порядок — приближённый LRU с точностью до периода sweep(), а
+        горячий путь только добавляет слот в множество. Затем с начала
+        порядка удаляются ключи старше ttl и, если полоса больше своей доли
+        бюджета, вытесняются самые давние — до EVICT_TO доли.
+        """
+        if self._touched is None:
+            return
+        now = time.monotonic()
+        share = self.memory_budget / self.stripes
+        for i in range(self.stripes):
+            with self._locks[i]:
+                self._sweep_stripe(i, now, share)
+
+    def _sweep_stripe(self, i: int, now: float, share: float) -> None:
+        table, seen, touched = self._shards[i], self._seen[i], self._touched[i]
+        for slot in touched:
+            series = table.series[slot]
+            self._forget(i, slot)
+            if series is not None:
+                size = series.nbytes() + KEY_OVERHEAD
+                seen[slot] = (now, size)
+                self._bytes[i] += size
+        touched.clear()
+        spill = self._spill[i] if self._spill is not None else None
+
+        if self.ttl:
+            old = []
+            for slot, (at, _) in seen.items():
+                if at >= now - self.ttl:
+                    break
+                old.append(slot)
+            for slot in old:
+                table.pop(slot)
+                self._forget(i, slot)
+            self.expired += len(old) + (len(spill.expire(now - self.ttl)) if spill is not None else 0)
+
+        if share and self._bytes[i] > share:
+            excess = self._bytes[i] - share * EVICT_TO
+            cold = []
+            for slot, (at, size) in seen.items():
+                if excess <= 0:
+                    break
+                cold.append((slot, at))
+                excess -= size
+            for slot, at in cold:
+                key = table.key_of(slot)
+                series = table.pop(slot)
+                self._forget(i, slot)
+                if spill is not None:
+                    spill.put(key, self._encode(key, series), at)
+            self.evicted += len(cold)
+
+    def sweep_periodically(self, interval: float) -> threading.Thread:
+        """Запускает sweep() раз в interval секунд в фоновом потоке."""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.sweep()
+
+        thread = threading.Thread(target=run, name="storage-sweep", daemon=True)
+        thread.start()
+        return thread
+
+    def memory_stats(self) -> dict:
+        """Счётчики для GetStats (без мьютексов): учтённая память, вытеснения, файлы вытеснения."""
+        return {
+            'memory_bytes': sum(self._bytes),
+            'evicted': self.evicted,
+            'expired': self.expired,
+            'spilled_keys': sum(map(len, self._spill)) if self._spill is not None else 0,
+            'reloaded': sum(self._reloaded),
+        }
+
+    def stripe_sizes(self) -> list[int]:
+        """Число ключей в памяти в каждой полосе (без мьютексов, для статистики)."""
+        return [len(table) for table in self._shards]
+
+    def __len__(self) -> int:
+        return sum(len(table) for table in self._shards)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+import math
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from custom_service.sketch import DEFAULT_ACCURACY, DEFAULT_SKETCH_HOURS, DDSketch, SketchRollup
+
+# Уровни свёртки по умолчанию: (ширина корзины в секундах, сколько корзин хранить)
+DEFAULT_TIERS = ((3600, 24 * 90), (60, 24 * 60))
+DEFAULT_RAW_TAIL = 1024
+
+class Aggregate:
+    """
+    Инкрементальная статистика по одному ключу (user_id, MetricType).
+    Обновляется за O(1), сырые значения не хранятся.
+    """
+    __slots__ = ("count", "total", "total_sq", "min", "max")
+
+    def __init__(self, count: int = 0, total: float = 0.0, total_sq: float = 0.0,
+                 lo: float = math.inf, hi: float = -math.inf):
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.min = lo
+        self.max = hi
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values) -> None:
+        if not values:
+            return
+        self.count += len(values)
+        self.total += math.fsum(values)
+        self.total_sq += math.fsum(v * v for v in values)
+        self.min = min(self.min, min(values))
+        self.max = max(self.max, max(values))
+
+    def merge(self, other: "Aggregate") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def copy(self) -> "Aggregate":
+        return Aggregate(self.count, self.total, self.total_sq, self.min, self.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def variance(self) -> float:
+        if not self.count:
+            return 0.0
+        return max(0.0, self.total_sq / self.count - self.mean ** 2)
+
+class Rollup:
+    """
+    Корзины фиксированной ширины: отсортированные начала корзин и
+    параллельные массивы сумм и количеств. Хранится не больше `capacity`
+    корзин; самые старые выбрасываются, `floor` — момент, начиная с
+    которого данные уровня полны.
+    """
+    __slots__ = ("width", "capacity", "starts", "sums", "counts", "floor")
+
+    def __init__(self, width: int, capacity: int):
+        self.width = width
+        self.capacity = capacity
+        self.starts = array('q')
+        self.sums = array('d')
+        self.counts = array('q')
+        self.floor = -math.inf
+
+    def _bucket(self, start: int) -> int:
+        """Индекс корзины с началом start; создаёт её при необходимости."""
+        starts = self.starts
+        i = len(starts) - 1
+        if i < 0 or starts[i] != start:
+            # Обычно время растёт и корзина добавляется в конец
+            i = bisect_left(starts, start)
+            if i == len(starts) or starts[i] != start:
+                starts.insert(i, start)
+                self.sums.insert(i, 0.0)
+                self.counts.insert(i, 0)
+        return i
+
+    def _trim(self) -> None:
+        starts = self.starts
+        if len(starts) > self.capacity:
+            drop = len(starts) - self.capacity
+            self.floor = starts[drop - 1] + self.width
+            del starts[:drop], self.sums[:drop], self.counts[:drop]
+
+    def add(self, ts: int, value: float) -> None:
+        if ts < self.floor:
+            return
+        i = self._bucket(ts - ts % self.width)
+        self.sums[i] += value
+        self.counts[i] += 1
+        self._trim()
+
+    def merge(self, other: "Rollup") -> None:
+        """Складывает корзины другого ряда той же ширины; полнота — с более позднего floor."""
+        self.floor = max(self.floor, other.floor)
+        for start, total, count in zip(other.starts, other.sums, other.counts):
+            if start >= self.floor:
+                i = self._bucket(start)
+                self.sums[i] += total
+                self.counts[i] += count
+        i = bisect_left(self.starts, self.floor)
+        del self.starts[:i], self.sums[:i], self.counts[:i]
+        self._trim()
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sum(map(sys.getsizeof, (self.starts, self.sums, self.counts)))
+
+    def range_sum(self, lo: int, hi: int) -> tuple[float, int]:
+        """Сумма и количество по корзинам с началом в [lo, hi)."""
+        i = bisect_left(self.starts, lo)
+        j = bisect_left(self.starts, hi)
+        return math.fsum(self.sums[i:j]), sum(self.counts[i:j])
+
+class RawTail:
+    """
+    Последние `capacity` сырых значений колонками array('q') времени и
+    array('d') значений, отсортированные по времени. Старые значения
+    срезаются пачкой, когда хвост вырастает на `slack` сверх capacity, —
+    иначе каждое добавление в полный хвост сдвигало бы весь массив.
+    """
+    __slots__ = ("capacity", "slack", "timestamps", "values", "floor")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slack = max(1, capacity // 2)
+        self.timestamps = array('q')
+        self.values = array('d')
+        self.floor = -math.inf
+
+    def add(self, ts: int, value: float) -> None:
+        if ts < self.floor:
+            return
+        if not self.timestamps or ts >= self.timestamps[-1]:
+            self.timestamps.append(ts)
+            self.values.append(value)
+        else:
+            i = bisect_right(self.timestamps, ts)
+            self.timestamps.insert(i, ts)
+            self.values.insert(i, value)
+        if len(self.timestamps) >= self.capacity + self.slack:
+            drop = len(self.timestamps) - self.capacity
+            self.floor = self.timestamps[drop - 1] + 1
+            del self.timestamps[:drop], self.values[:drop]
+
+    def merge(self, other: "RawTail") -> None:
+        self.floor = max(self.floor, other.floor)
+        for ts, value in zip(other.timestamps, other.values):
+            self.add(ts, value)
+        i = bisect_left(self.timestamps, self.floor)
+        del self.timestamps[:i], self.values[:i]
+
+    def range_sum(self, lo: int, hi: int) -> tuple[float, int]:
+        i = bisect_left(self.timestamps, lo)
+        j = bisect_left(self.timestamps, hi)
+        return math.fsum(self.values[i:j]), j - i
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.timestamps) + sys.getsizeof(self.values)
+
+    def slice(self, lo: int, hi: int) -> tuple[array, array]:
+        """Копии колонок времени и значений для времени в [lo, hi)."""
+        i = bisect_left(self.timestamps, lo)
+        j = bisect_left(self.timestamps, hi)
+        return self.timestamps[i:j], self.values[i:j]
+
+class TimeSeries:
+    """
+    Данные одного ключа (user_id, MetricType): агрегат за всё время,
+    свёртки по часам и минутам, ограниченный хвост сырых значений и
+    квантильные скетчи — за всё время и по последним `sketch_hours` часам.
+    Память на ключ ограничена при любой частоте измерений.
+
+    add/add_many/merge ведут только историю; агрегат `agg` обновляет
+    владелец. Пока ряд лежит в KeyTable хранилища, агрегат живёт в её
+    колонках, а agg — None; у ряда вне таблицы (снапшот, перенос между
+    узлами, файл вытеснения) агрегат — в agg.
+    """
+    __slots__ = ("agg", "tiers", "raw", "sketch", "hourly")
+
+    def __init__(self, tiers=DEFAULT_TIERS, raw_tail: int = DEFAULT_RAW_TAIL,
+                 sketch_accuracy: float = DEFAULT_ACCURACY, sketch_hours: int = DEFAULT_SKETCH_HOURS):
+        self.agg = Aggregate()
+        # От крупных корзин к мелким
+        self.tiers = [Rollup(width, capacity) for width, capacity in tiers]
+        self.raw = RawTail(raw_tail)
+        self.sketch = DDSketch(sketch_accuracy)
+        self.hourly = SketchRollup(sketch_accuracy, sketch_hours)
+
+    def add(self, ts: int, value: float) -> None:
+        for tier in self.tiers:
+            tier.add(ts, value)
+        self.raw.add(ts, value)
+        self.sketch.add(value)
+        self.hourly.add(ts, value)
+
+    def add_many(self, timestamps, values) -> None:
+        for tier in self.tiers:
+            for ts, value in zip(timestamps, values):
+                tier.add(ts, value)
+        for ts, value in zip(timestamps, values):
+            self.raw.add(ts, value)
+            self.sketch.add(value)
+            self.hourly.add(ts, value)
+
+    def merge(self, other: "TimeSeries") -> None:
+        """Вливает историю ряда того же ключа с другого узла (при ребалансировке)."""
+        for tier, theirs in zip(self.tiers, other.tiers):
+            tier.merge(theirs)
+        self.raw.merge(other.raw)
+        self.sketch.merge(other.sketch)
+        self.hourly.merge(other.hourly)
+
+    def quantiles(self, qs, lo: int | None = None, hi: int | None = None) -> tuple[list[float], int]:
+        """
+        Квантили qs и число значений за всё время или, если задано окно,
+        по часовым скетчам, пересекающим [lo, hi) (окно округляется до часов).
+        """
+        sketch = self.sketch if lo is None else self.hourly.window(lo, hi)
+        return [sketch.quantile(q) for q in qs], sketch.count
+
+    def nbytes(self) -> int:
+        """Примерный объём истории ряда в памяти (с запасом ёмкости массивов) — для бюджета памяти хранилища."""
+        return (sys.getsizeof(self) + sum(tier.nbytes() for tier in self.tiers)
+                + self.raw.nbytes() + self.sketch.nbytes() + self.hourly.nbytes())
+
+    def _floor(self, level: int):
+        return self.tiers[level].floor if level < len(self.tiers) else self.raw.floor
+
+    def window(self, lo: int, hi: int, level: int = 0) -> tuple[float, int]:
+        """
+        Сумма и количество значений с временем в [lo, hi).
+        Внутренняя выровненная часть окна берётся из корзин уровня, края —
+        рекурсивно из более мелких уровней. Если мелкий уровень край уже
+        выбросил, край округляется наружу до целых корзин текущего уровня.
+        """
+        if lo >= hi:
+            return 0.0, 0
+        if level == len(self.tiers):
+            return self.raw.range_sum(lo, hi)
+
+        rollup = self.tiers[level]
+        w = rollup.width
+        finer = self._floor(level + 1)
+        a = lo // w * w if lo < finer else -(-lo // w) * w
+        b = -(-hi // w) * w if hi // w * w < finer else hi // w * w
+        if a >= b:
+            return self.window(lo, hi, level + 1)
+
+        total, count = rollup.range_sum(a, b)
+        left = self.window(lo, a, level + 1)
+        right = self.window(b, hi, level + 1)
+        return total + left[0] + right[0], count + left[1] + right[1]
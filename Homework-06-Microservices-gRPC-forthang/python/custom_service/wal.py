@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from custom_service.sketch import DDSketch
+from custom_service.timeseries import Aggregate, TimeSeries
+
+# Запись WAL фиксированного размера: user_id, type, value, timestamp + crc32 тела
+USER_ID_BYTES = 64
+RECORD_BODY = struct.Struct(f'<{USER_ID_BYTES}sidq')
+RECORD_SIZE = RECORD_BODY.size + 4
+
+SNAPSHOT_FILE = "snapshot.bin"
+SNAPSHOT_MAGIC = b'VSN2'
+# magic, число уровней свёртки, число ключей, seq_lo, seq_hi
+SNAPSHOT_HEAD = struct.Struct('<4sIqqq')
+TIER_HEAD = struct.Struct('<qq')
+# Точность и число часов квантильных скетчей
+SKETCH_HEAD = struct.Struct('<dq')
+# Пачка рядов для переноса между узлами: magic, число уровней, число ключей
+DUMP_MAGIC = b'VSD2'
+DUMP_HEAD = struct.Struct('<4sII')
+
+def encode_record(user_id: str, metric_type: int, value: float, ts: int) -> bytes:
+    body = RECORD_BODY.pack(user_id.encode(), metric_type, value, ts)
+    return body + zlib.crc32(body).to_bytes(4, 'little')
+
+def _segment_name(start: int) -> str:
+    return f"{start:020d}.wal"
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class WriteAheadLog:
+    """
+    Append-only журнал измерений в каталоге `path`, разбитый на сегменты.
+
+    Запись с номером seq (с 1) лежит в сегменте, имя которого — число
+    записей до него. RPC-потоки только кладут записи в очередь; отдельный
+    поток пишет накопленное одним write и делает один fsync на пачку
+    (group commit): пачка закрывается через `interval` секунд после первой
+    записи или при `max_batch` записях. В режиме `sync` commit() ждёт fsync
+    своей пачки, иначе подтверждение не ждёт диска и при падении теряется
+    не больше `interval` секунд данных.
+    """
+
+    def __init__(self, path: str, start_seq: int = 0, sync: bool = False, interval: float = 0.005,
+                 max_batch: int = 8192, segment_records: int = 1 << 20):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.sync = sync
+        self.interval = interval
+        self.max_batch = max_batch
+        self.segment_records = segment_records
+        self.appended = start_seq  # seq последней поставленной в очередь записи
+        self.durable = start_seq   # seq последней записи, прошедшей fsync
+        self.commits = 0
+        self._pending = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)     # будит поток записи
+        self._flushed = threading.Condition(self._lock)  # будит ждущих commit()
+        self._open_segment(start_seq)
+        self._thread = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+        self._thread.start()
+
+    def _open_segment(self, start: int) -> None:
+        self._file = open(os.path.join(self.path, _segment_name(start)), 'ab')
+        self._segment_start = start
+        self._segment_count = 0
+        _fsync_dir(self.path)
+
+    def append(self, records: list[bytes]) -> int:
+        """Ставит закодированные записи в очередь; возвращает seq последней."""
+        with self._lock:
+            was_empty = not self._pending
+            self._pending.extend(records)
+            self.appended += len(records)
+            if was_empty or len(self._pending) >= self.max_batch:
+                self._work.notify()
+            return self.appended
+
+    def commit(self, seq: int) -> None:
+        """В режиме sync ждёт, пока запись seq не окажется на диске."""
+        if self.sync:
+            with self._lock:
+                self._flushed.wait_for(lambda: self.durable >= seq or self._closed)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                self._work.wait_for(lambda: self._pending or self._closed)
+                # Окно group commit: копим записи до interval или max_batch
+                self._work.wait_for(lambda: len(self._pending) >= self.max_batch or self._closed,
+                                    timeout=self.interval)
+                batch, self._pending = self._pending, []
+                seq, closed = self.appended, self._closed
+
+            if batch:
+                self._file.write(b''.join(batch))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._segment_count += len(batch)
+                if self._segment_count >= self.segment_records:
+                    self._file.close()
+                    self._open_segment(seq)
+
+            with self._lock:
+                self.durable = seq
+                self.commits += bool(batch)
+                self._flushed.notify_all()
+
+            if closed:
+                self._file.close()
+                return
+
+    def segments(self) -> list[tuple[int, str]]:
+        """(start, путь) всех сегментов по возрастанию start."""
+        names = sorted(n for n in os.listdir(self.path) if n.endswith('.wal'))
+        return [(int(n[:-4]), os.path.join(self.path, n)) for n in names]
+
+    def truncate(self, seq: int) -> None:
+        """Удаляет сегменты, все записи которых имеют номер не больше seq."""
+        segments = self.segments()
+        for (start, path), (next_start, _) in zip(segments, segments[1:]):
+            if next_start <= seq and start < self._segment_start:
+                os.remove(path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._work.notify()
+        self._thread.join()
+
+def _key_struct(n_levels: int) -> struct.Struct:
+    # user_id, type, seq, count, total, total_sq, min, max; затем (floor, n) на каждый уровень и сырой хвост
+    return struct.Struct(f'<{USER_ID_BYTES}siqqdddd' + 'di' * n_levels)
+
+def _encode_series(key_struct: struct.Struct, key, agg: Aggregate, series: TimeSeries, seq: int) -> bytes:
+    """agg — агрегат ключа: у ряда из KeyTable он лежит в колонках таблицы, а не в series.agg."""
+    user_id, metric_type = key
+    levels = []
+    for tier in series.tiers:
+        levels += [tier.floor, len(tier.starts)]
+    levels += [series.raw.floor, len(series.raw.values)]
+    parts = [key_struct.pack(user_id.encode(), metric_type, seq, agg.count, agg.total,
+                             agg.total_sq, agg.min, agg.max, *levels)]
+    for tier in series.tiers:
+        parts += [tier.starts.tobytes(), tier.sums.tobytes(), tier.counts.tobytes()]
+    parts += [series.raw.timestamps.tobytes(), series.raw.values.tobytes()]
+    # Скетч за всё время, затем число часов, их начала и скетчи
+    hourly = series.hourly
+    parts += [series.sketch.to_bytes(), len(hourly.starts).to_bytes(4, 'little'), hourly.starts.tobytes()]
+    parts += [sketch.to_bytes() for sketch in hourly.sketches]
+    return b''.join(parts)
+
+def _tiers_header(storage) -> bytes:
+    tiers = [TIER_HEAD.pack(width, capacity) for width, capacity in storage.tiers]
+    return (b''.join(tiers) + TIER_HEAD.pack(0, storage.raw_tail)
+            + SKETCH_HEAD.pack(storage.sketch_accuracy, storage.sketch_hours))
+
+def _check_tiers(storage, buf, off: int, n_tiers: int, name: str) -> int:
+    """Проверяет, что уровни свёрток в buf совпадают с конфигурацией storage; возвращает смещение за ними."""
+    tiers = []
+    for _ in range(n_tiers + 1):
+        tiers.append(TIER_HEAD.unpack_from(buf, off))
+        off += TIER_HEAD.size
+    if tuple(tiers[:-1]) != tuple(tuple(t) for t in storage.tiers) or tiers[-1][1] != storage.raw_tail:
+        raise ValueError(f"{name}: rollup tiers differ from storage config")
+    if SKETCH_HEAD.unpack_from(buf, off) != (storage.sketch_accuracy, storage.sketch_hours):
+        raise ValueError(f"{name}: sketch accuracy or hours differ from storage config")
+    return off + SKETCH_HEAD.size
+
+def _decode_series(storage, key_struct: struct.Struct, buf, off: int):
+    """Читает одну запись ключа из buf (bytes или mmap); возвращает (ключ, seq, TimeSeries, новое смещение)."""
+    user_id, metric_type, seq, count, total, total_sq, lo, hi, *levels = key_struct.unpack_from(buf, off)
+    off += key_struct.size
+    series = storage.new_series()
+    agg = series.agg
+    agg.count, agg.total, agg.total_sq, agg.min, agg.max = count, total, total_sq, lo, hi
+    for tier, floor, n in zip(series.tiers, levels[0::2], levels[1::2]):
+        tier.floor = floor
+        for arr in (tier.starts, tier.sums, tier.counts):
+            arr.frombytes(buf[off:off + n * arr.itemsize])
+            off += n * arr.itemsize
+    series.raw.floor, n = levels[-2], levels[-1]
+    for arr in (series.raw.timestamps, series.raw.values):
+        arr.frombytes(buf[off:off + n * arr.itemsize])
+        off += n * arr.itemsize
+    off = series.sketch.load(buf, off)
+    hourly = series.hourly
+    n = int.from_bytes(buf[off:off + 4], 'little')
+    off += 4
+    hourly.starts.frombytes(buf[off:off + 8 * n])
+    off += 8 * n
+    for _ in range(n):
+        sketch = DDSketch(hourly.accuracy)
+        off = sketch.load(buf, off)
+        hourly.sketches.append(sketch)
+    return (user_id.rstrip(b'\0').decode(), metric_type), seq, series, off
+
+def write_snapshot(storage, wal: WriteAheadLog, path: str) -> int:
+    """
+    Пишет снапшот всех ключей и возвращает seq_lo: записи WAL с номером
+    не больше seq_lo в снапшоте уже учтены.
+
+    Полосы копируются по очереди, каждая под своим мьютексом, без общей
+    остановки записи. Запись в WAL идёт под тем же мьютексом полосы, что и
+    обновление ключа, поэтому для каждого ключа сохраняется seq, до
+    которого включительно он содержит все записи.
+    """
+    n_tiers = len(storage.tiers)
+    key_struct = _key_struct(n_tiers + 1)
+    file = os.path.join(path, SNAPSHOT_FILE)
+    tmp = file + '.tmp'
+    seq_lo = wal.appended
+    n_keys = 0
+    with open(tmp, 'wb') as f:
+        f.write(SNAPSHOT_HEAD.pack(SNAPSHOT_MAGIC, n_tiers, 0, 0, 0))
+        f.write(_tiers_header(storage))
+        for i in range(storage.stripes):
+            chunks = storage.dump_stripe(
+                i, lambda key, agg, series: _encode_series(key_struct, key, agg, series, wal.appended))
+            f.write(b''.join(chunks))
+            n_keys += len(chunks)
+        f.seek(0)
+        f.write(SNAPSHOT_HEAD.pack(SNAPSHOT_MAGIC, n_tiers, n_keys, seq_lo, wal.appended))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file)
+    _fsync_dir(path)
+    return seq_lo
+
+def load_snapshot(storage, path: str) -> tuple[int, int, dict]:
+    """Загружает снапшот через mmap; возвращает (seq_lo, seq_hi, {ключ: seq})."""
+    file = os.path.join(path, SNAPSHOT_FILE)
+    if not os.path.exists(file) or not os.path.getsize(file):
+        return 0, 0, {}
+
+    key_seq = {}
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, n_tiers, n_keys, seq_lo, seq_hi = SNAPSHOT_HEAD.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{file}: not a snapshot")
+        off = _check_tiers(storage, mm, SNAPSHOT_HEAD.size, n_tiers, file)
+        key_struct = _key_struct(n_tiers + 1)
+        for _ in range(n_keys):
+            key, seq, series, off = _decode_series(storage, key_struct, mm, off)
+            storage.restore(key, series)
+            key_seq[key] = seq
+    return seq_lo, seq_hi, key_seq
+
+def dump_series(storage, items) -> bytes:
+    """Сериализует [(ключ, TimeSeries)] в формате записей снапшота — для переноса между узлами."""
+    key_struct = _key_struct(len(storage.tiers) + 1)
+    parts = [DUMP_HEAD.pack(DUMP_MAGIC, len(storage.tiers), len(items)), _tiers_header(storage)]
+    parts += [_encode_series(key_struct, key, series.agg, series, 0) for key, series in items]
+    return b''.join(parts)
+
+def load_series(storage, data: bytes) -> list:
+    """Обратное к dump_series: [(ключ, TimeSeries)]."""
+    if not data:
+        return []
+    magic, n_tiers, n_keys = DUMP_HEAD.unpack_from(data, 0)
+    if magic != DUMP_MAGIC:
+        raise ValueError("not a series dump")
+    off = _check_tiers(storage, data, DUMP_HEAD.size, n_tiers, "series dump")
+    key_struct = _key_struct(n_tiers + 1)
+    items = []
+    for _ in range(n_keys):
+        key, _, series, off = _decode_series(storage, key_struct, data, off)
+        items.append((key, series))
+    return items
+
+def _quarantine(segments) -> None:
+    """Убирает сегменты из журнала, переименовывая в *.wal.quarantined (данные остаются для разбора)."""
+    for _, file in segments:
+        os.replace(file, file + '.quarantined')
+        print(f"[WAL] {file}: past the break in the log, moved aside")
+    if segments:
+        _fsync_dir(os.path.dirname(segments[0][1]))
+
+def replay(storage, path: str, seq_lo: int, key_seq: dict, chunk: int = 65536) -> int:
+    """
+    Применяет записи WAL с номером больше seq_lo, которых нет в снапшоте.
+    Сегменты читаются через mmap с нужного смещения. Оборванная запись в
+    конце (падение посреди write) отрезается. Возвращает seq последней
+    целой записи.
+
+    Если журнал обрывается на испорченной записи или сегмент заходит на
+    номера следующего, сегмент обрезается по последней целой записи, а
+    все следующие убираются в карантин: новый журнал продолжит нумерацию
+    с возвращённого seq, и старые записи с теми же номерами не должны
+    проиграться при следующем старте.
+    """
+    names = sorted(n for n in os.listdir(path) if n.endswith('.wal'))
+    segments = [(int(n[:-4]), os.path.join(path, n)) for n in names]
+    last = seq_lo
+    items = []
+    for k, (start, file) in enumerate(segments):
+        next_start = segments[k + 1][0] if k + 1 < len(segments) else None
+        if next_start is not None and next_start <= seq_lo:
+            continue
+        size = os.path.getsize(file)
+        n = size // RECORD_SIZE
+        valid = n
+        if n:
+            with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for j in range(max(0, seq_lo - start), n):
+                    off = j * RECORD_SIZE
+                    body = mm[off:off + RECORD_BODY.size]
+                    if zlib.crc32(body) != int.from_bytes(mm[off + RECORD_BODY.size:off + RECORD_SIZE], 'little'):
+                        valid = j
+                        break
+                    raw_user, metric_type, value, ts = RECORD_BODY.unpack(body)
+                    key = (raw_user.rstrip(b'\0').decode(), metric_type)
+                    seq = start + j + 1
+                    if seq > key_seq.get(key, 0):
+                        items.append((key[0], metric_type, value, ts))
+                        if len(items) >= chunk:
+                            storage.record_items(items)
+                            items = []
+                    last = max(last, seq)
+        # Пропуск номеров до следующего сегмента допустим (хвост не дошёл до диска,
+        # журнал открыт заново с seq снапшота), перекрытие — нет
+        broken = valid < n or (next_start is not None and start + valid > next_start)
+        if valid * RECORD_SIZE != size:
+            with open(file, 'r+b') as f:
+                f.truncate(valid * RECORD_SIZE)
+                os.fsync(f.fileno())
+        if broken:
+            print(f"[WAL] {file}: log breaks after record {start + valid}, replay stopped")
+            _quarantine(segments[k + 1:])
+            break
+    storage.record_items(items)
+    return last
+
+class Durability:
+    """
+    Долговременный режим MetricStorage: восстановление при старте
+    (снапшот + хвост WAL), журнал новых записей и снапшот каждые
+    `snapshot_interval` секунд с удалением покрытых им сегментов.
+    """
+
+    def __init__(self, storage, path: str, sync: bool = False, commit_interval: float = 0.005,
+                 snapshot_interval: float = 60.0):
+        os.makedirs(path, exist_ok=True)
+        self.storage = storage
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+
+        seq_lo, seq_hi, key_seq = load_snapshot(storage, path)
+        last = replay(storage, path, seq_lo, key_seq)
+        print(f"[WAL] Recovered {len(key_seq)} keys from snapshot, replayed WAL from seq {seq_lo} to {last}")
+
+        self.wal = WriteAheadLog(path, max(last, seq_hi), sync=sync, interval=commit_interval)
+        storage.wal = self.wal
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="snapshotter", daemon=True)
+        self._thread.start()
+
+    def snapshot(self) -> None:
+        seq_lo = write_snapshot(self.storage, self.wal, self.path)
+        self.wal.truncate(seq_lo)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.snapshot()
+        self.storage.wal = None
+        self.wal.close()
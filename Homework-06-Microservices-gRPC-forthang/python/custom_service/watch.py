@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import threading
+
+class Watchers:
+    """
+    Подписки WatchAverage по ключам (user_id, MetricType): ключ -> набор
+    функций wake(). notify(key) будит только подписчиков этого ключа —
+    O(их числа), а не всех. Само обновление подписчик собирает сам, после
+    пробуждения, поэтому пачка записей в один ключ даёт одно обновление.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key = {}
+
+    def subscribe(self, key, wake) -> None:
+        with self._lock:
+            # Копия при записи: notify читает набор без мьютекса
+            self._by_key[key] = self._by_key.get(key, frozenset()) | {wake}
+
+    def unsubscribe(self, key, wake) -> None:
+        with self._lock:
+            rest = self._by_key.get(key, frozenset()) - {wake}
+            if rest:
+                self._by_key[key] = rest
+            else:
+                self._by_key.pop(key, None)
+
+    def notify(self, key) -> None:
+        for wake in self._by_key.get(key, ()):
+            wake()
+
+    def __len__(self) -> int:
+        """Число ключей, на которые кто-то подписан."""
+        return len(self._by_key)
@@ -1,29 +1,107 @@
+import argparse
+import hashlib
+import json
 import os
+import socket
 import sys
 import time
 import subprocess
+import tempfile
+import threading
 import grpc
 import random
 from concurrent import futures
+from importlib import metadata
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 PROTO_PATH = os.path.join(PROJECT_ROOT, 'proto')
 PYTHON_OUT = os.path.join(PROJECT_ROOT, 'tests', 'generated')
+PACKAGE_DIR = os.path.join(PROJECT_ROOT, 'python', 'custom_service')
+# Хэши входов кодогенерации и сборки с прошлого запуска
+CACHE_FILE = os.path.join(PYTHON_OUT, '.build-cache.json')
 
 os.makedirs(PYTHON_OUT, exist_ok=True)
 
-def generate_proto():
-    print(f"[*] Generating proto code for testing from {PROTO_PATH}...")
-    cmd = [
+def content_hash(paths, *extra) -> str:
+    """sha256 содержимого файлов (и каталогов рекурсивно) плюс строк extra."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, n) for n in names]
+        elif os.path.exists(path):
+            files.append(path)
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        digest.update(os.path.relpath(path, PROJECT_ROOT).encode() + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for item in extra:
+        digest.update(str(item).encode() + b'\0')
+    return digest.hexdigest()
+
+def cached_step(name: str, digest: str, outputs, run, rebuild: bool = False) -> None:
+    """Выполняет run(), только если хэш входов изменился или каких-то outputs нет."""
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if not rebuild and cache.get(name) == digest and all(os.path.exists(o) for o in outputs):
+        print(f"[*] {name}: up to date, skipping")
+        return
+    run()
+    cache[name] = digest
+    with open(CACHE_FILE, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+def protoc(out_dir: str) -> None:
+    subprocess.check_call([
         sys.executable, "-m", "grpc_tools.protoc",
         f"-I{PROTO_PATH}",
-        f"--python_out={PYTHON_OUT}",
-        f"--grpc_python_out={PYTHON_OUT}",
+        f"--python_out={out_dir}",
+        f"--grpc_python_out={out_dir}",
         os.path.join(PROTO_PATH, "metrics.proto")
-    ]
-    subprocess.check_call(cmd)
+    ])
+
+def generate_proto(rebuild: bool = False):
+    print(f"[*] Generating proto code for testing from {PROTO_PATH}...")
+    digest = content_hash([os.path.join(PROTO_PATH, "metrics.proto")], metadata.version('grpcio-tools'))
+    outputs = [os.path.join(PYTHON_OUT, n) for n in ("metrics_pb2.py", "metrics_pb2_grpc.py")]
+    cached_step("tests proto", digest, outputs, lambda: protoc(PYTHON_OUT), rebuild)
     sys.path.append(PYTHON_OUT)
 
+def generate_package_proto(rebuild: bool = False):
+    """Код для самого сервиса (как в README), чтобы сервер не запускался со старым proto."""
+    digest = content_hash([os.path.join(PROTO_PATH, "metrics.proto")], metadata.version('grpcio-tools'))
+    outputs = [os.path.join(PACKAGE_DIR, n) for n in ("metrics_pb2.py", "metrics_pb2_grpc.py")]
+    cached_step("package proto", digest, outputs, lambda: protoc(PACKAGE_DIR), rebuild)
+
+def wait_for_server(port, process=None, timeout: float = 30.0) -> bool:
+    """Ждёт готовности канала короткими попытками; прекращает ждать, если процесс сервера умер."""
+    deadline = time.monotonic() + timeout
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                print(f"[!] Server exited with code {process.returncode}.")
+                return False
+            try:
+                grpc.channel_ready_future(channel).result(timeout=0.1)
+                return True
+            except grpc.FutureTimeoutError:
+                pass
+    print("[!] Connection timed out. Server did not start.")
+    return False
+
+def start_in_process():
+    """Python-сервис в этом же процессе на свободном порту; возвращает (server, порт)."""
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, 'python'))
+    from custom_service.server import build_server
+
+    server, port = build_server("0")
+    server.start()
+    return server, port
+
 def is_python_track():
     server_path = os.path.join(PROJECT_ROOT, 'python', 'custom_service', 'server.py')
     if not os.path.exists(server_path):
@@ -70,58 +148,595 @@ def run_integration_test(port=50051):
         expected_avg = sum(values) / len(values)
         print(f"[*] Got: {response.average_value}, Expected: {expected_avg}")
 
-        if abs(response.average_value - expected_avg) < 0.01:
-            print("[+] Test PASSED!")
-            return True
-        else:
+        if abs(response.average_value - expected_avg) >= 0.01:
             print("[-] Test FAILED: Wrong average calculation.")
             return False
 
+        if not run_streaming_test(stub, metrics_pb2):
+            return False
+
+        if not run_percentile_test(stub, metrics_pb2):
+            return False
+
+        if not run_batch_average_test(stub, metrics_pb2):
+            return False
+
+        if not run_watch_test(stub, metrics_pb2):
+            return False
+
+        print("[+] Test PASSED!")
+        return True
+
     except grpc.RpcError as e:
         print(f"[!] RPC Error: {e}")
         return False
 
+def run_streaming_test(stub, metrics_pb2):
+    """Проверка client-streaming RPC; пропускается, если сервер их не реализует."""
+    user_id = "test_user_stream"
+    values = [55.0, 65.0, 75.0, 85.0]
+
+    print("[*] Streaming metrics (RecordMetrics + RecordBatches)...")
+    try:
+        requests = (metrics_pb2.MetricRequest(user_id=user_id, type=metrics_pb2.HEART_RATE, value=v)
+                    for v in values[:2])
+        first = stub.RecordMetrics(requests)
+        batch = metrics_pb2.MetricBatch(user_id=user_id, type=metrics_pb2.HEART_RATE,
+                                        values=values[2:] + [float('nan')])
+        second = stub.RecordBatches(iter([batch]))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+            print("[*] Streaming RPCs not implemented, skipping.")
+            return True
+        raise
+
+    response = stub.GetAverage(metrics_pb2.AverageRequest(user_id=user_id, type=metrics_pb2.HEART_RATE))
+    expected_avg = sum(values) / len(values)
+    print(f"[*] Accepted {first.accepted + second.accepted}, rejected {first.rejected + second.rejected}; "
+          f"got average {response.average_value}, expected {expected_avg}")
+
+    if (first.accepted + second.accepted, second.rejected, response.count) != (len(values), 1, len(values)) \
+            or abs(response.average_value - expected_avg) >= 0.01:
+        print("[-] Test FAILED: Wrong streaming ingest result.")
+        return False
+    return True
+
+def run_percentile_test(stub, metrics_pb2):
+    """Квантили GetPercentiles против точных; пропускается, если сервер RPC не реализует."""
+    user_id = "test_user_percentiles"
+    rng = random.Random(42)
+    values = [rng.lognormvariate(4.3, 0.4) for _ in range(5000)]
+    quantiles = [0.5, 0.9, 0.95, 0.99, 0.999]
+
+    print("[*] Checking GetPercentiles against exact quantiles...")
+    try:
+        batches = (metrics_pb2.MetricBatch(user_id=user_id, type=metrics_pb2.STRESS_LEVEL, values=values[i:i + 500])
+                   for i in range(0, len(values), 500))
+        stub.RecordBatches(batches)
+        response = stub.GetPercentiles(metrics_pb2.PercentilesRequest(
+            user_id=user_id, type=metrics_pb2.STRESS_LEVEL, quantiles=quantiles))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+            print("[*] GetPercentiles not implemented, skipping.")
+            return True
+        raise
+
+    ordered = sorted(values)
+    worst = 0.0
+    for q, got in zip(quantiles, response.values):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        worst = max(worst, abs(got - exact) / exact)
+    print(f"[*] {response.count} values, worst relative error {worst:.4f} "
+          f"(guaranteed {response.relative_accuracy})")
+
+    if response.count != len(values) or len(response.values) != len(quantiles) \
+            or worst > response.relative_accuracy + 1e-9:
+        print("[-] Test FAILED: Percentiles outside the guaranteed error.")
+        return False
+    return True
+
+def run_batch_average_test(stub, metrics_pb2):
+    """BatchGetAverage против GetAverage по тем же ключам; пропускается, если сервер RPC не реализует."""
+    user_ids = [f"test_user_batch_{i}" for i in range(20)] + ["test_user_batch_missing"]
+    types = [metrics_pb2.HEART_RATE, metrics_pb2.STRESS_LEVEL]
+
+    print("[*] Checking BatchGetAverage against GetAverage...")
+    batches = (metrics_pb2.MetricBatch(user_id=user_id, type=types[i % 2], values=[float(i), float(2 * i + 1)])
+               for i, user_id in enumerate(user_ids[:-1]))
+    stub.RecordBatches(batches)
+    try:
+        response = stub.BatchGetAverage(metrics_pb2.BatchAverageRequest(user_ids=user_ids, types=types))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+            print("[*] BatchGetAverage not implemented, skipping.")
+            return True
+        raise
+
+    expected = [stub.GetAverage(metrics_pb2.AverageRequest(user_id=user_id, type=metric_type))
+                for user_id in user_ids for metric_type in types]
+    if list(response.averages) != expected:
+        print("[-] Test FAILED: BatchGetAverage differs from GetAverage.")
+        return False
+    return True
+
+def run_watch_test(stub, metrics_pb2):
+    """WatchAverage присылает обновления после записей; пропускается, если сервер RPC не реализует."""
+    user_id = "test_user_watch"
+    values = [60.0, 80.0, 100.0]
+
+    print("[*] Watching average while sending metrics...")
+    call = stub.WatchAverage(metrics_pb2.AverageRequest(user_id=user_id, type=metrics_pb2.HEART_RATE),
+                             timeout=15)
+    seen = []
+    try:
+        for response in call:
+            seen.append(response.count)
+            if response.count == len(values):
+                break
+            if len(seen) == 1:
+                for v in values:
+                    stub.RecordMetric(metrics_pb2.MetricRequest(user_id=user_id, type=metrics_pb2.HEART_RATE, value=v))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+            print("[*] WatchAverage not implemented, skipping.")
+            return True
+        raise
+    finally:
+        call.cancel()
+
+    print(f"[*] Watch updates (counts): {seen}")
+    if not seen or seen[0] != 0 or seen[-1] != len(values) or abs(response.average_value - 80.0) >= 0.01:
+        print("[-] Test FAILED: WatchAverage did not push the update.")
+        return False
+    return True
+
+def run_wal_corruption_test():
+    """Испорченная запись в среднем сегменте WAL: после двух перезапусков нет записей из старых сегментов."""
+    from custom_service.storage import MetricStorage
+    from custom_service.wal import RECORD_SIZE, Durability, WriteAheadLog, encode_record
+
+    print("[*] Corrupting a middle WAL segment and restarting twice...")
+    user_id, metric_type = "test_user_wal", 1
+
+    def restart(path):
+        storage = MetricStorage()
+        durability = Durability(storage, path, sync=True, snapshot_interval=3600)
+        return storage, durability
+
+    def crash(durability):
+        # Без финального снапшота, как при падении процесса: состояние — только в WAL
+        durability._stop.set()
+        durability._thread.join()
+        durability.storage.wal = None
+        durability.wal.close()
+
+    with tempfile.TemporaryDirectory() as path:
+        wal = WriteAheadLog(path, sync=True, segment_records=10)
+        for k in range(3):  # сегменты с началами 0, 10, 20
+            wal.commit(wal.append([encode_record(user_id, metric_type, float(10 * k + j), 0) for j in range(10)]))
+        wal.close()
+        with open(os.path.join(path, f"{10:020d}.wal"), 'r+b') as f:
+            f.seek(3 * RECORD_SIZE + 5)  # seq 14
+            f.write(b'\xff')
+
+        storage, durability = restart(path)
+        first = storage.get(user_id, metric_type).count
+        for value in (100.0, 100.0, 100.0, 100.0, 100.0):
+            storage.record(user_id, metric_type, value)
+        crash(durability)
+
+        storage, durability = restart(path)
+        agg = storage.get(user_id, metric_type)
+        crash(durability)
+        storage, durability = restart(path)
+        again = storage.get(user_id, metric_type)
+        durability.close()
+        quarantined = [n for n in os.listdir(path) if n.endswith('.quarantined')]
+
+    expected = (sum(range(13)) + 500.0) / 18
+    print(f"[*] After corruption {first} values, after restarts {agg.count} and {again.count}, "
+          f"quarantined {quarantined}")
+    if (first, agg.count, again.count) != (13, 18, 18) or abs(agg.total / agg.count - expected) >= 1e-9 \
+            or f"{20:020d}.wal.quarantined" not in quarantined:
+        print("[-] Test FAILED: stale WAL segments replayed after corruption.")
+        return False
+    return True
+
+def run_router_fence_test():
+    """Запись, начатая по старому кольцу, не остаётся на старом владельце после add_node."""
+    from custom_service import metrics_pb2, metrics_pb2_grpc
+    from custom_service.router import HashRing, Router
+    from custom_service.server import build_admin_server, build_server
+    from custom_service.storage import MetricStorage
+
+    print("[*] Adding a router node while a write to a moving user is in flight...")
+    servers, specs = [], []
+    for _ in range(2):
+        storage = MetricStorage()
+        server, port = build_server("0", max_workers=4, storage=storage)
+        admin, admin_port = build_admin_server("localhost:0", storage)
+        server.start()
+        admin.start()
+        servers += [server, admin]
+        specs.append(f"localhost:{port},localhost:{admin_port}")
+    try:
+        old = specs[0].split(',')[0]
+        new = specs[1].split(',')[0]
+        ring = HashRing([old, new])
+        user_id = next(u for u in (f"fence_{i}" for i in range(1000)) if ring.node_for(u) == new)
+
+        # Служебный сервис не должен отвечать на публичном порту
+        with grpc.insecure_channel(old) as channel:
+            try:
+                metrics_pb2_grpc.ClusterAdminServiceStub(channel).ExportRange(metrics_pb2.HashRange(), timeout=5)
+                exposed = True
+            except grpc.RpcError as e:
+                exposed = e.code() != grpc.StatusCode.UNIMPLEMENTED
+
+        router = Router([specs[0]])
+        try:
+            router.add_node(new)
+            refused = False
+        except ValueError:
+            refused = router.ring.nodes == [old]
+
+        epoch, write_ring = router._begin_write([user_id])
+        mover = threading.Thread(target=router.add_node, args=(specs[1],))
+        mover.start()
+        time.sleep(0.3)
+        waited = mover.is_alive()
+        request = metrics_pb2.MetricRequest(user_id=user_id, type=metrics_pb2.HEART_RATE, value=70.0)
+        router.stub(write_ring.node_for(user_id)).RecordMetric(request, timeout=5)
+        router._end_write(epoch)
+        mover.join(timeout=10)
+        router.record(metrics_pb2.MetricRequest(user_id=user_id, type=metrics_pb2.HEART_RATE, value=80.0))
+        count = router.get_average(metrics_pb2.AverageRequest(user_id=user_id, type=metrics_pb2.HEART_RATE)).count
+    finally:
+        for server in servers:
+            server.stop(0)
+
+    print(f"[*] Admin on public port: {exposed}, node without admin refused: {refused}, "
+          f"move waited for write: {waited}, values on new owner: {count}")
+    if exposed or not refused or not waited or count != 2:
+        print("[-] Test FAILED: write stranded on the old owner or admin service exposed.")
+        return False
+    return True
+
+def run_router_rollback_test():
+    """Сорвавшийся перенос не оставляет кольцо переключённым, а ряды — разбросанными по узлам."""
+    from custom_service import metrics_pb2
+    from custom_service.router import Router
+    from custom_service.server import build_admin_server, build_server
+    from custom_service.storage import MetricStorage
+    from custom_service.wal import Durability
+
+    print("[*] Failing router rebalances: a --wal node and an ExportRange error mid-move...")
+    servers, specs = [], []
+    with tempfile.TemporaryDirectory() as path:
+        storages = [MetricStorage() for _ in range(4)]
+        # Первый узел — с WAL: переносить его ряды нельзя
+        durability = Durability(storages[0], path, sync=True, snapshot_interval=3600)
+        for storage in storages:
+            server, port = build_server("0", max_workers=4, storage=storage)
+            admin, admin_port = build_admin_server("localhost:0", storage)
+            server.start()
+            admin.start()
+            servers += [server, admin]
+            specs.append(f"localhost:{port},localhost:{admin_port}")
+        users = {f"rollback_{i}": float(i % 50 + 50) for i in range(200)}
+        try:
+            def load(router):
+                router.record_batches([metrics_pb2.MetricBatch(user_id=u, type=metrics_pb2.HEART_RATE, values=[v])
+                                       for u, v in users.items()])
+
+            def lost(router):
+                return sum(router.get_average(metrics_pb2.AverageRequest(
+                    user_id=u, type=metrics_pb2.HEART_RATE)).count != 1 for u in users)
+
+            wal_router = Router([specs[0]])
+            load(wal_router)
+            try:
+                wal_router.add_node(specs[1])
+                wal_refused = False
+            except ValueError:
+                wal_refused = len(wal_router.ring.nodes) == 1
+            wal_lost = lost(wal_router)
+
+            # Второй источник отказывает на ExportRange, когда первый уже перенёс свои ряды;
+            # третий ExportRange — возврат этих рядов с нового узла
+            router = Router(specs[1:3])
+            load(router)
+            real_admin_stub = router.admin_stub
+            exports = []
+
+            class FailingStub:
+                def __init__(self, stub):
+                    self.stub = stub
+
+                def ExportRange(self, request, timeout=None):
+                    if request.first:
+                        exports.append(request)
+                        if len(exports) == 2:
+                            raise grpc.RpcError("source went away")
+                    return self.stub.ExportRange(request, timeout=timeout)
+
+                def ImportSeries(self, request, timeout=None):
+                    return self.stub.ImportSeries(request, timeout=timeout)
+
+            router.admin_stub = lambda node: FailingStub(real_admin_stub(node))
+            try:
+                router.add_node(specs[3])
+                rolled_back = False
+            except grpc.RpcError:
+                rolled_back = router.ring.nodes == [specs[1].split(',')[0], specs[2].split(',')[0]]
+            router.admin_stub = real_admin_stub
+            move_lost = lost(router)
+            stray = len(storages[3].take(lambda user_id: True))
+        finally:
+            for server in servers:
+                server.stop(0)
+            durability.close()
+
+    print(f"[*] WAL node refused: {wal_refused}, lost {wal_lost}; mid-move failure rolled back: {rolled_back} "
+          f"after {len(exports)} exports, lost {move_lost}, left on the new node {stray}")
+    if not wal_refused or wal_lost or not rolled_back or len(exports) != 3 or move_lost or stray:
+        print("[-] Test FAILED: a failed rebalance left the ring switched or the data split.")
+        return False
+    return True
+
+def run_multiproc_rebalance_test():
+    """Роутер переносит пользователей на multiproc-узел и обратно, их ряды расходятся по шардам."""
+    from custom_service import metrics_pb2
+    from custom_service.router import Router
+    from custom_service.server import build_admin_server, build_server
+    from custom_service.storage import MetricStorage
+
+    def free_port():
+        with socket.socket() as s:
+            s.bind(('localhost', 0))
+            return s.getsockname()[1]
+
+    print("[*] Rebalancing users onto a multi-process node and back...")
+    port, admin_port = free_port(), free_port()
+    process = subprocess.Popen([sys.executable, "-m", "custom_service.multiproc", "--procs", "2", "--port", str(port),
+                                "--admin-address", f"localhost:{admin_port}"],
+                               cwd=os.path.join(PROJECT_ROOT, 'python'), stdout=subprocess.DEVNULL)
+    storage = MetricStorage()
+    server, single_port = build_server("0", max_workers=4, storage=storage)
+    admin, single_admin = build_admin_server("localhost:0", storage)
+    server.start()
+    admin.start()
+    try:
+        if not wait_for_server(port, process) or not wait_for_server(admin_port, process):
+            return False
+        single = f"localhost:{single_port},localhost:{single_admin}"
+        router = Router([single])
+        users = {f"mp_user_{i}": [float(i % 97), float(i % 89) + 0.5] for i in range(300)}
+        router.record_batches([metrics_pb2.MetricBatch(user_id=u, type=metrics_pb2.HEART_RATE, values=v)
+                               for u, v in users.items()])
+
+        def mismatches():
+            bad = 0
+            for user_id, values in users.items():
+                r = router.get_average(metrics_pb2.AverageRequest(user_id=user_id, type=metrics_pb2.HEART_RATE))
+                bad += r.count != len(values) or abs(r.average_value - sum(values) / len(values)) >= 1e-9
+            return bad
+
+        moved_in = router.add_node(f"localhost:{port},localhost:{admin_port}")
+        after_add = mismatches()
+        moved_out = router.remove_node(single)
+        after_remove = mismatches()
+    finally:
+        process.terminate()
+        process.wait()
+        server.stop(0)
+        admin.stop(0)
+
+    print(f"[*] Moved {moved_in} keys in and {moved_out} out, mismatches {after_add} and {after_remove}")
+    if not moved_in or moved_in + moved_out != len(users) or after_add or after_remove:
+        print("[-] Test FAILED: rebalancing with a multi-process node lost or duplicated data.")
+        return False
+    return True
+
+def run_sharded_admin_rollback_test():
+    """ShardedAdminServicer: отказ одного шарда не оставляет ряды влитыми или вынутыми наполовину."""
+    from concurrent import futures as pool
+    from custom_service import metrics_pb2, metrics_pb2_grpc
+    from custom_service.multiproc import ShardedAdminServicer, peer_address, shard_of
+    from custom_service.server import ClusterAdminServicer
+    from custom_service.storage import MetricStorage
+    from custom_service.wal import dump_series
+
+    print("[*] Failing one shard during multiproc ImportSeries and ExportRange...")
+
+    class BrokenShard(metrics_pb2_grpc.ClusterAdminServiceServicer):
+        def ExportRange(self, request, context):
+            context.abort(grpc.StatusCode.UNAVAILABLE, "shard is down")
+
+        def ImportSeries(self, request, context):
+            context.abort(grpc.StatusCode.UNAVAILABLE, "shard is down")
+
+    n_shards = 3
+    users = [f"shard_user_{i}" for i in range(60)]
+    with tempfile.TemporaryDirectory() as socket_dir:
+        storages = [MetricStorage() for _ in range(n_shards)]
+        servers = []
+        for shard in (1, 2):
+            server = grpc.server(pool.ThreadPoolExecutor(max_workers=2))
+            servicer = ClusterAdminServicer(storages[shard]) if shard == 1 else BrokenShard()
+            metrics_pb2_grpc.add_ClusterAdminServiceServicer_to_server(servicer, server)
+            server.add_insecure_port(peer_address(socket_dir, shard))
+            server.start()
+            servers.append(server)
+        admin = ShardedAdminServicer(0, n_shards, socket_dir, storages[0])
+        try:
+            source = MetricStorage()
+            for user_id in users:
+                source.record(user_id, metrics_pb2.HEART_RATE, 70.0)
+            data = dump_series(source, source.take(lambda user_id: True))
+            try:
+                admin.import_series(data)
+                import_failed = False
+            except grpc.RpcError:
+                import_failed = True
+            left_after_import = sum(len(storage.take(lambda user_id: True)) for storage in storages[:2])
+
+            # Шарды 0 и 1 держат своих пользователей, шард 2 отказывает на ExportRange
+            for user_id in users:
+                owner = shard_of(user_id, n_shards)
+                if owner < 2:
+                    storages[owner].record(user_id, metrics_pb2.HEART_RATE, 70.0)
+            held = {owner: sum(shard_of(u, n_shards) == owner for u in users) for owner in (0, 1)}
+            try:
+                admin.export_range(metrics_pb2.HashRange(first=[0], last=[(1 << 64) - 1]))
+                export_failed = False
+            except grpc.RpcError:
+                export_failed = True
+            kept = {owner: len(storages[owner].take(lambda user_id: True)) for owner in (0, 1)}
+        finally:
+            for server in servers:
+                server.stop(0)
+
+    print(f"[*] Import failed: {import_failed}, series left on healthy shards {left_after_import}; "
+          f"export failed: {export_failed}, kept {kept} of {held}")
+    if not import_failed or left_after_import or not export_failed or kept != held:
+        print("[-] Test FAILED: a shard failure left multiproc admin RPCs half applied.")
+        return False
+    return True
+
+def run_admission_streaming_test():
+    """Медленная потоковая запись на простаивающий сервер не отбрасывается admission."""
+    from custom_service import metrics_pb2, metrics_pb2_grpc
+    from custom_service.admission import AdmissionController, AdmissionInterceptor
+    from custom_service.server import build_server
+
+    print("[*] Uploading a slow RecordMetrics stream through admission control...")
+    controller = AdmissionController(target=0.02)
+
+    def slow_upload():
+        for k in range(5):
+            time.sleep(0.05)  # больше target между сообщениями
+            yield metrics_pb2.MetricRequest(user_id="test_user_slow", type=metrics_pb2.HEART_RATE, value=60.0 + k)
+
+    server, port = build_server("0", max_workers=4, admission=controller)
+    server.start()
+    try:
+        with grpc.insecure_channel(f'localhost:{port}') as channel:
+            stub = metrics_pb2_grpc.VitalSignsServiceStub(channel)
+            try:
+                accepted = stub.RecordMetrics(slow_upload(), timeout=10).accepted
+            except grpc.RpcError as e:
+                print(f"[*] RecordMetrics failed: {e.code()} {e.details()}")
+                accepted = 0
+    finally:
+        server.stop(0)
+
+    # Обработчик стрима может начаться и позже прихода вызова — ждать ему разрешено
+    class Details:
+        method = '/lifeos.VitalSignsService/RecordBatches'
+
+    class Context:
+        def set_trailing_metadata(self, metadata):
+            pass
+
+        def abort(self, code, details):
+            raise RuntimeError(details)
+
+    handler = grpc.stream_unary_rpc_method_handler(lambda requests, context: sum(1 for _ in requests))
+    wrapped = AdmissionInterceptor(controller).intercept_service(lambda details: handler, Details())
+    time.sleep(0.05)
+    try:
+        late = wrapped.stream_unary(iter([1, 2, 3]), Context())
+    except RuntimeError:
+        late = 0
+
+    print(f"[*] Slow stream accepted {accepted} values, late-started stream handled {late}, "
+          f"admission rejected {controller.rejected}")
+    if accepted != 5 or late != 3 or controller.rejected:
+        print("[-] Test FAILED: slow streaming upload was shed by admission control.")
+        return False
+    return True
+
+def run_service_tests():
+    """Проверки внутренностей Python-сервиса (WAL, роутер и т. п.), которые не видны через RPC."""
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, 'python'))
+    return (run_wal_corruption_test() and run_router_fence_test() and run_router_rollback_test()
+            and run_multiproc_rebalance_test() and run_sharded_admin_rollback_test()
+            and run_admission_streaming_test())
+
 def main():
-    generate_proto()
+    parser = argparse.ArgumentParser(description="Интеграционная проверка VitalSignsService")
+    parser.add_argument('--in-process', action='store_true',
+                        help="поднять Python-сервис в этом процессе на свободном порту (без pip и подпроцесса)")
+    parser.add_argument('--rebuild', action='store_true', help="игнорировать кэш кодогенерации и сборки")
+    args = parser.parse_args()
+    started = time.perf_counter()
+
+    generate_proto(args.rebuild)
 
     server_process = None
+    in_process = None
+    python_track = False
+    port = 50051
 
     try:
-        if is_cpp_track() and not os.environ.get("FORCE_PYTHON"):
+        if args.in_process:
+            print("=== Python Track, in-process ===")
+            generate_package_proto(args.rebuild)
+            in_process, port = start_in_process()
+            python_track = True
+
+        elif is_cpp_track() and not os.environ.get("FORCE_PYTHON"):
             print("=== Detected C++ Track ===")
             build_dir = os.path.join(PROJECT_ROOT, 'cpp', 'build')
             os.makedirs(build_dir, exist_ok=True)
+            exe_path = os.path.join(build_dir, 'lifeos_grpc_service-server')
 
-            print("[*] Running CMake...")
-            subprocess.check_call(['cmake', '-DCMAKE_BUILD_TYPE=Debug', '..'], cwd=build_dir)
+            def build():
+                print("[*] Running CMake...")
+                subprocess.check_call(['cmake', '-DCMAKE_BUILD_TYPE=Debug', '..'], cwd=build_dir)
 
-            print("[*] Compiling (this may take time)...")
-            subprocess.check_call(['make', '-j', '2'], cwd=build_dir)
+                print("[*] Compiling (this may take time)...")
+                subprocess.check_call(['make', '-j', '2'], cwd=build_dir)
+
+            cpp_dir = os.path.join(PROJECT_ROOT, 'cpp')
+            digest = content_hash([os.path.join(cpp_dir, 'src'), os.path.join(cpp_dir, 'CMakeLists.txt'),
+                                   os.path.join(PROTO_PATH, 'metrics.proto')], 'Debug')
+            cached_step("cpp build", digest, [exe_path], build, args.rebuild)
 
             print("[*] Starting C++ Server...")
-            exe_path = os.path.join(build_dir, 'lifeos_grpc_service-server')
             config_path = os.path.join(PROJECT_ROOT, 'cpp', 'config.yaml')
 
             server_process = subprocess.Popen([exe_path, '--config', config_path])
 
         elif is_python_track():
             print("=== Detected Python Track ===")
-            print("[*] Installing package...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "-e", "."], cwd=os.path.join(PROJECT_ROOT, 'python'))
+            python_dir = os.path.join(PROJECT_ROOT, 'python')
+
+            def install():
+                print("[*] Installing package...")
+                subprocess.check_call([sys.executable, "-m", "pip", "install", "-e", "."], cwd=python_dir)
+
+            # Пакет ставится в режиме -e: переустановка нужна, только если поменялось описание пакета
+            cached_step("pip install", content_hash([os.path.join(python_dir, 'pyproject.toml')]), [], install,
+                        args.rebuild)
+            generate_package_proto(args.rebuild)
 
             print("[*] Starting Python Server...")
+            python_track = True
             server_process = subprocess.Popen(
                 [sys.executable, "-m", "custom_service.server"],
-                cwd=os.path.join(PROJECT_ROOT, 'python')
+                cwd=python_dir
             )
 
         else:
             print("[!] Neither Python nor C++ solution detected (files are empty or missing).")
             sys.exit(1)
 
-        time.sleep(5)
-
-        success = run_integration_test()
+        success = wait_for_server(port, server_process) and run_integration_test(port)
+        if success and python_track:
+            success = run_service_tests()
+        print(f"[*] Finished in {time.perf_counter() - started:.2f}s")
 
         if not success:
             sys.exit(1)
@@ -130,6 +745,8 @@ def main():
         print(f"[!] Build/Setup failed: {e}")
         sys.exit(1)
     finally:
+        if in_process is not None:
+            in_process.stop(0)
         if server_process:
             print("[*] Stopping server...")
             server_process.terminate()
@@ -1,3 +1,4 @@
 """RL Agents."""
 from .qlearning import QLearningAgent
 from .ppo import PPOAgent
+from .rollout import RolloutCollector
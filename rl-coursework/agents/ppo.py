@@ -38,6 +38,7 @@ class PPOAgent:
         self.log_probs = []
         self.values = []
         self.dones = []
+        self.cuts = {}  # index -> bootstrap value for truncated segments
     
     def _tanh(self, x):
         return np.tanh(np.clip(x, -20, 20))
@@ -76,6 +77,14 @@ class PPOAgent:
         self.values.append(value)
         self.dones.append(done)
     
+    def cut(self, last_value):
+        """Mark the last stored step as the end of a truncated segment.
+        
+        GAE does not leak across the cut and bootstraps from last_value,
+        the critic's estimate for the state the segment stopped in.
+        """
+        self.cuts[len(self.states) - 1] = last_value
+    
     def learn(self):
         if len(self.states) < 32:
             self.clear_buffer()
@@ -99,6 +108,9 @@ class PPOAgent:
             if dones[t]:
                 next_val = 0
                 gae = 0
+            elif t in self.cuts:
+                next_val = self.cuts[t]
+                gae = 0
             delta = rewards[t] + self.gamma * next_val - values[t]
             gae = delta + self.gamma * self.lam * gae
             advantages[t] = gae
@@ -155,18 +167,22 @@ class PPOAgent:
         
         self.clear_buffer()
     
+    PARAMS = ('w1', 'b1', 'w2', 'b2', 'w_mu', 'b_mu', 'log_std',
+              'vw1', 'vb1', 'vw2', 'vb2', 'vw3', 'vb3')
+    
+    def get_params(self):
+        """Copy of all network weights as a name -> array dict."""
+        return {k: getattr(self, k).copy() for k in self.PARAMS}
+    
+    def set_params(self, params):
+        """Replace network weights with copies from a name -> array dict."""
+        for k in self.PARAMS:
+            setattr(self, k, np.array(params[k]))
+    
     def save(self, path):
-        np.savez(path, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2,
-                 w_mu=self.w_mu, b_mu=self.b_mu, log_std=self.log_std,
-                 vw1=self.vw1, vb1=self.vb1, vw2=self.vw2, vb2=self.vb2,
-                 vw3=self.vw3, vb3=self.vb3)
+        np.savez(path, **{k: getattr(self, k) for k in self.PARAMS})
     
     def load(self, path):
         d = np.load(path)
-        self.w1, self.b1 = d['w1'], d['b1']
-        self.w2, self.b2 = d['w2'], d['b2']
-        self.w_mu, self.b_mu = d['w_mu'], d['b_mu']
-        self.log_std = d['log_std']
-        self.vw1, self.vb1 = d['vw1'], d['vb1']
-        self.vw2, self.vb2 = d['vw2'], d['vb2']
-        self.vw3, self.vb3 = d['vw3'], d['vb3']
+        for k in self.PARAMS:
+            setattr(self, k, d[k])
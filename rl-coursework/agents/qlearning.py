@@ -1,10 +1,18 @@
 """Q-Learning Agent implementation."""
+import heapq
 import numpy as np
 
 class QLearningAgent:
-    """Tabular Q-Learning agent with epsilon-greedy exploration."""
+    """Tabular Q-Learning agent with epsilon-greedy exploration.
     
-    def __init__(self, n_states, n_actions, alpha=0.1, gamma=0.99, epsilon=0.1):
+    With planning_steps > 0 the agent becomes Dyna-Q: it keeps a learned
+    deterministic model (s, a) -> (s', r, done) and after every real step
+    replays planning_steps simulated updates from it, either sampled
+    uniformly or (prioritized=True) by prioritized sweeping on TD error.
+    """
+    
+    def __init__(self, n_states, n_actions, alpha=0.1, gamma=0.99, epsilon=0.1,
+                 planning_steps=0, prioritized=False, theta=1e-4):
         self.n_states = n_states
         self.n_actions = n_actions
         self.alpha = alpha      # learning rate
@@ -12,23 +20,125 @@ class QLearningAgent:
         self.epsilon = epsilon  # exploration rate
         self.q_table = np.zeros((n_states, n_actions))
         
+        self.planning_steps = planning_steps
+        self.prioritized = prioritized
+        self.theta = theta      # min priority to enter the sweep queue
+        if planning_steps:
+            self._init_model()
+    
+    def _init_model(self):
+        """Learned model stored as compact (n_states, n_actions) arrays."""
+        shape = (self.n_states, self.n_actions)
+        self.model_next = np.full(shape, -1, dtype=np.int32)
+        self.model_reward = np.zeros(shape, dtype=np.float32)
+        self.model_done = np.zeros(shape, dtype=bool)
+        self._seen = np.zeros(self.n_states * self.n_actions, dtype=np.int32)
+        self._n_seen = 0
+        self._priority = np.zeros(shape)
+        self._queue = []
+        self._preds = {}  # s' -> {(s, a)} whose modelled transition leads to s'
+    
     def choose_action(self, state, training=True):
         """Select action using epsilon-greedy policy."""
         if training and np.random.random() < self.epsilon:
             return np.random.randint(self.n_actions)
         return np.argmax(self.q_table[state])
     
-    def learn(self, state, action, reward, next_state, done):
-        """Update Q-table using Q-learning update rule."""
-        current_q = self.q_table[state, action]
+    def _td_error(self, state, action, reward, next_state, done):
         next_max_q = 0 if done else np.max(self.q_table[next_state])
-        target = reward + self.gamma * next_max_q
-        self.q_table[state, action] += self.alpha * (target - current_q)
+        return reward + self.gamma * next_max_q - self.q_table[state, action]
+    
+    def learn(self, state, action, reward, next_state, done):
+        """Update Q-table using Q-learning update rule (plus planning)."""
+        td = self._td_error(state, action, reward, next_state, done)
+        self.q_table[state, action] += self.alpha * td
         
+        if self.planning_steps:
+            self._update_model(state, action, reward, next_state, done)
+            if self.prioritized:
+                self._push(state, action, abs(td))
+                self._sweep()
+            else:
+                self._plan_uniform()
+    
+    def _update_model(self, state, action, reward, next_state, done):
+        old = self.model_next[state, action]
+        if old < 0:
+            self._seen[self._n_seen] = state * self.n_actions + action
+            self._n_seen += 1
+        if old != next_state:
+            if old >= 0:
+                self._preds[int(old)].discard((int(state), int(action)))
+            self._preds.setdefault(int(next_state), set()).add((int(state), int(action)))
+        self.model_next[state, action] = next_state
+        self.model_reward[state, action] = reward
+        self.model_done[state, action] = done
+    
+    def _model_update(self, s, a):
+        """One simulated Q-learning update from the model; returns |TD|."""
+        td = self._td_error(s, a, self.model_reward[s, a],
+                            self.model_next[s, a], self.model_done[s, a])
+        self.q_table[s, a] += self.alpha * td
+        return abs(td)
+    
+    def _plan_uniform(self):
+        """Dyna-Q: replay uniformly sampled previously seen (s, a)."""
+        idx = self._seen[np.random.randint(self._n_seen, size=self.planning_steps)]
+        for s, a in zip(*np.divmod(idx, self.n_actions)):
+            self._model_update(s, a)
+    
+    def _push(self, s, a, priority):
+        # Lazy decrease-key: stale heap entries are skipped on pop
+        if priority > self.theta and priority > self._priority[s, a]:
+            self._priority[s, a] = priority
+            heapq.heappush(self._queue, (-priority, int(s), int(a)))
+    
+    def _sweep(self):
+        """Prioritized sweeping: update highest-|TD| pairs, then their predecessors."""
+        for _ in range(self.planning_steps):
+            while self._queue:
+                neg_p, s, a = heapq.heappop(self._queue)
+                if -neg_p == self._priority[s, a]:
+                    break
+            else:
+                return
+            self._priority[s, a] = 0
+            self._model_update(s, a)
+            
+            # All predecessors lead to s: its max Q is shared by their TD errors
+            next_max_q = self.q_table[s].max()
+            for ps, pa in self._preds.get(s, ()):
+                target = self.model_reward[ps, pa]
+                if not self.model_done[ps, pa]:
+                    target += self.gamma * next_max_q
+                self._push(ps, pa, abs(target - self.q_table[ps, pa]))
+    
+    def learn_batch(self, states, actions, rewards, next_states, dones, epochs=1):
+        """Offline Q-learning over a whole batch of logged transitions.
+        
+        Each epoch is one synchronous sweep: TD errors for all transitions
+        are computed from the same Q-table, summed per (s, a) with np.add.at
+        and averaged, so duplicated transitions do not inflate the step.
+        """
+        flat = np.asarray(states) * self.n_actions + np.asarray(actions)
+        counts = np.bincount(flat, minlength=self.q_table.size)
+        seen = counts > 0
+        not_done = ~np.asarray(dones, dtype=bool)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        
+        self.q_table = np.ascontiguousarray(self.q_table, dtype=np.float64)
+        q = self.q_table.reshape(-1)  # flat view
+        for _ in range(epochs):
+            next_max = self.q_table.max(axis=1)[next_states]
+            td = rewards + self.gamma * next_max * not_done - q[flat]
+            td_sum = np.zeros(q.size)
+            np.add.at(td_sum, flat, td)
+            q[seen] += self.alpha * td_sum[seen] / counts[seen]
+    
     def save(self, path):
         """Save Q-table to file."""
         np.save(path, self.q_table)
-        
+    
     def load(self, path):
         """Load Q-table from file."""
         self.q_table = np.load(path)
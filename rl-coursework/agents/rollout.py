@@ -0,0 +1,87 @@
+"""Fixed-horizon rollout collection with auto-reset."""
+import numpy as np
+
+
+class RolloutCollector:
+    """Collects exactly horizon x len(envs) steps per update.
+    
+    A walker that falls, is caught or times out is reset immediately, so
+    no env idles while waiting for the slowest one. Finished episodes are
+    kept as stats and handed out by pop_episodes(). An optional recorder
+    (environments.trajectory.TrajectoryWriter) gets one row per step.
+    """
+    
+    def __init__(self, envs, agent, horizon=128, ray_speed=1.0, recorder=None):
+        self.envs = envs
+        self.agent = agent
+        self.horizon = horizon
+        self.ray_speed = ray_speed  # applied to an env whenever it resets
+        self.recorder = recorder
+        self.states = [self._reset(e) for e in envs]
+        self.ep_rewards = [0.0] * len(envs)
+        self.episodes = []
+    
+    def _reset(self, env):
+        env.set_ray_speed(self.ray_speed)
+        return env.reset()
+    
+    def collect(self, on_step=None):
+        """Run one rollout and store it in the agent, env by env.
+        
+        on_step() is called after every step over all envs; returning
+        False stops the rollout early. Returns the number of steps taken.
+        """
+        agent = self.agent
+        n = len(self.envs)
+        buf = [[] for _ in range(n)]
+        
+        for _ in range(self.horizon):
+            row = []
+            for i, env in enumerate(self.envs):
+                state = self.states[i]
+                action, log_p = agent.choose_action(state)
+                val = agent.get_value(state)
+                next_state, reward, done = env.step(action)
+                buf[i].append((state, action, reward, log_p, val, done))
+                self.ep_rewards[i] += reward
+                if self.recorder is not None:
+                    row.append((state, action, reward, env.get_render_data()))
+                
+                if done:
+                    self.episodes.append({
+                        'reward': self.ep_rewards[i],
+                        'distance': env.x - env.start_x,
+                        'ray_speed': env.ray_base_speed,
+                    })
+                    self.ep_rewards[i] = 0.0
+                    next_state = self._reset(env)
+                self.states[i] = next_state
+            
+            if self.recorder is not None:
+                self.recorder.record(*zip(*row))
+            if on_step is not None and on_step() is False:
+                break
+        
+        # Contiguous per-env segments so GAE never mixes walkers
+        for i, seg in enumerate(buf):
+            for step in seg:
+                agent.store(*step)
+            if seg and not seg[-1][5]:
+                agent.cut(agent.get_value(self.states[i]))
+        return sum(len(seg) for seg in buf)
+    
+    def pop_episodes(self):
+        """Stats of episodes finished since the last call."""
+        episodes, self.episodes = self.episodes, []
+        return episodes
+    
+    @staticmethod
+    def summarize(episodes):
+        """Aggregate a group of episodes into one metrics entry."""
+        distances = [e['distance'] for e in episodes]
+        return {
+            'reward': float(np.mean([e['reward'] for e in episodes])),
+            'best_dist': max(distances),
+            'avg_dist': float(np.mean(distances)),
+            'ray_speed': episodes[-1]['ray_speed'],
+        }
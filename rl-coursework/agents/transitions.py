@@ -0,0 +1,50 @@
+"""Compact binary log of tabular transitions for offline training."""
+import numpy as np
+
+# One record = 17 bytes, little-endian, no padding
+TRANSITION_DTYPE = np.dtype([
+    ('state', '<i4'),
+    ('action', '<i4'),
+    ('reward', '<f4'),
+    ('next_state', '<i4'),
+    ('done', '?'),
+])
+
+
+class TransitionRecorder:
+    """Appends (s, a, r, s', done) records to a binary file in batches."""
+    
+    def __init__(self, path, buffer_size=4096):
+        self.path = path
+        self._file = open(path, 'ab')
+        self._buf = np.zeros(buffer_size, dtype=TRANSITION_DTYPE)
+        self._n = 0
+        self.count = 0
+    
+    def record(self, state, action, reward, next_state, done):
+        self._buf[self._n] = (state, action, reward, next_state, done)
+        self._n += 1
+        self.count += 1
+        if self._n == len(self._buf):
+            self.flush()
+    
+    def flush(self):
+        self._buf[:self._n].tofile(self._file)
+        self._file.flush()
+        self._n = 0
+    
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_transitions(*paths):
+    """Read and concatenate transition files into one structured array."""
+    return np.concatenate([np.fromfile(p, dtype=TRANSITION_DTYPE) for p in paths])
@@ -0,0 +1,37 @@
+"""Scan a Walker trajectory recording chunk by chunk without loading it into RAM."""
+import argparse
+import numpy as np
+from environments.trajectory import TrajectoryReader
+
+
+def analyze(path, chunk=1 << 16):
+    reader = TrajectoryReader(path)
+    n = reader.n_walkers
+    reward_sum = np.zeros(n)
+    max_dist = np.full(n, -np.inf)
+    falls = np.zeros(n, dtype=int)
+    caught = np.zeros(n, dtype=int)
+    
+    for start in range(0, reader.rows, chunk):
+        sl = slice(start, start + chunk)
+        reward_sum += reader['reward'][sl].sum(axis=0)
+        max_dist = np.maximum(max_dist, reader['distance'][sl].max(axis=0))
+        # fallen/caught are only set on the terminal step of an episode
+        falls += reader['fallen'][sl].sum(axis=0)
+        caught += reader['caught'][sl].sum(axis=0)
+    
+    episodes = [len(reader.episodes(w)) for w in range(n)]
+    print(f"Recording: {path}")
+    print(f"Steps: {reader.rows} x {n} walkers = {reader.rows * n}")
+    print(f"{'walker':>6} {'episodes':>9} {'avg reward':>11} {'max dist':>9} {'falls':>6} {'caught':>7}")
+    for w in range(n):
+        print(f"{w:>6} {episodes[w]:>9} {reward_sum[w] / max(reader.rows, 1):>11.3f} "
+              f"{max_dist[w] / 100:>8.1f}m {falls[w]:>6} {caught[w]:>7}")
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser()
+    p.add_argument('path')
+    p.add_argument('--chunk', type=int, default=1 << 16, help='rows per scanned chunk')
+    args = p.parse_args()
+    analyze(args.path, args.chunk)
@@ -0,0 +1,86 @@
+"""Benchmark: plain Q-Learning vs Dyna-Q vs prioritized sweeping on a larger GridWorld."""
+import argparse
+import json
+import time
+import numpy as np
+from environments.gridworld import GridWorld
+from agents.qlearning import QLearningAgent
+
+
+def maze(size):
+    """Walls every third row with a gap alternating between the two sides."""
+    obstacles = []
+    for k, row in enumerate(range(2, size - 1, 3)):
+        cols = range(0, size - 2) if k % 2 == 0 else range(2, size)
+        obstacles += [(row, c) for c in cols]
+    return obstacles
+
+
+def run(env, agent, target, window, max_episodes, max_steps):
+    """Train until the success rate over `window` episodes reaches `target`."""
+    successes = []
+    env_steps = 0
+    t0 = time.perf_counter()
+    
+    for ep in range(max_episodes):
+        state = env.reset()
+        done = False
+        for _ in range(max_steps):
+            action = agent.choose_action(state)
+            next_state, reward, done = env.step(action)
+            agent.learn(state, action, reward, next_state, done)
+            state = next_state
+            env_steps += 1
+            if done:
+                break
+        successes.append(1 if done else 0)
+        if len(successes) >= window and np.mean(successes[-window:]) >= target:
+            break
+    
+    return {'episodes': ep + 1, 'env_steps': env_steps,
+            'wall_time': time.perf_counter() - t0,
+            'reached': bool(np.mean(successes[-window:]) >= target)}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--size', type=int, default=10)
+    p.add_argument('--planning', type=int, default=10)
+    p.add_argument('--target', type=float, default=0.9)
+    p.add_argument('--window', type=int, default=20)
+    p.add_argument('--seeds', type=int, default=5)
+    p.add_argument('--max-episodes', type=int, default=2000)
+    p.add_argument('--out', default='logs/dyna_benchmark.json')
+    args = p.parse_args()
+    
+    configs = {
+        'q-learning': {},
+        'dyna-q': {'planning_steps': args.planning},
+        'prioritized': {'planning_steps': args.planning, 'prioritized': True},
+    }
+    max_steps = args.size * args.size * 4
+    results = {}
+    
+    print(f"GridWorld {args.size}x{args.size}, target success {args.target:.0%} "
+          f"over {args.window} episodes, {args.seeds} seeds")
+    print(f"{'method':<12} {'episodes':>9} {'env steps':>10} {'time (s)':>9}")
+    
+    for name, kw in configs.items():
+        runs = []
+        for seed in range(args.seeds):
+            np.random.seed(seed)
+            env = GridWorld(size=args.size, obstacles=maze(args.size))
+            agent = QLearningAgent(env.n_states, env.n_actions, **kw)
+            runs.append(run(env, agent, args.target, args.window, args.max_episodes, max_steps))
+        results[name] = runs
+        print(f"{name:<12} {np.mean([r['episodes'] for r in runs]):>9.1f} "
+              f"{np.mean([r['env_steps'] for r in runs]):>10.0f} "
+              f"{np.mean([r['wall_time'] for r in runs]):>9.3f}")
+    
+    with open(args.out, 'w') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    print(f"Saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
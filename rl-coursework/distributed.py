@@ -0,0 +1,288 @@
+"""Distributed actor-learner PPO for Walker over gRPC.
+
+Actors run Walker rollouts with a local copy of the policy and stream
+them to the learner as float32 chunks; the learner runs PPOAgent.learn
+and publishes versioned weights that actors pull before each rollout.
+The service uses generic gRPC handlers on raw bytes, so no proto
+codegen is needed. Start the learner with train_walker.py --actors,
+extra actors (possibly on other hosts) with:
+
+    python distributed.py --target learner-host:50061 --seed 7
+"""
+import argparse
+import multiprocessing as mp
+import queue
+import struct
+import time
+from concurrent import futures
+import grpc
+import numpy as np
+from environments.walker import Walker
+from agents.ppo import PPOAgent
+from agents.rollout import RolloutCollector
+
+NUM_WALKERS = 6
+RAY_STEP = 0.01  # ray speed added per episode (same curriculum as train_walker)
+CHUNK_STEPS = 256  # rows per streamed message
+
+SERVICE = 'walker.Learner'
+PUSH_METHOD = f'/{SERVICE}/PushRollout'
+PULL_METHOD = f'/{SERVICE}/GetWeights'
+
+# chunk: policy version, rows, episodes; then rows x (state, action, reward,
+# log_prob, value, done, cut) and episodes x (reward, distance, ray_speed)
+CHUNK = struct.Struct('<qII')
+EPISODE_COLS = 3
+# PushRollout reply: ray speed for new episodes, stop
+REPLY = struct.Struct('<f?')
+# GetWeights request: version the actor has; reply: version + weights if newer
+VERSION = struct.Struct('<q')
+
+
+def pack_params(params):
+    return np.concatenate([params[k].ravel() for k in PPOAgent.PARAMS]).astype('<f4').tobytes()
+
+
+def unpack_params(blob, shapes):
+    flat = np.frombuffer(blob, dtype='<f4')
+    params, off = {}, 0
+    for k in PPOAgent.PARAMS:
+        size = int(np.prod(shapes[k], dtype=int))
+        params[k] = flat[off:off + size].astype(np.float64).reshape(shapes[k])
+        off += size
+    return params
+
+
+def pack_rollout(agent, version, episodes, chunk_steps=CHUNK_STEPS):
+    """Turn the agent's buffer into CHUNK messages; episode stats ride in the last one.
+
+    The cut column holds the bootstrap value of a truncated segment's
+    last step and NaN elsewhere, so chunks can split segments anywhere.
+    """
+    n = len(agent.states)
+    cut = np.full(n, np.nan)
+    for i, v in agent.cuts.items():
+        cut[i] = v
+    width = agent.state_dim + agent.action_dim + 5
+    rows = np.empty((n, width), dtype='<f4')
+    if n:
+        rows[:, :agent.state_dim] = agent.states
+        rows[:, agent.state_dim:-5] = agent.actions
+        rows[:, -5:] = np.column_stack([agent.rewards, agent.log_probs, agent.values,
+                                        agent.dones, cut])
+    eps = np.array([[e['reward'], e['distance'], e['ray_speed']] for e in episodes],
+                   dtype='<f4').reshape(-1, EPISODE_COLS)
+
+    chunks = []
+    starts = range(0, n, chunk_steps) if n else [0]
+    for start in starts:
+        part = rows[start:start + chunk_steps]
+        last = start + chunk_steps >= n
+        tail = eps if last else eps[:0]
+        chunks.append(CHUNK.pack(version, len(part), len(tail)) + part.tobytes() + tail.tobytes())
+    return chunks
+
+
+def unpack_chunk(data, width):
+    """Returns (version, rows, episodes) as float32 views of one message."""
+    version, n, n_eps = CHUNK.unpack_from(data)
+    rows = np.frombuffer(data, dtype='<f4', count=n * width, offset=CHUNK.size).reshape(n, width)
+    eps = np.frombuffer(data, dtype='<f4', count=n_eps * EPISODE_COLS,
+                        offset=CHUNK.size + rows.nbytes).reshape(n_eps, EPISODE_COLS)
+    return version, rows, eps
+
+
+class Learner:
+    """Owns the PPO agent and serves the PushRollout / GetWeights RPCs.
+
+    Handlers only decode rollouts into a bounded queue (a full queue
+    blocks the pushing actor) and hand out the latest packed weights;
+    all learning happens in the thread that calls train(). An actor has
+    up to two rollouts in flight (one queued, one being collected), so
+    by default rollouts two versions behind are still learned from;
+    PPO's clipped ratio keeps such slightly off-policy steps bounded.
+    """
+
+    def __init__(self, agent, batch_steps, max_lag=2, queue_size=8):
+        self.agent = agent
+        self.batch_steps = batch_steps
+        self.max_lag = max_lag
+        self.width = agent.state_dim + agent.action_dim + 5
+        self.rollouts = queue.Queue(maxsize=queue_size)
+        self.ray_speed = 1.0
+        self.stop = False
+        self.updates = 0
+        self.dropped = 0
+        self._publish(0)
+
+    def _publish(self, version):
+        # One tuple assignment, so handlers never see a version with other weights
+        self.published = (version, pack_params(self.agent.get_params()))
+
+    def push_rollout(self, chunks, context):
+        parts = [unpack_chunk(data, self.width) for data in chunks]
+        while not self.stop:
+            try:
+                self.rollouts.put(parts, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        return REPLY.pack(self.ray_speed, self.stop)
+
+    def get_weights(self, request, context):
+        known, = VERSION.unpack(request)
+        version, blob = self.published
+        return VERSION.pack(version) + (blob if version != known else b'')
+
+    def handler(self):
+        return grpc.method_handlers_generic_handler(SERVICE, {
+            'PushRollout': grpc.stream_unary_rpc_method_handler(self.push_rollout),
+            'GetWeights': grpc.unary_unary_rpc_method_handler(self.get_weights),
+        })
+
+    def _store(self, rows):
+        sd, ad = self.agent.state_dim, self.agent.action_dim
+        for row in rows:
+            self.agent.store(row[:sd], row[sd:sd + ad], float(row[-5]), float(row[-4]),
+                             float(row[-3]), bool(row[-2]))
+            if not np.isnan(row[-1]):
+                self.agent.cut(float(row[-1]))
+
+    def train(self, episodes, alive=None):
+        """Consume rollouts until `episodes` metric entries are collected.
+
+        Rollouts more than max_lag versions behind are not learned from,
+        but their finished episodes still count. alive() returning False
+        (all local actors died) aborts training.
+        """
+        metrics = {'rewards': [], 'best_dist': [], 'avg_dist': [], 'ray_speeds': []}
+        pending, steps, ep = [], 0, 0
+
+        while ep < episodes:
+            try:
+                parts = self.rollouts.get(timeout=1.0)
+            except queue.Empty:
+                if alive is not None and not alive():
+                    raise RuntimeError("all actors exited before training finished")
+                continue
+
+            version = self.published[0]
+            stale = version - parts[0][0] > self.max_lag
+            self.dropped += stale
+            for _, rows, eps in parts:
+                if not stale:
+                    self._store(rows)
+                    steps += len(rows)
+                pending += [{'reward': float(r), 'distance': float(d), 'ray_speed': float(s)}
+                            for r, d, s in eps]
+
+            if steps >= self.batch_steps:
+                self.agent.learn()
+                self.updates += 1
+                self._publish(version + 1)
+                steps = 0
+
+            # Every NUM_WALKERS finished episodes make one metrics entry
+            while len(pending) >= NUM_WALKERS and ep < episodes:
+                s = RolloutCollector.summarize(pending[:NUM_WALKERS])
+                pending = pending[NUM_WALKERS:]
+                metrics['rewards'].append(s['reward'])
+                metrics['best_dist'].append(s['best_dist'])
+                metrics['avg_dist'].append(s['avg_dist'])
+                metrics['ray_speeds'].append(s['ray_speed'])
+                ep += 1
+                self.ray_speed = 1.0 + ep * RAY_STEP
+
+                if ep % 5 == 0:
+                    record = max(metrics['best_dist']) / 100
+                    print(f"Ep {ep}: Best={s['best_dist']/100:.1f}m, Avg={s['avg_dist']/100:.1f}m, "
+                          f"Record={record:.1f}m, Ray={s['ray_speed']:.2f}, v{self.published[0]}")
+
+        self.stop = True
+        return metrics
+
+
+def _pull(stub, agent, shapes, version):
+    reply = stub(VERSION.pack(version))
+    latest, = VERSION.unpack_from(reply)
+    if len(reply) > VERSION.size:
+        agent.set_params(unpack_params(reply[VERSION.size:], shapes))
+    return latest
+
+
+def run_actor(target, seed=0, horizon=128):
+    """Collect rollouts for the learner at target until it says stop or goes away."""
+    np.random.seed(seed)
+    envs = [Walker() for _ in range(NUM_WALKERS)]
+    agent = PPOAgent(envs[0].state_dim, envs[0].action_dim)
+    shapes = {k: v.shape for k, v in agent.get_params().items()}
+    collector = RolloutCollector(envs, agent, horizon)
+
+    with grpc.insecure_channel(target) as channel:
+        grpc.channel_ready_future(channel).result(timeout=30)
+        push = channel.stream_unary(PUSH_METHOD)
+        pull = channel.unary_unary(PULL_METHOD)
+        version, rollouts = -1, 0
+        try:
+            while True:
+                # Unchanged weights cost an 8-byte reply, so check before every rollout
+                version = _pull(pull, agent, shapes, version)
+                collector.collect()
+                chunks = pack_rollout(agent, version, collector.pop_episodes())
+                agent.clear_buffer()
+                ray_speed, stop = REPLY.unpack(push(iter(chunks)))
+                rollouts += 1
+                if stop:
+                    break
+                collector.ray_speed = ray_speed
+        except grpc.RpcError as e:
+            # The learner finished and shut down between our calls
+            if e.code() not in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.CANCELLED):
+                raise
+    return rollouts
+
+
+def train_distributed(episodes=300, actors=4, horizon=128, port=0, batch_steps=0,
+                      max_lag=2, seed=0):
+    """Serve a learner on localhost:port and train with `actors` local
+    actor processes (0 = only external ones). batch_steps defaults to one
+    rollout per actor per update. Returns the agent and metrics."""
+    env = Walker()
+    agent = PPOAgent(env.state_dim, env.action_dim, lr=5e-4)
+    batch_steps = batch_steps or horizon * NUM_WALKERS * max(1, actors)
+    learner = Learner(agent, batch_steps, max_lag, queue_size=max(1, actors))
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max(4, 2 * actors + 2)))
+    server.add_generic_rpc_handlers((learner.handler(),))
+    port = server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    print(f"Learner on port {port}: {actors} local actors, {batch_steps} steps per update")
+
+    # spawn: forking a process with a running gRPC server is unsafe
+    ctx = mp.get_context('spawn')
+    procs = [ctx.Process(target=run_actor, args=(f'localhost:{port}', seed + 1 + i, horizon),
+                         daemon=True) for i in range(actors)]
+    for proc in procs:
+        proc.start()
+
+    alive = (lambda: any(p.is_alive() for p in procs)) if procs else None
+    t0 = time.perf_counter()
+    try:
+        metrics = learner.train(episodes, alive)
+    finally:
+        learner.stop = True
+        server.stop(grace=2).wait()
+        for proc in procs:
+            proc.join(timeout=10)
+    print(f"{learner.updates} updates in {time.perf_counter() - t0:.1f}s, "
+          f"{learner.dropped} stale rollouts dropped")
+    return agent, metrics
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Run one rollout actor against a learner.')
+    p.add_argument('--target', default='localhost:50061', help='learner host:port')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--horizon', type=int, default=128, help='steps per walker per rollout')
+    args = p.parse_args()
+    print(f"Sent {run_actor(args.target, args.seed, args.horizon)} rollouts")
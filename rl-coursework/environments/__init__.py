@@ -1,3 +1,4 @@
 """RL Environments."""
 from .gridworld import GridWorld
 from .walker import Walker
+from .trajectory import TrajectoryWriter, TrajectoryReader
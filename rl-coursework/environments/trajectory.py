@@ -0,0 +1,139 @@
+"""Memory-mapped columnar recording of Walker trajectories."""
+import json
+import os
+import numpy as np
+
+# column -> (dtype, per-walker shape); every column is (rows, n_walkers, *shape)
+COLUMNS = {
+    'obs': ('<f4', (10,)),
+    'action': ('<f4', (4,)),
+    'reward': ('<f4', ()),
+    'x': ('<f4', ()),
+    'hip_y': ('<f4', ()),
+    'torso_top': ('<f4', ()),
+    'head_y': ('<f4', ()),
+    'l_hip': ('<f4', (2,)),
+    'l_knee': ('<f4', (2,)),
+    'l_foot': ('<f4', (2,)),
+    'r_hip': ('<f4', (2,)),
+    'r_knee': ('<f4', (2,)),
+    'r_foot': ('<f4', (2,)),
+    'ray_x': ('<f4', ()),
+    'fallen': ('?', ()),
+    'caught': ('?', ()),
+    'distance': ('<f4', ()),
+    'steps': ('<i4', ()),
+}
+RENDER_FIELDS = [k for k in COLUMNS if k not in ('obs', 'action', 'reward')]
+POINT_FIELDS = [k for k in RENDER_FIELDS if COLUMNS[k][1] == (2,)]
+
+
+def _nbytes(name, rows, n_walkers):
+    dtype, shape = COLUMNS[name]
+    return rows * n_walkers * int(np.prod(shape, dtype=int)) * np.dtype(dtype).itemsize
+
+
+class TrajectoryWriter:
+    """Writes one row per step (all walkers) into preallocated memmaps.
+    
+    Files double in size when full and are trimmed to the recorded
+    number of rows on close(), which also writes meta.json.
+    """
+    
+    def __init__(self, path, n_walkers, capacity=4096, ground_y=400):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.n_walkers = n_walkers
+        self.capacity = capacity
+        self.ground_y = ground_y
+        self.rows = 0
+        self.cols = {name: self._open(name, capacity, 'w+') for name in COLUMNS}
+    
+    def _file(self, name):
+        return os.path.join(self.path, name + '.bin')
+    
+    def _open(self, name, rows, mode):
+        dtype, shape = COLUMNS[name]
+        return np.memmap(self._file(name), dtype=dtype, mode=mode,
+                         shape=(rows, self.n_walkers) + shape)
+    
+    def _resize(self, rows):
+        for name in COLUMNS:
+            self.cols[name].flush()
+            self.cols[name] = None
+            with open(self._file(name), 'r+b') as f:
+                f.truncate(_nbytes(name, rows, self.n_walkers))
+            if rows:
+                self.cols[name] = self._open(name, rows, 'r+')
+        self.capacity = rows
+    
+    def record(self, obs, actions, rewards, render):
+        """Append one step: per-walker observations the actions were chosen
+        from, the actions, rewards and get_render_data() after the step."""
+        if self.rows == self.capacity:
+            self._resize(self.capacity * 2)
+        r = self.rows
+        cols = self.cols
+        cols['obs'][r] = obs
+        cols['action'][r] = actions
+        cols['reward'][r] = rewards
+        for name in RENDER_FIELDS:
+            cols[name][r] = [d[name] for d in render]
+        self.rows += 1
+    
+    def close(self, **meta):
+        self._resize(self.rows)
+        meta.update(rows=self.rows, n_walkers=self.n_walkers, ground_y=self.ground_y,
+                    columns={k: [d, list(s)] for k, (d, s) in COLUMNS.items()})
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    """Read-only memmap view of a recording; nothing is loaded until sliced."""
+    
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.rows = self.meta['rows']
+        self.n_walkers = self.meta['n_walkers']
+        self.cols = {}
+        for name, (dtype, shape) in self.meta['columns'].items():
+            full = (self.rows, self.n_walkers) + tuple(shape)
+            if self.rows:
+                self.cols[name] = np.memmap(os.path.join(path, name + '.bin'),
+                                            dtype=dtype, mode='r', shape=full)
+            else:
+                self.cols[name] = np.zeros(full, dtype=dtype)
+    
+    def __getitem__(self, name):
+        return self.cols[name]
+    
+    def episodes(self, walker=0):
+        """(start, stop) row ranges of each episode of one walker."""
+        starts = np.flatnonzero(self.cols['steps'][:, walker] == 1)
+        if self.rows and (len(starts) == 0 or starts[0] != 0):
+            starts = np.concatenate([[0], starts])
+        stops = np.append(starts[1:], self.rows)
+        return list(zip(starts.tolist(), stops.tolist()))
+    
+    def render_data(self, row, walker=0):
+        """Rebuild the Walker.get_render_data() dict for one recorded step."""
+        d = {name: self.cols[name][row, walker].item() for name in RENDER_FIELDS
+             if name not in POINT_FIELDS}
+        for name in POINT_FIELDS:
+            d[name] = tuple(self.cols[name][row, walker].tolist())
+        d['ground_y'] = self.meta['ground_y']
+        return d
+    
+    def iter_chunks(self, name, chunk=1 << 16):
+        """Scan a column in fixed-size row chunks (bounded memory)."""
+        col = self.cols[name]
+        for start in range(0, self.rows, chunk):
+            yield col[start:start + chunk]
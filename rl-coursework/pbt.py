@@ -0,0 +1,138 @@
+"""Population-based training for Walker - K agents in parallel processes."""
+import multiprocessing as mp
+import numpy as np
+from environments.walker import Walker
+from agents.ppo import PPOAgent
+from agents.rollout import RolloutCollector
+
+NUM_WALKERS = 6
+RAY_STEP = 0.01  # ray speed added per episode (same curriculum as train_walker)
+
+
+def run_episodes(collector, pending, start, n, base_ray_speed):
+    """Collect rollouts until n metrics entries of NUM_WALKERS finished
+    episodes each are ready, learning after every rollout (as in
+    train_walker). Leftover episodes stay in `pending` for the next call."""
+    stats = []
+    while len(stats) < n:
+        collector.ray_speed = base_ray_speed + (start + len(stats)) * RAY_STEP
+        collector.collect()
+        collector.agent.learn()
+        pending += collector.pop_episodes()
+        while len(pending) >= NUM_WALKERS and len(stats) < n:
+            stats.append(RolloutCollector.summarize(pending[:NUM_WALKERS]))
+            del pending[:NUM_WALKERS]
+    return stats
+
+
+def _worker(conn, seed, hp, horizon):
+    """Owns one agent and its walkers; executes commands from the controller."""
+    np.random.seed(seed)
+    envs = [Walker(ray_base_speed=hp['ray_speed']) for _ in range(NUM_WALKERS)]
+    agent = PPOAgent(envs[0].state_dim, envs[0].action_dim,
+                     lr=hp['lr'], clip_eps=hp['clip_eps'])
+    collector = RolloutCollector(envs, agent, horizon, hp['ray_speed'])
+    pending = []
+
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == 'train':
+            start, n = arg
+            conn.send(run_episodes(collector, pending, start, n, hp['ray_speed']))
+        elif cmd == 'get':
+            conn.send((agent.get_params(), dict(hp)))
+        elif cmd == 'set':
+            params, hp = arg
+            agent.set_params(params)
+            agent.lr = hp['lr']
+            agent.clip_eps = hp['clip_eps']
+        elif cmd == 'close':
+            break
+    conn.close()
+
+
+def _explore(hp, rng):
+    """Perturb hyperparameters of a copied member."""
+    return {
+        'lr': float(np.clip(hp['lr'] * rng.choice([0.8, 1.25]), 1e-5, 1e-2)),
+        'clip_eps': float(np.clip(hp['clip_eps'] * rng.choice([0.8, 1.25]), 0.05, 0.5)),
+        'ray_speed': float(max(0.5, hp['ray_speed'] * rng.choice([0.9, 1.1]))),
+    }
+
+
+def train_pbt(episodes=300, population=4, interval=10, frac=0.25, seed=0, horizon=128):
+    """Train a population; every `interval` episodes the bottom `frac`
+    copies weights of the top `frac` (exploit) and perturbs lr, clip_eps
+    and ray speed (explore). Workers collect fixed-horizon rollouts of
+    `horizon` steps per walker. Returns the best agent and metrics."""
+    # The best member is picked from a ranking, so at least one round must run
+    if episodes < 1 or population < 1 or interval < 1:
+        raise ValueError(f"episodes, population and interval must be >= 1, "
+                         f"got {episodes}, {population}, {interval}")
+    rng = np.random.default_rng(seed)
+    hps = [{'lr': 5e-4, 'clip_eps': 0.2, 'ray_speed': 1.0}]
+    hps += [_explore(hps[0], rng) for _ in range(population - 1)]
+
+    conns, procs = [], []
+    for i, hp in enumerate(hps):
+        parent, child = mp.Pipe()
+        proc = mp.Process(target=_worker, args=(child, seed + i, hp, horizon), daemon=True)
+        proc.start()
+        conns.append(parent)
+        procs.append(proc)
+
+    metrics = {'rewards': [], 'best_dist': [], 'avg_dist': [], 'ray_speeds': [],
+               'leaderboard': []}
+    n_cut = max(1, int(population * frac))
+
+    try:
+        for start in range(0, episodes, interval):
+            n = min(interval, episodes - start)
+            for conn in conns:
+                conn.send(('train', (start, n)))
+            results = [conn.recv() for conn in conns]
+
+            # Per-episode metrics: population best / mean
+            for k in range(n):
+                eps = [r[k] for r in results]
+                top = max(eps, key=lambda e: e['best_dist'])
+                metrics['rewards'].append(float(np.mean([e['reward'] for e in eps])))
+                metrics['best_dist'].append(top['best_dist'])
+                metrics['avg_dist'].append(float(np.mean([e['avg_dist'] for e in eps])))
+                metrics['ray_speeds'].append(top['ray_speed'])
+
+            scores = [np.mean([e['best_dist'] for e in r]) for r in results]
+            ranking = [int(i) for i in np.argsort(scores)[::-1]]
+            metrics['leaderboard'].append({
+                'episode': start + n,
+                'ranking': [{'member': i, 'score': float(scores[i]), **hps[i]} for i in ranking],
+            })
+
+            best = ranking[0]
+            print(f"Ep {start+n}: Leader #{best} {scores[best]/100:.1f}m "
+                  f"(lr={hps[best]['lr']:.1e}, clip={hps[best]['clip_eps']:.2f}, "
+                  f"ray={hps[best]['ray_speed']:.2f})")
+
+            if start + n >= episodes:
+                break
+
+            # Exploit + explore
+            for loser in ranking[-n_cut:]:
+                src = ranking[int(rng.integers(n_cut))]
+                conns[src].send(('get', None))
+                params, hp = conns[src].recv()
+                hps[loser] = _explore(hp, rng)
+                conns[loser].send(('set', (params, hps[loser])))
+
+        conns[ranking[0]].send(('get', None))
+        params, hp = conns[ranking[0]].recv()
+    finally:
+        for conn in conns:
+            conn.send(('close', None))
+        for proc in procs:
+            proc.join()
+
+    env = Walker()
+    agent = PPOAgent(env.state_dim, env.action_dim, lr=hp['lr'], clip_eps=hp['clip_eps'])
+    agent.set_params(params)
+    return agent, metrics
@@ -0,0 +1,11 @@
+"""pbt workers driven by RolloutCollector, end to end."""
+from pbt import train_pbt
+
+
+def test_train_pbt_collects_fixed_horizon_rollouts():
+    agent, metrics = train_pbt(episodes=3, population=2, interval=2, horizon=64)
+    
+    assert len(metrics['best_dist']) == 3
+    assert len(metrics['leaderboard']) == 2
+    assert all(e['ranking'] for e in metrics['leaderboard'])
+    assert agent.get_params()
@@ -0,0 +1,21 @@
+"""train_walker.train() end to end with a headless pygame display."""
+import os
+import train_walker
+from environments.trajectory import TrajectoryReader
+
+
+def test_record_dir_receives_recording(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    # save_model() writes models/ and logs/ relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'models').mkdir()
+    (tmp_path / 'logs').mkdir()
+    record_dir = str(tmp_path / 'run')
+    
+    train_walker.train(episodes=1, delay=1, horizon=32, record_dir=record_dir)
+    
+    assert os.path.exists(os.path.join(record_dir, 'meta.json'))
+    reader = TrajectoryReader(record_dir)
+    assert reader.rows > 0
+    assert reader.n_walkers == train_walker.NUM_WALKERS
+    assert f"to {record_dir}" in capsys.readouterr().out
@@ -0,0 +1,47 @@
+"""Offline Q-Learning: retrain a GridWorld Q-table from recorded transition logs."""
+import argparse
+import time
+from environments.gridworld import GridWorld
+from agents.qlearning import QLearningAgent
+from agents.transitions import load_transitions
+
+
+def greedy_rollout(env, agent, max_steps=100):
+    """Follow the greedy policy once; returns (reached_goal, steps)."""
+    state = env.reset()
+    for step in range(max_steps):
+        state, reward, done = env.step(agent.choose_action(state, training=False))
+        if done:
+            return reward == 10, step + 1
+    return False, max_steps
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('logs', nargs='+', help='transition files from train_visual.py --record')
+    p.add_argument('--alpha', type=float, default=0.5)
+    p.add_argument('--gamma', type=float, default=0.99)
+    p.add_argument('--epochs', type=int, default=200)
+    p.add_argument('--size', type=int, default=5)
+    p.add_argument('--out', default='models/gridworld_q.npy')
+    args = p.parse_args()
+    
+    data = load_transitions(*args.logs)
+    env = GridWorld(size=args.size)
+    agent = QLearningAgent(env.n_states, env.n_actions, args.alpha, args.gamma)
+    
+    t0 = time.perf_counter()
+    agent.learn_batch(data['state'], data['action'], data['reward'],
+                      data['next_state'], data['done'], epochs=args.epochs)
+    elapsed = time.perf_counter() - t0
+    
+    success, steps = greedy_rollout(env, agent)
+    print(f"Trained on {len(data)} transitions x {args.epochs} epochs in {elapsed:.2f}s")
+    print(f"Greedy policy: {'reached goal' if success else 'failed'} in {steps} steps")
+    
+    agent.save(args.out)
+    print(f"Saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
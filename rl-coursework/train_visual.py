@@ -5,6 +5,7 @@ import numpy as np
 import pygame
 from environments.gridworld import GridWorld
 from agents.qlearning import QLearningAgent
+from agents.transitions import TransitionRecorder
 
 # Colors
 BLACK = (20, 20, 20)
@@ -19,9 +20,10 @@ CELL_SIZE = 100
 INFO_HEIGHT = 150
 
 class VisualTrainer:
-    def __init__(self, env, agent, episodes, delay=50):
+    def __init__(self, env, agent, episodes, delay=50, recorder=None):
         self.env = env
         self.agent = agent
+        self.recorder = recorder
         self.episodes = episodes
         self.delay = delay
         
@@ -131,6 +133,8 @@ class VisualTrainer:
                 action = self.agent.choose_action(state)
                 next_state, reward, done = self.env.step(action)
                 self.agent.learn(state, action, reward, next_state, done)
+                if self.recorder:
+                    self.recorder.record(state, action, reward, next_state, done)
                 
                 state = next_state
                 total_reward += reward
@@ -153,6 +157,9 @@ class VisualTrainer:
         pygame.quit()
     
     def save_results(self):
+        if self.recorder:
+            self.recorder.close()
+            print(f"Recorded {self.recorder.count} transitions to {self.recorder.path}")
         self.agent.save('models/gridworld_q.npy')
         with open('logs/gridworld_metrics.json', 'w') as f:
             json.dump(self.metrics, f)
@@ -165,12 +172,17 @@ def main():
     parser.add_argument('--gamma', type=float, default=0.99)
     parser.add_argument('--epsilon', type=float, default=0.1)
     parser.add_argument('--delay', type=int, default=50)
+    parser.add_argument('--planning', type=int, default=0, help='Dyna-Q planning updates per step')
+    parser.add_argument('--prioritized', action='store_true', help='use prioritized sweeping')
+    parser.add_argument('--record', default=None, help='append transitions to this binary log')
     args = parser.parse_args()
     
     env = GridWorld()
-    agent = QLearningAgent(env.n_states, env.n_actions, args.alpha, args.gamma, args.epsilon)
+    agent = QLearningAgent(env.n_states, env.n_actions, args.alpha, args.gamma, args.epsilon,
+                           planning_steps=args.planning, prioritized=args.prioritized)
     
-    trainer = VisualTrainer(env, agent, args.episodes, args.delay)
+    recorder = TransitionRecorder(args.record) if args.record else None
+    trainer = VisualTrainer(env, agent, args.episodes, args.delay, recorder)
     trainer.train()
 
 if __name__ == '__main__':
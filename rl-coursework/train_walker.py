@@ -4,7 +4,9 @@ import json
 import numpy as np
 import pygame
 from environments.walker import Walker
+from environments.trajectory import TrajectoryWriter
 from agents.ppo import PPOAgent
+from agents.rollout import RolloutCollector
 
 # Colors
 BG = (25, 25, 35)
@@ -141,35 +143,25 @@ class Visualizer:
         self.screen.blit(self.font.render(ctrl, True, (100, 100, 110)), (10, self.h - 22))
 
 
-def train(episodes=300, delay=5):
+def train(episodes=300, delay=5, horizon=128, record_dir=None):
     # Fast ray, no adaptation
     ray_speed = 1.0
     
     envs = [Walker(ray_base_speed=ray_speed) for _ in range(NUM_WALKERS)]
     agent = PPOAgent(envs[0].state_dim, envs[0].action_dim, lr=5e-4)
+    recorder = TrajectoryWriter(record_dir, NUM_WALKERS) if record_dir else None
+    collector = RolloutCollector(envs, agent, horizon, ray_speed, recorder)
     viz = Visualizer()
     
     metrics = {'rewards': [], 'best_dist': [], 'avg_dist': [], 'ray_speeds': []}
     running = True
     paused = False
+    ep = 0
+    pending = []
     
-    for ep in range(episodes):
-        if not running:
-            break
-        
-        # Ray gets faster each episode
-        ray_speed = 1.0 + ep * 0.01
-        for env in envs:
-            env.set_ray_speed(ray_speed)
-        
-        states = [e.reset() for e in envs]
-        total_rewards = [0] * NUM_WALKERS
-        viz.cam_x = 0
-        
-        while any(not e.fallen and not e.caught_by_ray and e.steps < 800 for e in envs):
-            if not running:
-                break
-            
+    def on_step():
+        nonlocal running, paused, delay
+        while running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
@@ -185,52 +177,41 @@ def train(episodes=300, delay=5):
                     elif event.key == pygame.K_MINUS:
                         delay = min(30, delay + 1)
             
-            if paused:
-                render_data = [e.get_render_data() for e in envs]
-                best_idx = max(range(NUM_WALKERS), key=lambda i: envs[i].x)
-                viz.draw(render_data, best_idx, ep + 1, metrics, ray_speed, True)
-                pygame.time.wait(50)
-                continue
-            
-            for i, (env, state) in enumerate(zip(envs, states)):
-                if env.fallen or env.caught_by_ray or env.steps >= 800:
-                    continue
-                
-                action, log_p = agent.choose_action(state)
-                val = agent.get_value(state)
-                next_state, reward, done = env.step(action)
-                agent.store(state, action, reward, log_p, val, done)
-                
-                states[i] = next_state
-                total_rewards[i] += reward
-            
             render_data = [e.get_render_data() for e in envs]
-            best_idx = max(range(NUM_WALKERS), 
-                          key=lambda i: envs[i].x if not envs[i].fallen and not envs[i].caught_by_ray else -1000)
-            viz.draw(render_data, best_idx, ep + 1, metrics, ray_speed)
-            pygame.time.wait(delay)
-        
+            best_idx = max(range(NUM_WALKERS), key=lambda i: envs[i].x)
+            viz.draw(render_data, best_idx, ep + 1, metrics, collector.ray_speed, paused)
+            if not paused:
+                pygame.time.wait(delay)
+                break
+            pygame.time.wait(50)
+        return running
+    
+    while running and ep < episodes:
+        # Ray gets faster each episode; walkers pick it up on their next reset
+        collector.ray_speed = 1.0 + ep * 0.01
+        collector.collect(on_step)
         agent.learn()
         
-        distances = [e.x - e.start_x for e in envs]
-        metrics['rewards'].append(sum(total_rewards) / NUM_WALKERS)
-        metrics['best_dist'].append(max(distances))
-        metrics['avg_dist'].append(sum(distances) / NUM_WALKERS)
-        metrics['ray_speeds'].append(ray_speed)
-        
-        best_d = max(distances) / 100
-        avg_d = sum(distances) / NUM_WALKERS / 100
-        color = GREEN if best_d > 4 else YELLOW if best_d > 2 else RED
-        txt = f"Ep {ep+1}: Best {best_d:.1f}m  Avg {avg_d:.1f}m"
-        t = viz.font_big.render(txt, True, color)
-        viz.screen.blit(t, (viz.w // 2 - 110, viz.h // 2))
-        pygame.display.flip()
-        pygame.time.wait(60)
-        
-        if (ep + 1) % 5 == 0:
-            record = max(metrics['best_dist']) / 100
-            print(f"Ep {ep+1}: Best={best_d:.1f}m, Avg={avg_d:.1f}m, Record={record:.1f}m, Ray={ray_speed:.2f}")
+        # Every NUM_WALKERS finished episodes make one metrics entry
+        pending += collector.pop_episodes()
+        while len(pending) >= NUM_WALKERS and ep < episodes:
+            s = RolloutCollector.summarize(pending[:NUM_WALKERS])
+            pending = pending[NUM_WALKERS:]
+            metrics['rewards'].append(s['reward'])
+            metrics['best_dist'].append(s['best_dist'])
+            metrics['avg_dist'].append(s['avg_dist'])
+            metrics['ray_speeds'].append(s['ray_speed'])
+            ep += 1
+            
+            if ep % 5 == 0:
+                best_d = s['best_dist'] / 100
+                avg_d = s['avg_dist'] / 100
+                record = max(metrics['best_dist']) / 100
+                print(f"Ep {ep}: Best={best_d:.1f}m, Avg={avg_d:.1f}m, Record={record:.1f}m, Ray={s['ray_speed']:.2f}")
     
+    if recorder:
+        recorder.close(ray_speeds=metrics['ray_speeds'])
+        print(f"Recorded {recorder.rows} steps x {NUM_WALKERS} walkers to {record_dir}")
     save_model(agent, metrics)
     pygame.quit()
 
@@ -247,4 +228,24 @@ if __name__ == '__main__':
     p = argparse.ArgumentParser()
     p.add_argument('--episodes', type=int, default=300)
     p.add_argument('--delay', type=int, default=5)
-    train(**vars(p.parse_args()))
+    p.add_argument('--horizon', type=int, default=128, help='steps per walker per update')
+    p.add_argument('--record', default=None, help='directory for a memory-mapped trajectory recording')
+    p.add_argument('--pbt', type=int, default=0, help='population size for PBT (0 = off)')
+    p.add_argument('--pbt-interval', type=int, default=10, help='episodes between exploit/explore')
+    p.add_argument('--actors', type=int, default=0, help='local actor processes for distributed PPO (0 = off)')
+    p.add_argument('--port', type=int, default=0, help='learner gRPC port; with --actors 0 it waits for external actors')
+    p.add_argument('--batch-steps', type=int, default=0, help='steps per PPO update (0 = one rollout per actor)')
+    p.add_argument('--max-lag', type=int, default=2, help='policy versions a rollout may lag and still be used')
+    args = p.parse_args()
+    
+    if args.pbt:
+        from pbt import train_pbt
+        agent, metrics = train_pbt(args.episodes, args.pbt, args.pbt_interval, horizon=args.horizon)
+        save_model(agent, metrics)
+    elif args.actors or args.port:
+        from distributed import train_distributed
+        agent, metrics = train_distributed(args.episodes, args.actors, args.horizon, args.port,
+                                           args.batch_steps, args.max_lag)
+        save_model(agent, metrics)
+    else:
+        train(args.episodes, args.delay, args.horizon, args.record)